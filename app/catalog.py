@@ -0,0 +1,491 @@
+"""
+Compact product catalog for the e-shop.
+This module stores large catalogs in columnar arrays, offers slotted products
+and indexes products for search.
+"""
+
+import bisect
+import threading
+import weakref
+from array import array
+
+from app.inventory import DEFAULT_INVENTORY, Inventory
+
+
+class _ProductBehavior:
+    """Availability and buying shared by the compact product types."""
+
+    __slots__ = ()
+    name: str
+    inventory: Inventory
+
+    def is_available(self, requested_amount):
+        """
+        Check if the requested amount of product is available.
+
+        Args:
+            requested_amount: Amount of product requested
+
+        Returns:
+            bool: True if requested amount is available, False otherwise
+
+        Raises:
+            ValueError: If requested_amount cannot be converted to an integer
+        """
+        try:
+            requested = int(requested_amount)
+        except Exception as exc:
+            raise ValueError("requested_amount must be an integer") from exc
+        return self.inventory.is_available(self, requested)
+
+    def buy(self, requested_amount):
+        """
+        Reduce the available amount of product by the requested amount.
+
+        Args:
+            requested_amount: Amount of product to buy
+
+        Raises:
+            ValueError: If not enough product is available
+        """
+        self.inventory.take(self, int(requested_amount))
+
+    def __eq__(self, other):
+        """Check if two products are equal based on their names."""
+        return isinstance(other, _ProductBehavior) and self.name == other.name
+
+    def __ne__(self, other):
+        """Check if two products are not equal."""
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        """Generate hash based on product name."""
+        return hash(self.name)
+
+    def __str__(self):
+        """Return string representation of the product."""
+        return self.name
+
+
+class SlottedProduct(_ProductBehavior):
+    """
+    Standalone product without a per-instance __dict__.
+
+    Behaves like Product but its attributes are fixed, so it needs less
+    memory.
+
+    Attributes:
+        name: Name of the product
+        price: Price of the product
+        available_amount: Number of items available in stock
+        inventory: Inventory that owns stock changes
+    """
+
+    __slots__ = ("name", "price", "available_amount", "inventory")
+
+    def __init__(self, name, price, available_amount, inventory=None):
+        """
+        Initialize a new SlottedProduct instance.
+
+        Args:
+            name: Name of the product
+            price: Price of the product
+            available_amount: Number of items available in stock
+            inventory: Inventory that owns stock changes, defaults to the shared one
+
+        Raises:
+            ValueError: If available_amount cannot be converted to an integer
+        """
+        self.inventory = inventory or DEFAULT_INVENTORY
+        self.name = name
+        self.price = float(price)
+        try:
+            self.available_amount = int(available_amount)
+        except Exception as exc:
+            raise ValueError("available_amount must be an integer") from exc
+
+    def __repr__(self):
+        """Return a debug representation of the product."""
+        return (
+            f"SlottedProduct(name={self.name!r}, price={self.price!r}, "
+            f"available_amount={self.available_amount!r})"
+        )
+
+
+class ProductView(_ProductBehavior):
+    """
+    Lightweight product backed by one row of a Catalog.
+
+    Reads and writes go straight to the catalog's columns, so a view holds no
+    data of its own and can be created and dropped freely.
+    """
+
+    __slots__ = ("_catalog", "_row")
+
+    def __init__(self, catalog, row):
+        """
+        Initialize a new ProductView instance.
+
+        Args:
+            catalog: The catalog that stores the product
+            row: Row of the product in the catalog
+        """
+        self._catalog = catalog
+        self._row = row
+
+    @property
+    def inventory(self):
+        """Inventory that owns stock changes of the catalog."""
+        return self._catalog.inventory
+
+    @property
+    def name(self):
+        """Name of the product."""
+        return self._catalog.names[self._row]
+
+    @property
+    def price(self):
+        """Price of the product."""
+        return self._catalog.prices[self._row]
+
+    @price.setter
+    def price(self, value):
+        self._catalog.prices[self._row] = float(value)
+
+    @property
+    def available_amount(self):
+        """Number of items available in stock."""
+        return self._catalog.stock[self._row]
+
+    @available_amount.setter
+    def available_amount(self, value):
+        self._catalog.stock[self._row] = int(value)
+
+    def __repr__(self):
+        """Return a debug representation of the product."""
+        return (
+            f"ProductView(name={self.name!r}, price={self.price!r}, "
+            f"available_amount={self.available_amount!r})"
+        )
+
+
+class Catalog:
+    """
+    Columnar store of products.
+
+    Names, prices and stock are kept in parallel columns, prices and stock in
+    typed arrays, so no object is kept per product and the columns can be
+    scanned without creating any.
+
+    Attributes:
+        names: Product names, one per row
+        prices: Product prices as an array of doubles
+        stock: Available amounts as an array of 64-bit integers
+        inventory: Inventory that owns stock changes of the products
+    """
+
+    def __init__(self, inventory=None):
+        """
+        Initialize an empty catalog.
+
+        Args:
+            inventory: Inventory that owns stock changes, defaults to the shared one
+        """
+        self.inventory = inventory or DEFAULT_INVENTORY
+        self.names = []
+        self.prices = array("d")
+        self.stock = array("q")
+        self._rows = {}
+
+    def add(self, name, price, available_amount):
+        """
+        Add a product to the catalog.
+
+        Args:
+            name: Name of the product
+            price: Price of the product
+            available_amount: Number of items available in stock
+
+        Returns:
+            ProductView: View of the new product
+
+        Raises:
+            ValueError: If the product is already in the catalog or
+                available_amount cannot be converted to an integer
+        """
+        if name in self._rows:
+            raise ValueError(f"Product {name} is already in the catalog")
+        try:
+            amount = int(available_amount)
+        except Exception as exc:
+            raise ValueError("available_amount must be an integer") from exc
+        row = len(self.names)
+        self.names.append(name)
+        self.prices.append(float(price))
+        self.stock.append(amount)
+        self._rows[name] = row
+        return ProductView(self, row)
+
+    def extend(self, products):
+        """
+        Add many products at once.
+
+        Args:
+            products: Iterable of (name, price, available_amount) tuples
+
+        Raises:
+            ValueError: If a product is already in the catalog
+        """
+        for name, price, available_amount in products:
+            self.add(name, price, available_amount)
+
+    def get(self, name):
+        """
+        Look a product up by name.
+
+        Args:
+            name: Name of the product
+
+        Returns:
+            ProductView: View of the product, None if it is not in the catalog
+        """
+        row = self._rows.get(name)
+        return None if row is None else ProductView(self, row)
+
+    def is_available(self, name, requested_amount):
+        """
+        Check availability by name without creating a view.
+
+        Args:
+            name: Name of the product
+            requested_amount: Amount of product requested
+
+        Returns:
+            bool: True if the product exists and the amount is available
+        """
+        row = self._rows.get(name)
+        return row is not None and self.stock[row] >= requested_amount
+
+    def __getitem__(self, name):
+        """Return the view of the named product or raise KeyError."""
+        return ProductView(self, self._rows[name])
+
+    def __contains__(self, name):
+        """Check if a product with this name is in the catalog."""
+        return name in self._rows
+
+    def __len__(self):
+        """Return the number of products in the catalog."""
+        return len(self.names)
+
+    def __iter__(self):
+        """Iterate over views of all products in catalog order."""
+        return (ProductView(self, row) for row in range(len(self.names)))
+
+
+class ProductIndex:
+    """
+    Search index over products by name, price range and availability.
+
+    The name index follows the products' name-based equality, the price index
+    is a sorted list searched with bisect and availability is a bitmap with
+    one bit per product. The index subscribes to the inventory, so every
+    stock change made through it updates the bitmap; stock assigned directly
+    needs a refresh() and price changes go through reprice(). The inventory
+    holds the index weakly: it is unsubscribed on close(), at the end of a
+    with block or once it is garbage collected.
+    """
+
+    def __init__(self, products=(), inventory=None):
+        """
+        Initialize a new ProductIndex instance.
+
+        Args:
+            products: Products to index
+            inventory: Inventory whose stock changes are followed,
+                defaults to the shared one
+        """
+        self.inventory = inventory or DEFAULT_INVENTORY
+        self._slots = {}
+        self._products = []
+        self._prices = []
+        self._by_price = []
+        self._in_stock = bytearray()
+        self._free = []
+        self._lock = threading.Lock()
+        for product in products:
+            self.add(product)
+        self._unsubscribe = self._follow(self.inventory)
+
+    def _follow(self, inventory):
+        index = weakref.ref(self)
+
+        def listener(product):
+            followed = index()
+            if followed is not None:
+                followed.refresh(product)
+
+        inventory.subscribe(listener)
+        return weakref.finalize(self, inventory.unsubscribe, listener)
+
+    def close(self):
+        """Stop following the inventory."""
+        self._unsubscribe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, product):
+        """
+        Add a product to the index.
+
+        Args:
+            product: The product to add
+
+        Raises:
+            ValueError: If a product with the same name is already indexed
+        """
+        with self._lock:
+            if product.name in self._slots:
+                raise ValueError(f"Product {product} is already indexed")
+            if self._free:
+                slot = self._free.pop()
+                self._products[slot] = product
+                self._prices[slot] = product.price
+            else:
+                slot = len(self._products)
+                self._products.append(product)
+                self._prices.append(product.price)
+                if slot % 8 == 0:
+                    self._in_stock.append(0)
+            self._slots[product.name] = slot
+            bisect.insort(self._by_price, (product.price, slot))
+            self._mark(slot, product.available_amount > 0)
+
+    def remove(self, product):
+        """
+        Remove a product from the index.
+
+        Args:
+            product: The product to remove
+        """
+        with self._lock:
+            slot = self._slots.pop(product.name, None)
+            if slot is None:
+                return
+            del self._by_price[self._price_position(slot)]
+            self._mark(slot, False)
+            self._products[slot] = None
+            self._free.append(slot)
+
+    def reprice(self, product, price):
+        """
+        Change the price of an indexed product.
+
+        Args:
+            product: The product to change
+            price: The new price
+        """
+        with self._lock:
+            slot = self._slots[product.name]
+            del self._by_price[self._price_position(slot)]
+            self._products[slot].price = self._prices[slot] = float(price)
+            bisect.insort(self._by_price, (self._prices[slot], slot))
+
+    def refresh(self, product):
+        """
+        Update the availability bit of a product from its available_amount.
+
+        Called by the inventory on every stock change; products that are not
+        indexed are ignored.
+
+        Args:
+            product: The changed product
+        """
+        with self._lock:
+            slot = self._slots.get(product.name)
+            if slot is not None:
+                self._mark(slot, self._products[slot].available_amount > 0)
+
+    def get(self, name):
+        """
+        Look a product up by name.
+
+        Args:
+            name: Name of the product
+
+        Returns:
+            The product, None if it is not indexed
+        """
+        slot = self._slots.get(name)
+        return None if slot is None else self._products[slot]
+
+    def price_range(self, low, high, in_stock_only=False):
+        """
+        Find products priced between low and high, both included.
+
+        Args:
+            low: Lowest price
+            high: Highest price
+            in_stock_only: Skip products that are out of stock
+
+        Returns:
+            list: Matching products ordered by price
+        """
+        with self._lock:
+            start = bisect.bisect_left(self._by_price, (low, -1))
+            end = bisect.bisect_right(self._by_price, (high, len(self._products)))
+            return [
+                self._products[slot]
+                for _, slot in self._by_price[start:end]
+                if not in_stock_only or self._is_marked(slot)
+            ]
+
+    def in_stock(self):
+        """
+        List the products that are in stock.
+
+        Returns:
+            list: Products with available_amount above zero
+        """
+        with self._lock:
+            return [
+                self._products[(position << 3) + bit]
+                for position, byte in enumerate(self._in_stock)
+                if byte
+                for bit in range(8)
+                if byte >> bit & 1
+            ]
+
+    def count_in_stock(self):
+        """Return the number of products that are in stock."""
+        with self._lock:
+            return bin(int.from_bytes(self._in_stock, "little")).count("1")
+
+    def is_in_stock(self, product):
+        """Check if an indexed product is in stock."""
+        slot = self._slots.get(product.name)
+        return slot is not None and self._is_marked(slot)
+
+    def __contains__(self, product):
+        """Check if a product with the same name is indexed."""
+        return product.name in self._slots
+
+    def __len__(self):
+        """Return the number of indexed products."""
+        return len(self._slots)
+
+    def _price_position(self, slot):
+        return bisect.bisect_left(self._by_price, (self._prices[slot], slot))
+
+    def _mark(self, slot, in_stock):
+        if in_stock:
+            self._in_stock[slot >> 3] |= 1 << (slot & 7)
+        else:
+            self._in_stock[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    def _is_marked(self, slot):
+        return bool(self._in_stock[slot >> 3] >> (slot & 7) & 1)
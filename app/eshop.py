@@ -3,12 +3,15 @@ E-commerce module providing functionality for an online shop.
 This module contains classes for products, shopping carts, orders, and shipments.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
+from decimal import Decimal
 from typing import Dict, List
-import uuid
 
+from services.ids import new_id
+from services.instrumentation import instrumented
 from services.service import ShippingService
+from app.inventory import DEFAULT_INVENTORY, OutOfStockError
 
 
 @dataclass()
@@ -27,7 +30,7 @@ class Product:
     name: str
     price: float
 
-    def __init__(self, name, price, available_amount):
+    def __init__(self, name, price, available_amount, inventory=None):
         """
         Initialize a new Product instance.
 
@@ -35,10 +38,12 @@ class Product:
             name: Name of the product
             price: Price of the product
             available_amount: Number of items available in stock
+            inventory: Inventory that owns stock changes, defaults to the shared one
 
         Raises:
             ValueError: If available_amount cannot be converted to an integer
         """
+        self.inventory = inventory or DEFAULT_INVENTORY
         self.name = name
         self.price = float(price)
         try:
@@ -63,7 +68,7 @@ class Product:
             requested = int(requested_amount)
         except Exception as exc:
             raise ValueError("requested_amount must be an integer") from exc
-        return self.available_amount >= requested
+        return self.inventory.is_available(self, requested)
 
     def buy(self, requested_amount):
         """
@@ -76,9 +81,7 @@ class Product:
             ValueError: If not enough product is available
         """
         requested = int(requested_amount)
-        if self.available_amount < requested:
-            raise ValueError("Not enough product available")
-        self.available_amount -= requested
+        self.inventory.take(self, requested)
 
     def __eq__(self, other):
         """Check if two products are equal based on their names."""
@@ -102,15 +105,43 @@ class ShoppingCart:
     """
     Represents a shopping cart containing products and their quantities.
 
+    The subtotal is maintained incrementally with exact decimal arithmetic.
+    Each line keeps the unit price it was added with until reprice() is called.
+
     Attributes:
         products: Dictionary mapping Product objects to their quantities
     """
 
     products: Dict[Product, int]
 
-    def __init__(self):
-        """Initialize an empty shopping cart."""
+    def __init__(self, inventory=None):
+        """
+        Initialize an empty shopping cart.
+
+        Args:
+            inventory: Inventory for products that do not keep their own stock,
+                defaults to the shared one
+        """
+        self.inventory = inventory or DEFAULT_INVENTORY
         self.products = {}
+        self._unit_prices = {}
+        self._subtotal = Decimal(0)
+        self._item_count = 0
+
+    @property
+    def subtotal(self):
+        """Exact total price of the cart, kept up to date by every change."""
+        return self._subtotal
+
+    @property
+    def line_count(self):
+        """Number of distinct products in the cart."""
+        return len(self.products)
+
+    @property
+    def item_count(self):
+        """Number of items in the cart over all lines."""
+        return self._item_count
 
     def contains_product(self, product):
         """
@@ -131,7 +162,23 @@ class ShoppingCart:
         Returns:
             float: The total price
         """
-        return sum(p.price * count for p, count in self.products.items())
+        return float(self._subtotal)
+
+    def reprice(self):
+        """
+        Take the current price of every product in the cart.
+
+        Returns:
+            Decimal: The new subtotal
+        """
+        self._unit_prices = {
+            product: Decimal(str(product.price)) for product in self.products
+        }
+        self._subtotal = sum(
+            (self._unit_prices[p] * count for p, count in self.products.items()),
+            Decimal(0),
+        )
+        return self._subtotal
 
     def add_product(self, product: Product, amount):
         """
@@ -154,7 +201,15 @@ class ShoppingCart:
             raise ValueError(
                 f"Product {product} has only {product.available_amount} items"
             )
+        if product in self.products:
+            # the line is replaced, so its old amount leaves the totals
+            self._subtotal -= self._unit_prices[product] * self.products[product]
+            self._item_count -= self.products[product]
+        unit_price = Decimal(str(product.price))
         self.products[product] = amt
+        self._unit_prices[product] = unit_price
+        self._subtotal += unit_price * amt
+        self._item_count += amt
 
     def remove_product(self, product):
         """
@@ -164,23 +219,56 @@ class ShoppingCart:
             product: The product to remove
         """
         if product in self.products:
-            del self.products[product]
+            amount = self.products.pop(product)
+            self._subtotal -= self._unit_prices.pop(product) * amount
+            self._item_count -= amount
 
+    @instrumented("ShoppingCart.submit_cart_order")
     def submit_cart_order(self):
         """
         Submit the cart as an order, reducing product availability.
 
+        Every line is reserved in one pass per inventory the products keep
+        their stock in, so either all of them are bought or the stock of none
+        of them changes.
+
         Returns:
             List[str]: List of product names in the order
+
+        Raises:
+            OutOfStockError: Listing every line that is not available
         """
-        product_ids = []
-        for product, count in self.products.items():
-            product.buy(count)
-            product_ids.append(str(product))
+        reservations = self._reserve_lines()
+        for inventory, reservation in reservations:
+            inventory.commit(reservation)
+        product_ids = [str(product) for product in self.products]
         self.products.clear()
+        self._unit_prices.clear()
+        self._subtotal = Decimal(0)
+        self._item_count = 0
 
         return product_ids
 
+    def _reserve_lines(self):
+        # Stock is held where each product keeps it, the cart's inventory is
+        # only the fallback; a failure releases what other inventories held.
+        groups = {}
+        for product, amount in self.products.items():
+            inventory = getattr(product, "inventory", None) or self.inventory
+            groups.setdefault(id(inventory), (inventory, {}))[1][product] = amount
+        reservations = []
+        unavailable = []
+        for inventory, lines in groups.values():
+            try:
+                reservations.append((inventory, inventory.reserve_all(lines)))
+            except OutOfStockError as exc:
+                unavailable.extend(exc.unavailable)
+        if unavailable:
+            for inventory, reservation in reservations:
+                inventory.release(reservation)
+            raise OutOfStockError(unavailable)
+        return reservations
+
 
 @dataclass()
 class Order:
@@ -195,12 +283,16 @@ class Order:
 
     cart: ShoppingCart
     shipping_service: ShippingService
-    order_id: str = str(uuid.uuid4())
+    order_id: str = field(default_factory=new_id)
 
+    @instrumented("Order.place_order")
     def place_order(self, shipping_type, due_date: datetime = None):
         """
         Place the order and create a shipping request.
 
+        With an idempotent shipping service the shipping is keyed by order id
+        and shipping type, so a retried call creates no second shipping.
+
         Args:
             shipping_type: Type of shipping to use
             due_date: Due date for the shipping, defaults to 3 seconds from now
@@ -211,11 +303,41 @@ class Order:
         if not due_date:
             due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
         product_ids = self.cart.submit_cart_order()
-        print(due_date)
         return self.shipping_service.create_shipping(
             shipping_type, product_ids, self.order_id, due_date
         )
 
+    @instrumented("Order.place_order_async")
+    async def place_order_async(self, shipping_type, due_date: datetime = None):
+        """
+        Place the order through an asynchronous shipping service.
+
+        Args:
+            shipping_type: Type of shipping to use
+            due_date: Due date for the shipping, defaults to 3 seconds from now
+
+        Returns:
+            The result of creating a shipping request
+        """
+        if not due_date:
+            due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
+        product_ids = self.cart.submit_cart_order()
+        return await self.shipping_service.create_shipping(
+            shipping_type, product_ids, self.order_id, due_date
+        )
+
+    def list_shipments(self):
+        """
+        List the shipments created for this order.
+
+        Returns:
+            List[Shipment]: Shipments of the order in the order they were created
+        """
+        return [
+            Shipment(shipping["shipping_id"], self.shipping_service)
+            for shipping in self.shipping_service.list_order_shippings(self.order_id)
+        ]
+
 
 @dataclass()
 class Shipment:
@@ -238,3 +360,26 @@ class Shipment:
             The status of the shipment
         """
         return self.shipping_service.check_status(self.shipping_id)
+
+    @staticmethod
+    def check_statuses(shipments):
+        """
+        Check the statuses of many shipments with one read per shipping service.
+
+        Args:
+            shipments: Shipments to check
+
+        Returns:
+            Dict[str, str]: Status of every shipment keyed by its shipping_id,
+            None for shipments that do not exist
+        """
+        shipping_ids_by_service = {}
+        for shipment in shipments:
+            shipping_ids_by_service.setdefault(shipment.shipping_service, []).append(
+                shipment.shipping_id
+            )
+
+        statuses = {}
+        for shipping_service, shipping_ids in shipping_ids_by_service.items():
+            statuses.update(shipping_service.check_statuses(shipping_ids))
+        return statuses
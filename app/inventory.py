@@ -0,0 +1,378 @@
+"""
+Inventory engine for the e-shop.
+This module serializes stock changes per product and tracks reservations.
+"""
+
+import heapq
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from services.repository import InventoryRepository, StockUnavailable
+
+
+class OutOfStockError(ValueError):
+    """
+    Raised when one or more lines of a multi-product reservation are unavailable.
+
+    Attributes:
+        unavailable: One dict per unavailable line with the product name,
+            the requested amount and the available amount
+    """
+
+    def __init__(self, unavailable: List[dict]):
+        self.unavailable = unavailable
+        details = ", ".join(
+            f"{line['product']} (requested {line['requested']}, "
+            f"available {line['available']})"
+            for line in unavailable
+        )
+        super().__init__(f"Not enough product available: {details}")
+
+
+@dataclass()
+class Reservation:
+    """
+    Stock held for a checkout until it is committed or released.
+
+    Attributes:
+        reservation_id: Unique identifier for the reservation
+        lines: Mapping of reserved products to reserved amounts
+        expires_at: time.monotonic() value after which the stock is given back
+    """
+
+    reservation_id: str
+    lines: Dict[object, int]
+    expires_at: float
+    committed: bool = field(default=False)
+
+
+class Inventory:
+    """
+    Owns every change of product stock.
+
+    Each product is guarded by one of a fixed number of striped locks, so
+    checkouts of different products do not wait for each other and no global
+    lock is needed. Reserved stock is taken out of the product's
+    available_amount right away and given back on release or expiry.
+    Subscribers are told about every change, so indexes over the products
+    stay current.
+    """
+
+    def __init__(self, stripes=64, reservation_ttl=900.0):
+        """
+        Initialize a new Inventory instance.
+
+        Args:
+            stripes: Number of locks the products are spread over
+            reservation_ttl: Seconds a reservation lives unless committed
+        """
+        self.reservation_ttl = reservation_ttl
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._reservations = {}
+        self._expiry = []
+        self._reservations_lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """
+        Call the listener with every product whose stock changes.
+
+        Args:
+            listener: Callable taking the changed product
+        """
+        # copied on write, so notifying needs no lock and a listener may
+        # unsubscribe while others are notified
+        self._listeners = self._listeners + [listener]
+
+    def unsubscribe(self, listener):
+        """Stop calling a listener added with subscribe."""
+        listeners = list(self._listeners)
+        listeners.remove(listener)
+        self._listeners = listeners
+
+    def lock_for(self, product):
+        """Return the lock that guards the stock of the product."""
+        return self._locks[hash(product) % len(self._locks)]
+
+    def is_available(self, product, requested_amount):
+        """
+        Check if the requested amount of product is available.
+
+        Args:
+            product: The product to check
+            requested_amount: Amount of product requested
+
+        Returns:
+            bool: True if requested amount is available, False otherwise
+        """
+        return product.available_amount >= requested_amount
+
+    def take(self, product, requested_amount):
+        """
+        Atomically reduce the available amount of product.
+
+        Args:
+            product: The product to take from
+            requested_amount: Amount of product to take
+
+        Raises:
+            ValueError: If not enough product is available
+        """
+        with self.lock_for(product):
+            if product.available_amount < requested_amount:
+                raise ValueError("Not enough product available")
+            product.available_amount -= requested_amount
+        self._notify(product)
+
+    def reserve(self, product, requested_amount, ttl=None):
+        """
+        Hold the requested amount of product for a later commit.
+
+        Args:
+            product: The product to reserve
+            requested_amount: Amount of product to reserve
+            ttl: Seconds until the reservation expires, defaults to reservation_ttl
+
+        Returns:
+            Reservation: The new reservation
+
+        Raises:
+            ValueError: If not enough product is available
+        """
+        self.release_expired()
+        self.take(product, requested_amount)
+        return self._track({product: requested_amount}, ttl)
+
+    def reserve_all(self, lines, ttl=None):
+        """
+        Hold stock for every line at once, or for none of them.
+
+        The locks of all involved products are taken in a fixed order, so two
+        checkouts over overlapping products can never deadlock.
+
+        Args:
+            lines: Mapping of products to requested amounts
+            ttl: Seconds until the reservation expires, defaults to reservation_ttl
+
+        Returns:
+            Reservation: The new reservation
+
+        Raises:
+            OutOfStockError: Listing every line that is not available
+        """
+        self.release_expired()
+        lines = {product: int(amount) for product, amount in lines.items()}
+        stripes = sorted({hash(product) % len(self._locks) for product in lines})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            unavailable = [
+                {
+                    "product": str(product),
+                    "requested": amount,
+                    "available": product.available_amount,
+                }
+                for product, amount in lines.items()
+                if product.available_amount < amount
+            ]
+            if unavailable:
+                raise OutOfStockError(unavailable)
+            for product, amount in lines.items():
+                product.available_amount -= amount
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
+
+        for product in lines:
+            self._notify(product)
+        return self._track(lines, ttl)
+
+    def commit(self, reservation):
+        """
+        Make the reserved stock change final.
+
+        Args:
+            reservation: The reservation to commit
+
+        Raises:
+            ValueError: If the reservation expired or was already released
+        """
+        self.release_expired()
+        with self._reservations_lock:
+            if self._reservations.pop(reservation.reservation_id, None) is None:
+                raise ValueError("Reservation has expired or was released")
+            reservation.committed = True
+
+    def release(self, reservation):
+        """
+        Give the reserved stock back.
+
+        Args:
+            reservation: The reservation to release
+
+        Returns:
+            bool: False if the reservation was already committed or released
+        """
+        with self._reservations_lock:
+            if self._reservations.pop(reservation.reservation_id, None) is None:
+                return False
+        self._restock(reservation.lines)
+        return True
+
+    def release_expired(self, now=None):
+        """
+        Give back the stock of every expired reservation.
+
+        Args:
+            now: time.monotonic() value to compare with, defaults to now
+
+        Returns:
+            int: Number of released reservations
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._reservations_lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, reservation_id = heapq.heappop(self._expiry)
+                reservation = self._reservations.pop(reservation_id, None)
+                if reservation is not None:
+                    expired.append(reservation)
+        for reservation in expired:
+            self._restock(reservation.lines)
+        return len(expired)
+
+    def _track(self, lines, ttl):
+        ttl = self.reservation_ttl if ttl is None else ttl
+        reservation = Reservation(str(uuid.uuid4()), lines, time.monotonic() + ttl)
+        with self._reservations_lock:
+            self._reservations[reservation.reservation_id] = reservation
+            heapq.heappush(
+                self._expiry, (reservation.expires_at, reservation.reservation_id)
+            )
+        return reservation
+
+    def _restock(self, lines):
+        for product, amount in lines.items():
+            with self.lock_for(product):
+                product.available_amount += amount
+            self._notify(product)
+
+    def _notify(self, product):
+        for listener in self._listeners:
+            listener(product)
+
+
+class PersistentInventory(Inventory):
+    """
+    Inventory whose stock is stored in DynamoDB, so every application process
+    sees the same amounts.
+
+    Products are keyed by name. The table rejects any decrement below zero,
+    and a multi-product reservation is written as one transaction. The
+    product's available_amount is only this process's view of the stock.
+    """
+
+    def __init__(self, repository=None, reservation_ttl=900.0):
+        """
+        Initialize a new PersistentInventory instance.
+
+        Args:
+            repository: InventoryRepository that stores the stock
+            reservation_ttl: Seconds a reservation lives unless committed
+        """
+        super().__init__(reservation_ttl=reservation_ttl)
+        self.repository = repository or InventoryRepository()
+
+    def register(self, *products):
+        """Store the current available_amount of every product as its stock."""
+        for product in products:
+            self.repository.set_stock(str(product), product.available_amount)
+
+    def is_available(self, product, requested_amount):
+        """
+        Check if the requested amount of product is available.
+
+        Recently read stock is served from the repository's local cache, the
+        final check happens when the stock is taken.
+
+        Args:
+            product: The product to check
+            requested_amount: Amount of product requested
+
+        Returns:
+            bool: True if requested amount is available, False otherwise
+        """
+        return self.repository.is_available(str(product), requested_amount)
+
+    def take(self, product, requested_amount):
+        """
+        Atomically reduce the stored stock of product.
+
+        Args:
+            product: The product to take from
+            requested_amount: Amount of product to take
+
+        Raises:
+            ValueError: If not enough product is available
+        """
+        try:
+            stock = self.repository.take(str(product), requested_amount)
+        except StockUnavailable as exc:
+            product.available_amount = exc.available[str(product)]
+            self._notify(product)
+            raise ValueError("Not enough product available") from exc
+        product.available_amount = stock
+        self._notify(product)
+
+    def reserve_all(self, lines, ttl=None):
+        """
+        Hold stock for every line at once, or for none of them.
+
+        Args:
+            lines: Mapping of products to requested amounts
+            ttl: Seconds until the reservation expires, defaults to reservation_ttl
+
+        Returns:
+            Reservation: The new reservation
+
+        Raises:
+            OutOfStockError: Listing every line that is not available
+        """
+        self.release_expired()
+        lines = {product: int(amount) for product, amount in lines.items()}
+        try:
+            self.repository.take_all(
+                {str(product): amount for product, amount in lines.items()}
+            )
+        except StockUnavailable as exc:
+            unavailable = []
+            for product, amount in lines.items():
+                if str(product) in exc.available:
+                    product.available_amount = exc.available[str(product)]
+                    unavailable.append(
+                        {
+                            "product": str(product),
+                            "requested": amount,
+                            "available": product.available_amount,
+                        }
+                    )
+            for product in lines:
+                self._notify(product)
+            raise OutOfStockError(unavailable) from exc
+
+        for product, amount in lines.items():
+            with self.lock_for(product):
+                product.available_amount -= amount
+            self._notify(product)
+        return self._track(lines, ttl)
+
+    def _restock(self, lines):
+        for product, amount in lines.items():
+            product.available_amount = self.repository.add_stock(str(product), amount)
+            self._notify(product)
+
+
+DEFAULT_INVENTORY = Inventory()
@@ -0,0 +1,85 @@
+"""
+Bulk pricing for the e-shop.
+This module re-prices and re-validates many shopping carts in vectorized passes.
+"""
+
+from dataclasses import dataclass, field
+from itertools import chain
+from operator import attrgetter
+from typing import List
+
+import numpy as np
+
+
+@dataclass()
+class CartCheck:
+    """
+    Result of pricing one cart.
+
+    Attributes:
+        total: Total price of the cart at the current product prices
+        available: True if every line of the cart is available
+        unavailable: Names of the products whose requested amount is not available
+    """
+
+    total: float
+    available: bool
+    unavailable: List[str] = field(default_factory=list)
+
+
+def check_carts(carts):
+    """
+    Price and validate many carts at once.
+
+    Price and stock are read once per distinct product into arrays indexed
+    by product, and every line refers to its product by index. Totals and
+    availability are then computed in a few NumPy passes over the lines
+    instead of one Python method call per line. Totals use the current
+    product prices in float arithmetic; ShoppingCart.reprice() takes the same
+    prices into a cart exactly.
+
+    Args:
+        carts: Shopping carts to check
+
+    Returns:
+        List[CartCheck]: One result per cart, in the order of carts
+    """
+    lines = [product for cart in carts for product in cart.products]
+    cart_count = len(carts)
+    line_count = len(lines)
+    if not line_count:
+        return [CartCheck(0.0, True) for _ in range(cart_count)]
+
+    amounts = chain.from_iterable(cart.products.values() for cart in carts)
+    quantities = np.fromiter(amounts, np.int64, line_count)
+    # products are told apart by identity, as the carts share the objects
+    identities = np.fromiter(map(id, lines), np.uintp, line_count)
+    _, first_lines, product_ids = np.unique(
+        identities, return_index=True, return_inverse=True
+    )
+    products = [lines[line] for line in first_lines.tolist()]
+    product_count = len(products)
+    product_prices = np.fromiter(
+        map(attrgetter("price"), products), np.float64, product_count
+    )
+    product_stock = np.fromiter(
+        map(attrgetter("available_amount"), products), np.int64, product_count
+    )
+    prices = product_prices[product_ids]
+    stock = product_stock[product_ids]
+    cart_ids = np.repeat(
+        np.arange(cart_count),
+        np.fromiter(map(len, map(attrgetter("products"), carts)), np.intp, cart_count),
+    )
+
+    totals = np.bincount(cart_ids, weights=prices * quantities, minlength=cart_count)
+    short = np.flatnonzero(stock < quantities)
+    short_lines = np.bincount(cart_ids[short], minlength=cart_count)
+
+    results = [
+        CartCheck(total, not missing)
+        for total, missing in zip(totals.tolist(), short_lines.tolist())
+    ]
+    for cart_id, line in zip(cart_ids[short].tolist(), short.tolist()):
+        results[cart_id].unavailable.append(str(lines[line]))
+    return results
@@ -0,0 +1,55 @@
+"""
+Measure the cost of showing the cart total after every change of a large cart,
+comparing a full rescan of the lines with the incrementally maintained subtotal.
+
+    python -m benchmarks.cart_totals --lines 10000
+"""
+
+import argparse
+import time
+
+from app.eshop import Product, ShoppingCart
+from app.inventory import Inventory
+
+
+def rescan_total(cart):
+    # what calculate_total did before the subtotal was maintained incrementally
+    return sum(p.price * count for p, count in cart.products.items())
+
+
+def run_session(products, total):
+    cart = ShoppingCart(inventory=products[0].inventory)
+    started = time.perf_counter()
+    for product in products:
+        cart.add_product(product, 2)
+        total(cart)
+    for product in products[::2]:
+        cart.remove_product(product)
+        total(cart)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=10000)
+    args = parser.parse_args()
+
+    inventory = Inventory()
+    products = [
+        Product(f"product_{i}", 9.99 + i % 100, 10, inventory=inventory)
+        for i in range(args.lines)
+    ]
+    changes = args.lines + len(products[::2])
+    for name, total in (
+        ("rescan", rescan_total),
+        ("incremental", ShoppingCart.calculate_total),
+    ):
+        elapsed = run_session(products, total)
+        print(
+            f"{name:>11} lines={args.lines:<6} {elapsed:8.3f}s "
+            f"{elapsed / changes * 1e6:8.1f}us per change"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare memory per SKU and iteration speed of the Product dataclass, the
+slotted SlottedProduct and the columnar Catalog.
+
+    python -m benchmarks.catalog --skus 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from app.catalog import Catalog, SlottedProduct
+from app.eshop import Product
+from app.inventory import Inventory
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, size, elapsed
+
+
+def timed(scan):
+    started = time.perf_counter()
+    result = scan()
+    return result, time.perf_counter() - started
+
+
+def products(store):
+    return store if isinstance(store, Catalog) else store.values()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--skus", type=int, default=500000)
+    args = parser.parse_args()
+
+    inventory = Inventory()
+
+    def rows():
+        # names and prices are created inside each build so they are measured
+        return ((f"sku_{i:08d}", 1.0 + i % 500 / 100, i % 7) for i in range(args.skus))
+
+    def build_catalog():
+        catalog = Catalog(inventory=inventory)
+        catalog.extend(rows())
+        return catalog
+
+    def build_index(product_type):
+        products = (product_type(*row, inventory=inventory) for row in rows())
+        return {product.name: product for product in products}
+
+    builds = (
+        ("dataclass", lambda: build_index(Product)),
+        ("slotted", lambda: build_index(SlottedProduct)),
+        ("catalog", build_catalog),
+    )
+    for name, build in builds:
+        store, size, elapsed = measure(build)
+        in_stock, scan = timed(
+            lambda: sum(1 for p in products(store) if p.available_amount)
+        )
+        print(
+            f"{name:>9} skus={args.skus:<8} {size / args.skus:7.1f} B/sku "
+            f"build {elapsed:6.2f}s  scan {scan:6.3f}s  in stock {in_stock}"
+        )
+        if isinstance(store, Catalog):
+            in_stock, scan = timed(lambda: sum(1 for s in store.stock if s))
+            print(f"{'columns':>9} skus={args.skus:<8} scan {scan:6.3f}s")
+        del store
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Measure ShippingRepository/ShippingPublisher construction and first-call latency
+with fresh boto3 clients for every construction (the old behaviour) and with the
+shared client registry from services.db.
+
+Run against LocalStack (docker-compose up -d) from the repository root:
+
+    python -m benchmarks.construction --rounds 50
+"""
+
+import argparse
+import statistics
+import time
+
+from services import db
+from services.publisher import ShippingPublisher
+from services.repository import ShippingRepository
+from services.schema import create_tables
+
+
+def construct_and_call():
+    started = time.perf_counter()
+    repository = ShippingRepository()
+    publisher = ShippingPublisher()
+    constructed = time.perf_counter()
+    repository.get_shipping("benchmark-missing-shipping")
+    publisher.client.get_queue_attributes(
+        QueueUrl=publisher.queue_url, AttributeNames=["QueueArn"]
+    )
+    return constructed - started, time.perf_counter() - constructed
+
+
+def measure(name, rounds, fresh_clients):
+    construction = []
+    first_call = []
+    for _ in range(rounds):
+        if fresh_clients:
+            db.reset_clients()
+        construct, call = construct_and_call()
+        construction.append(construct * 1000)
+        first_call.append(call * 1000)
+
+    print(
+        f"{name:>7}: construction median {statistics.median(construction):8.3f} ms, "
+        f"max {max(construction):8.3f} ms; "
+        f"first calls median {statistics.median(first_call):8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    create_tables(db.get_dynamodb_resource().meta.client)
+
+    measure("before", args.rounds, fresh_clients=True)
+    db.reset_clients()
+    measure("after", args.rounds, fresh_clients=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare the per-order create_shipping loop with the batched create_shippings path.
+
+Run against LocalStack (docker-compose up -d) from the repository root:
+
+    python -m benchmarks.create_shippings --orders 500
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from services.publisher import ShippingPublisher
+from services.repository import ShippingRepository
+from services.schema import create_tables
+from services.service import ShippingService
+
+
+def build_requests(count):
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+    return [
+        {
+            "shipping_type": shipping_type,
+            "product_ids": [f"bench_product_{i}"],
+            "order_id": f"bench_order_{i}",
+            "due_date": due_date,
+        }
+        for i in range(count)
+    ]
+
+
+def run_loop(service, requests):
+    for request in requests:
+        service.create_shipping(**request)
+
+
+def run_batch(service, requests):
+    results = service.create_shippings(requests)
+    failed = [result for result in results if result["error"]]
+    if failed:
+        print(f"  {len(failed)} orders failed, first error: {failed[0]['error']}")
+
+
+def measure(name, func, service, requests):
+    started = time.perf_counter()
+    func(service, requests)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:>8}: {elapsed:8.3f}s total, "
+        f"{elapsed / len(requests) * 1000:7.3f} ms/order, "
+        f"{len(requests) / elapsed:9.1f} orders/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200)
+    args = parser.parse_args()
+
+    repository = ShippingRepository()
+    create_tables(repository.resource.meta.client)
+    publisher = ShippingPublisher()
+    service = ShippingService(repository, publisher)
+
+    try:
+        measure("loop", run_loop, service, build_requests(args.orders))
+        measure("batch", run_batch, service, build_requests(args.orders))
+    finally:
+        publisher.client.purge_queue(QueueUrl=publisher.queue_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare exporting the shipping table with one scan segment against a parallel
+scan over several segments. Parallel segments pay off against a real endpoint,
+where every page is a network round trip; the memory backend shows the
+pipeline overhead only.
+
+    python -m benchmarks.export --backend localstack --items 5000 --segments 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from services import db
+from services.export import ShippingExporter
+from services.repository import ShippingRepository
+from services.schema import create_tables
+
+
+def seed(count):
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    ShippingRepository().create_shippings(
+        [
+            {
+                "shipping_type": "Нова Пошта",
+                "product_ids": [f"bench_product_{i}"],
+                "order_id": f"bench_order_{i}",
+                "due_date": due_date,
+            }
+            for i in range(count)
+        ],
+        "created",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=["memory", "localstack"], default="memory")
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    db.use_backend("memory" if args.backend == "memory" else "aws")
+    create_tables(db.get_client("dynamodb"))
+    seed(args.items)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "shippings.jsonl.gz")
+        for segments in (1, args.segments):
+            exporter = ShippingExporter(segments=segments, chunk_size=args.chunk_size)
+            started = time.perf_counter()
+            result = exporter.export(output)
+            elapsed = time.perf_counter() - started
+            print(
+                f"segments={segments:<3} items={result['items']:<7} "
+                f"chunks={result['chunks']:<5} {elapsed:8.3f}s "
+                f"{os.path.getsize(output) / 1024:8.0f}KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measure what instrumentation adds to an instrumented call: a bare function,
+the same function instrumented but disabled, and enabled with the in-memory
+and Prometheus exporters.
+
+    python -m benchmarks.instrumentation --calls 200000
+"""
+
+import argparse
+import time
+
+from services import instrumentation
+from services.instrumentation import MemoryExporter, PrometheusExporter
+
+
+def work(value):
+    return value + 1
+
+
+def run(func, calls):
+    started = time.perf_counter()
+    for value in range(calls):
+        func(value)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    traced = instrumentation.instrumented("work")(work)
+    cases = (
+        ("bare", work, ()),
+        ("disabled", traced, ()),
+        ("memory", traced, (MemoryExporter(),)),
+        ("prometheus", traced, (PrometheusExporter(),)),
+    )
+    for name, func, exporters in cases:
+        instrumentation.enable(*exporters)
+        elapsed = run(func, args.calls)
+        instrumentation.disable()
+        print(
+            f"{name:>10} calls={args.calls:<8} {elapsed:8.3f}s "
+            f"{elapsed / args.calls * 1e9:8.0f}ns per call"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measure how checkout throughput scales with thread count when stock changes go
+through the striped-lock Inventory, compared with a single global lock.
+
+    python -m benchmarks.inventory --threads 1 2 4 8 16 --checkouts 20000
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from app.eshop import Product
+from app.inventory import Inventory
+
+
+def run_checkouts(inventory, products, threads, checkouts):
+    per_thread = checkouts // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def checkout(seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(per_thread):
+            product = products[rng.randrange(len(products))]
+            reservation = inventory.reserve(product, 1)
+            inventory.commit(reservation)
+
+    workers = [
+        threading.Thread(target=checkout, args=(seed,)) for seed in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--checkouts", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    for name, stripes in (("global lock", 1), ("striped", 64)):
+        for threads in args.threads:
+            inventory = Inventory(stripes=stripes)
+            products = [
+                Product(f"product_{i}", 1.0, args.checkouts, inventory=inventory)
+                for i in range(args.products)
+            ]
+            throughput = run_checkouts(inventory, products, threads, args.checkouts)
+            print(f"{name:>11} threads={threads:<3} {throughput:10.0f} checkouts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare the legacy shipping item (comma-joined product ids, ISO dates) with the
+compact version 2 item: stored size, the write and read capacity units it
+costs, the time to build and decode it, and the due date check of
+process_shipping.
+
+    python -m benchmarks.items --products 1 10 100 1000
+"""
+
+import argparse
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeSerializer
+
+from services.items import decode_item, to_timestamp
+from services.repository import ShippingRepository
+
+_serializer = TypeSerializer()
+
+
+def legacy_item(product_ids, due_date):
+    # what build_item wrote before item version 2
+    created_date = datetime.now(timezone.utc)
+    return {
+        "shipping_id": "0192a4e0-3c1f-7cf3-9d2a-2b8f5c0e4a11",
+        "shipping_type": "Нова Пошта",
+        "order_id": "0192a4e0-3c1e-7a81-8d44-61a5b7f6e0c2",
+        "order_key": "0192a4e0-3c1e-7a81-8d44-61a5b7f6e0c2",
+        "product_ids": ",".join(product_ids),
+        "shipping_status": "in progress",
+        "created_date": created_date.isoformat(),
+        "created_day": created_date.strftime("%Y-%m-%d"),
+        "due_date": due_date.isoformat(),
+    }
+
+
+def _value_size(value):
+    # DynamoDB item size rules for the types shipping items use
+    kind, stored = next(iter(value.items()))
+    if kind == "S":
+        return len(stored.encode())
+    if kind == "N":
+        digits = len(stored.lstrip("-").replace(".", "").lstrip("0")) or 1
+        return math.ceil(digits / 2) + 1
+    if kind == "B":
+        return len(stored)
+    if kind == "L":
+        return 3 + sum(_value_size(element) + 1 for element in stored)
+    raise ValueError(f"Unsupported type {kind}")
+
+
+def item_size(item):
+    return sum(
+        len(name.encode()) + _value_size(_serializer.serialize(value))
+        for name, value in item.items()
+    )
+
+
+def as_stored(item):
+    # the types the resource returns: numbers as Decimal, bytes unchanged
+    return {
+        name: Decimal(value) if isinstance(value, int) else value
+        for name, value in item.items()
+    }
+
+
+def timed(func, item, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(item)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+    now = datetime.now(timezone.utc)
+    now_ts = to_timestamp(now)
+    for count in args.products:
+        product_ids = [f"catalog-product-{i:06d}" for i in range(count)]
+        for name, build, due_check in (
+            (
+                "legacy",
+                lambda: legacy_item(product_ids, due_date),
+                lambda item: datetime.fromisoformat(item["due_date"]) < now,
+            ),
+            (
+                "v2",
+                lambda: ShippingRepository.build_item(
+                    "Нова Пошта", product_ids, "order", "in progress", due_date
+                ),
+                lambda item: item["due_ts"] < now_ts,
+            ),
+        ):
+            item = build()
+            stored = as_stored(item)
+            size = item_size(item)
+            print(
+                f"{name:>6} products={count:<5} {size:7d}B "
+                f"wcu={math.ceil(size / 1024):<3} rcu={math.ceil(size / 4096):<2} "
+                f"build={timed(lambda _: build(), None, args.repeat) * 1e6:7.1f}us "
+                f"decode={timed(decode_item, stored, args.repeat) * 1e6:7.1f}us "
+                f"due check={timed(due_check, stored, args.repeat) * 1e9:6.0f}ns"
+            )
+
+
+if __name__ == "__main__":
+    main()
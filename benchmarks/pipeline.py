@@ -0,0 +1,283 @@
+"""
+Load-test the order-to-shipment pipeline:
+Order.place_order -> ShippingService.create_shipping -> process_shipping_batch.
+
+Orders are placed from a pool of threads at a configurable rate while consumer
+threads drain the queue. The run reports p50/p95/p99 latency per stage,
+end-to-end throughput and DynamoDB/SQS calls per order, and can write the
+result as JSON so that runs on different commits can be compared.
+
+    python -m benchmarks.pipeline --backend memory --orders 2000 --concurrency 16
+    python -m benchmarks.pipeline --backend localstack --orders 300 --output run.json
+    python -m benchmarks.pipeline --backend localstack --baseline run.json
+"""
+
+import argparse
+import json
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from app.eshop import Order, Product, ShoppingCart
+from services import db
+from services.publisher import ShippingPublisher
+from services.repository import ShippingRepository
+from services.schema import create_tables
+from services.service import ShippingService
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    def count(self, operation_name, **_):
+        with self._lock:
+            self.calls[operation_name] += 1
+
+    def __call__(self, model, **_):
+        self.count(model.name)
+
+
+class StageTimer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        return wrapper
+
+    def summary(self):
+        with self._lock:
+            return {
+                stage: summarize(samples) for stage, samples in self.samples.items()
+            }
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.50),
+        "p95_ms": percentile(ordered, 0.95),
+        "p99_ms": percentile(ordered, 0.99),
+        "max_ms": ordered[-1] if ordered else 0.0,
+    }
+
+
+def build_backend(name, counter):
+    # the memory backend runs the real repository and publisher on the
+    # in-process DynamoDB and SQS stand-ins
+    db.use_backend("memory" if name == "memory" else "aws")
+    repository = ShippingRepository()
+    create_tables(repository.resource.meta.client)
+    publisher = ShippingPublisher()
+    repository.resource.meta.client.meta.events.register("before-call.*.*", counter)
+    publisher.client.meta.events.register("before-call.*.*", counter)
+    return repository, publisher
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    counter = CallCounter()
+    timer = StageTimer()
+    repository, publisher = build_backend(args.backend, counter)
+    service = ShippingService(repository, publisher)
+    shipping_type = service.list_available_shipping_type()[0]
+
+    placed_at = {}
+    processed_at = {}
+    tracking_lock = threading.Lock()
+    processed = set()
+    done = threading.Event()
+
+    def complete(shipping_id):
+        # Called under tracking_lock once both timestamps are known; a worker
+        # may process a shipping before place_order has returned.
+        if shipping_id in processed:
+            return
+        processed.add(shipping_id)
+        timer.record("end_to_end", processed_at[shipping_id] - placed_at[shipping_id])
+        if len(processed) == args.orders:
+            done.set()
+
+    service.create_shipping = timer.timed("create_shipping", service.create_shipping)
+    process_shipping = service.process_shipping
+
+    def process_and_track(shipping_id, shipping=None):
+        started = time.perf_counter()
+        try:
+            return process_shipping(shipping_id, shipping)
+        finally:
+            finished = time.perf_counter()
+            timer.record("process_shipping", finished - started)
+            with tracking_lock:
+                processed_at.setdefault(shipping_id, finished)
+                if shipping_id in placed_at:
+                    complete(shipping_id)
+
+    service.process_shipping = process_and_track
+
+    def place_order(index):
+        product = Product(name=f"bench_product_{index}", price=10.0, available_amount=5)
+        cart = ShoppingCart()
+        cart.add_product(product, 1)
+        order = Order(cart, service, f"bench_order_{index}")
+        started = time.perf_counter()
+        shipping_id = order.place_order(
+            shipping_type, datetime.now(timezone.utc) + timedelta(minutes=10)
+        )
+        timer.record("place_order", time.perf_counter() - started)
+        with tracking_lock:
+            placed_at[shipping_id] = started
+            if shipping_id in processed_at:
+                complete(shipping_id)
+
+    # Long polls that come back empty only wait out WaitTimeSeconds; timing
+    # them would put the poll timeout into the batch percentiles, so they are
+    # counted separately.
+    polled = threading.local()
+    idle_polls = Counter()
+    poll_shipping_messages = publisher.poll_shipping_messages
+
+    def poll_and_count(*args, **kwargs):
+        messages = poll_shipping_messages(*args, **kwargs)
+        polled.count = len(messages)
+        return messages
+
+    publisher.poll_shipping_messages = poll_and_count
+
+    def consume():
+        while not done.is_set():
+            polled.count = 0
+            started = time.perf_counter()
+            try:
+                service.process_shipping_batch()
+            except Exception:  # pylint: disable=broad-except
+                timer.record("process_shipping_batch_error", 0)
+            finished = time.perf_counter()
+            if polled.count:
+                timer.record("process_shipping_batch", finished - started)
+            else:
+                with tracking_lock:
+                    idle_polls["idle"] += 1
+
+    consumers = [
+        threading.Thread(target=consume, daemon=True) for _ in range(args.consumers)
+    ]
+    started = time.perf_counter()
+    for consumer in consumers:
+        consumer.start()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for index in range(args.orders):
+            if args.rate:
+                delay = started + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(place_order, index)
+
+    drained = done.wait(args.timeout)
+    elapsed = time.perf_counter() - started
+    done.set()
+    for consumer in consumers:
+        consumer.join(15)
+    calls = dict(sorted(counter.calls.items()))
+    return {
+        "commit": git_commit(),
+        "backend": args.backend,
+        "orders": args.orders,
+        "processed": len(processed),
+        "drained": drained,
+        "concurrency": args.concurrency,
+        "consumers": args.consumers,
+        "rate": args.rate,
+        "duration_s": elapsed,
+        "throughput_orders_per_s": len(processed) / elapsed if elapsed else 0.0,
+        "stages": timer.summary(),
+        "idle_polls": idle_polls["idle"],
+        "calls": calls,
+        "calls_per_order": {name: count / args.orders for name, count in calls.items()},
+    }
+
+
+def print_report(result, baseline=None):
+    print(
+        f"{result['backend']} @ {result['commit']}: {result['processed']}/"
+        f"{result['orders']} orders in {result['duration_s']:.2f}s, "
+        f"{result['throughput_orders_per_s']:.1f} orders/s"
+    )
+    for stage, stats in sorted(result["stages"].items()):
+        line = (
+            f"  {stage:<28} n={stats['count']:<6} p50={stats['p50_ms']:8.2f}ms "
+            f"p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms"
+        )
+        old = (baseline or {}).get("stages", {}).get(stage)
+        if old and old["p95_ms"]:
+            line += f"  p95 {(stats['p95_ms'] / old['p95_ms'] - 1) * 100:+.1f}%"
+        print(line)
+    print(f"  {'idle polls':<28} n={result.get('idle_polls', 0)}")
+    for name, per_order in result["calls_per_order"].items():
+        print(f"  {name:<28} {per_order:.2f} calls/order")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=["memory", "localstack"], default="memory")
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--consumers", type=int, default=2)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="orders per second, 0 for unlimited"
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare")
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Re-price and re-validate many carts after a price update, comparing the
+per-line Python calls with the vectorized check_carts.
+
+    python -m benchmarks.pricing --carts 10000 --lines 20
+"""
+
+import argparse
+import random
+import time
+
+from app.eshop import Product, ShoppingCart
+from app.inventory import Inventory
+from app.pricing import check_carts
+
+
+def check_each(carts):
+    results = []
+    for cart in carts:
+        total = sum(p.price * amount for p, amount in cart.products.items())
+        unavailable = [
+            str(p) for p, amount in cart.products.items() if not p.is_available(amount)
+        ]
+        results.append((total, not unavailable, unavailable))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--carts", type=int, default=10000)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    inventory = Inventory()
+    products = [
+        Product(f"product_{i}", rng.uniform(1, 100), rng.randrange(50), inventory)
+        for i in range(args.products)
+    ]
+    carts = []
+    for _ in range(args.carts):
+        cart = ShoppingCart(inventory=inventory)
+        for product in rng.sample(products, args.lines):
+            cart.products[product] = rng.randrange(1, 5)
+        carts.append(cart)
+    for product in products:
+        product.price *= 1.1
+
+    for name, check in (("per line", check_each), ("vectorized", check_carts)):
+        elapsed = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            check(carts)
+            elapsed = min(elapsed, time.perf_counter() - started)
+        print(f"{name:>10} carts={args.carts:<6} lines={args.lines:<4} {elapsed:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
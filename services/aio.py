@@ -0,0 +1,312 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from boto3.dynamodb.conditions import Attr
+
+from .config import AWS_MAX_POOL_CONNECTIONS
+from .instrumentation import instrument
+from .items import due_before, due_not_before, to_timestamp
+from .publisher import ShippingPublisher
+from .repository import ShippingRepository, ShippingTransitionRejected
+from .service import ShippingService
+
+# boto3 has no native asyncio transport, so blocking calls run on a dedicated
+# pool sized to the HTTP connection pool. They never block the event loop and
+# never take slots from the loop's default executor.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=AWS_MAX_POOL_CONNECTIONS, thread_name_prefix="shipping-aio"
+            )
+    return _executor
+
+
+class _AsyncAdapter:
+    def __init__(self, executor=None):
+        self.executor = executor or get_executor()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # the worker runs in a copy of the caller's context, so spans recorded
+        # there keep the awaiting span as their parent
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+
+class AsyncShippingRepository(_AsyncAdapter):
+    def __init__(self, repository_factory=ShippingRepository, executor=None):
+        super().__init__(executor)
+        # DynamoDB resources are not thread-safe, so every executor thread
+        # works with its own repository.
+        self.repository_factory = repository_factory
+        self._local = threading.local()
+
+    def _repository(self):
+        repository = getattr(self._local, "repository", None)
+        if repository is None:
+            repository = self._local.repository = self.repository_factory()
+        return repository
+
+    async def _call(self, name, *args, **kwargs):
+        return await self._run(
+            lambda: getattr(self._repository(), name)(*args, **kwargs)
+        )
+
+    async def get_shipping(self, shipping_id):
+        return await self._call("get_shipping", shipping_id)
+
+    async def get_shippings(self, shipping_ids, attributes=None):
+        return await self._call("get_shippings", shipping_ids, attributes)
+
+    async def create_shipping(
+        self, shipping_type, product_ids, order_id, status, due_date
+    ):
+        return await self._call(
+            "create_shipping", shipping_type, product_ids, order_id, status, due_date
+        )
+
+    async def create_shippings(self, shippings, status):
+        return await self._call("create_shippings", shippings, status)
+
+    async def update_shipping_status(self, shipping_id, status, condition=None):
+        return await self._call(
+            "update_shipping_status", shipping_id, status, condition
+        )
+
+
+class AsyncShippingPublisher(_AsyncAdapter):
+    def __init__(self, publisher=None, executor=None):
+        super().__init__(executor)
+        # SQS clients are thread-safe and shared.
+        self.publisher = publisher or ShippingPublisher()
+
+    async def send_new_shipping(self, shipping_id):
+        return await self._run(self.publisher.send_new_shipping, shipping_id)
+
+    async def send_new_shippings(self, shipping_ids):
+        return await self._run(self.publisher.send_new_shippings, shipping_ids)
+
+    async def poll_shipping_messages(
+        self, batch_size=10, wait_time=10, visibility_timeout=None
+    ):
+        return await self._run(
+            self.publisher.poll_shipping_messages,
+            batch_size,
+            wait_time,
+            visibility_timeout,
+        )
+
+    async def delete_shippings(self, messages):
+        return await self._run(self.publisher.delete_shippings, messages)
+
+
+@instrument
+class AsyncShippingService:
+    SHIPPING_CREATED = ShippingService.SHIPPING_CREATED
+    SHIPPING_IN_PROGRESS = ShippingService.SHIPPING_IN_PROGRESS
+    SHIPPING_COMPLETED = ShippingService.SHIPPING_COMPLETED
+    SHIPPING_FAILED = ShippingService.SHIPPING_FAILED
+    ACTIVE_STATUSES = ShippingService.ACTIVE_STATUSES
+    REQUEST_KEYS = ShippingService.REQUEST_KEYS
+
+    list_available_shipping_type = staticmethod(
+        ShippingService.list_available_shipping_type
+    )
+    # Validation and result bookkeeping are shared with the sync service.
+    validate_shipping = ShippingService.validate_shipping
+    _validate_requests = ShippingService._validate_requests
+    _request_error = ShippingService._request_error
+    _record_written = ShippingService._record_written
+    _record_unpublished = ShippingService._record_unpublished
+    _cache_status = ShippingService._cache_status
+    _invalidate_status = ShippingService._invalidate_status
+
+    def __init__(self, repository, publisher, status_cache=None):
+        self.repository = repository
+        self.publisher = publisher
+        self.status_cache = status_cache
+
+    async def create_shipping(self, shipping_type, product_ids, order_id, due_date):
+        self.validate_shipping(shipping_type, due_date)
+
+        shipping_id = await self.repository.create_shipping(
+            shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date
+        )
+
+        # Publishing and the status update run side by side. The update only
+        # applies while the shipping is still created, so a worker that picks
+        # the message up first is never overwritten.
+        published, status_update = await asyncio.gather(
+            self.publisher.send_new_shipping(shipping_id),
+            self.repository.update_shipping_status(
+                shipping_id,
+                self.SHIPPING_IN_PROGRESS,
+                Attr("shipping_status").eq(self.SHIPPING_CREATED),
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(published, BaseException):
+            if not isinstance(status_update, BaseException):
+                await self._rollback_to_created(shipping_id)
+            raise published
+        if isinstance(status_update, ShippingTransitionRejected):
+            self._invalidate_status(shipping_id)
+        elif isinstance(status_update, BaseException):
+            raise status_update
+        else:
+            self._cache_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+
+        return shipping_id
+
+    async def create_shippings(self, requests):
+        results, accepted = self._validate_requests(requests)
+        if not accepted:
+            return results
+
+        shipping_ids = await self.repository.create_shippings(
+            [request for request, _ in accepted], self.SHIPPING_IN_PROGRESS
+        )
+        written = self._record_written(accepted, shipping_ids)
+
+        message_ids = await self.publisher.send_new_shippings(
+            [result["shipping_id"] for result in written]
+        )
+        await asyncio.gather(
+            *[
+                self.repository.update_shipping_status(
+                    result["shipping_id"], self.SHIPPING_CREATED
+                )
+                for result in self._record_unpublished(written, message_ids)
+            ]
+        )
+
+        return results
+
+    async def process_shipping_batch(self):
+        messages = await self.publisher.poll_shipping_messages()
+        shippings = await self.repository.get_shippings(
+            [message.shipping_id for message in messages], ["due_ts"]
+        )
+        outcomes = await asyncio.gather(
+            *[
+                self.process_shipping(
+                    message.shipping_id, shippings.get(message.shipping_id)
+                )
+                for message in messages
+            ],
+            return_exceptions=True,
+        )
+
+        result = []
+        processed = []
+        errors = []
+        for message, outcome in zip(messages, outcomes):
+            if isinstance(outcome, ShippingTransitionRejected):
+                processed.append(message)
+            elif isinstance(outcome, BaseException):
+                errors.append(outcome)
+            else:
+                result.append(outcome)
+                processed.append(message)
+        if processed:
+            await self.publisher.delete_shippings(processed)
+        if errors:
+            raise errors[0]
+
+        return result
+
+    async def process_shipping(self, shipping_id, shipping=None):
+        now = datetime.now(timezone.utc)
+        if shipping is not None:
+            if shipping["due_ts"] < to_timestamp(now):
+                return await self.fail_shipping(shipping_id)
+            return await self.complete_shipping(shipping_id)
+
+        try:
+            return await self.complete_shipping(shipping_id, due_not_before(now))
+        except ShippingTransitionRejected:
+            return await self.fail_shipping(shipping_id, due_before(now))
+
+    async def check_status(self, shipping_id):
+        if self.status_cache is not None:
+            status = self.status_cache.get(shipping_id)
+            if status is not None:
+                return status
+
+        shipping = await self.repository.get_shipping(shipping_id)
+        self._cache_status(shipping_id, shipping["shipping_status"])
+
+        return shipping["shipping_status"]
+
+    async def check_statuses(self, shipping_ids):
+        statuses = {}
+        if self.status_cache is not None:
+            for shipping_id in shipping_ids:
+                statuses[shipping_id] = self.status_cache.get(shipping_id)
+
+        missing = [
+            shipping_id for shipping_id in shipping_ids if not statuses.get(shipping_id)
+        ]
+        if missing:
+            shippings = await self.repository.get_shippings(
+                missing, ["shipping_status"]
+            )
+            for shipping_id in missing:
+                status = shippings.get(shipping_id, {}).get("shipping_status")
+                if status is not None:
+                    self._cache_status(shipping_id, status)
+                statuses[shipping_id] = status
+
+        return statuses
+
+    async def transition_shipping(self, shipping_id, status, condition=None):
+        response = await self._transition(shipping_id, status, condition)
+        return response["Attributes"]
+
+    async def fail_shipping(self, shipping_id, condition=None):
+        response = await self._transition(shipping_id, self.SHIPPING_FAILED, condition)
+        return response["ResponseMetadata"]
+
+    async def complete_shipping(self, shipping_id, condition=None):
+        response = await self._transition(
+            shipping_id, self.SHIPPING_COMPLETED, condition
+        )
+        return response["ResponseMetadata"]
+
+    async def _transition(self, shipping_id, status, condition=None):
+        allowed = Attr("shipping_status").is_in(list(self.ACTIVE_STATUSES))
+        if condition is not None:
+            allowed = allowed & condition
+        try:
+            response = await self.repository.update_shipping_status(
+                shipping_id, status, allowed
+            )
+        except ShippingTransitionRejected:
+            self._invalidate_status(shipping_id)
+            raise
+        self._cache_status(shipping_id, status)
+
+        return response
+
+    async def _rollback_to_created(self, shipping_id):
+        try:
+            await self.repository.update_shipping_status(
+                shipping_id,
+                self.SHIPPING_CREATED,
+                Attr("shipping_status").eq(self.SHIPPING_IN_PROGRESS),
+            )
+        except ShippingTransitionRejected:
+            pass
+        self._invalidate_status(shipping_id)
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StatusCache:
+    # Interface for status caches. A shared cache (Redis, memcached, ...)
+    # implements these methods and is passed to ShippingService as is.
+
+    def get(self, shipping_id):
+        raise NotImplementedError
+
+    def set(self, shipping_id, status):
+        raise NotImplementedError
+
+    def invalidate(self, shipping_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LRUStatusCache(StatusCache):
+    def __init__(self, max_size: int = 10000, ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, shipping_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(shipping_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            status, expires_at = entry
+            if expires_at <= now:
+                del self._items[shipping_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(shipping_id)
+            self.hits += 1
+            return status
+
+    def set(self, shipping_id, status):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._items[shipping_id] = (status, expires_at)
+            self._items.move_to_end(shipping_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, shipping_id):
+        with self._lock:
+            self._items.pop(shipping_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -1,6 +1,20 @@
 import os
 
+# "aws" talks to AWS_ENDPOINT_URL, "memory" uses the in-process stand-ins
+AWS_BACKEND = os.getenv("AWS_BACKEND", "aws")
 AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL", "http://localhost:4566")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 SHIPPING_TABLE_NAME = os.getenv("SHIPPING_TABLE_NAME", "ShippingTable")
 SHIPPING_QUEUE = os.getenv("SHIPPING_QUEUE_NAME", "ShippingQueue")
+SHIPPING_FIFO_QUEUE = os.getenv("SHIPPING_FIFO_QUEUE_NAME", f"{SHIPPING_QUEUE}.fifo")
+SHIPPING_OUTBOX_TABLE_NAME = os.getenv(
+    "SHIPPING_OUTBOX_TABLE_NAME", "ShippingOutboxTable"
+)
+INVENTORY_TABLE_NAME = os.getenv("INVENTORY_TABLE_NAME", "InventoryTable")
+IDEMPOTENCY_TABLE_NAME = os.getenv("IDEMPOTENCY_TABLE_NAME", "ShippingIdempotencyTable")
+# how long an idempotency key keeps returning the shipping created under it
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "3"))
@@ -0,0 +1,200 @@
+import logging
+import queue
+import threading
+import time
+
+from .publisher import SEND_BATCH_SIZE, VisibilityHeartbeat
+from .repository import ShippingTransitionRejected
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class StageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.count = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, items=1, error=False):
+        with self._lock:
+            self.count += items
+            self.errors += int(error)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started
+            calls = self.count + self.errors
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "throughput": self.count / elapsed if elapsed else 0.0,
+                "avg_latency": self.total_latency / calls if calls else 0.0,
+                "max_latency": self.max_latency,
+            }
+
+
+class ShippingConsumer:
+    def __init__(
+        self,
+        service,
+        pollers: int = 1,
+        workers: int = 4,
+        max_pending: int = None,
+        batch_size: int = 10,
+        wait_time: int = 1,
+        visibility_timeout: int = 30,
+        ack_delay=0.5,
+    ):
+        self.service = service
+        self.pollers = pollers
+        self.workers = workers
+        self.batch_size = batch_size
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.ack_delay = ack_delay
+        # Bounded hand-off between the stages: pollers block once workers
+        # fall behind instead of pulling more messages off the queue.
+        self.pending = queue.Queue(maxsize=max_pending or workers * batch_size)
+        self.acks = queue.Queue()
+        self.heartbeat = VisibilityHeartbeat(service.publisher, visibility_timeout)
+        self.stats = {
+            "poll": StageStats(),
+            "process": StageStats(),
+            "ack": StageStats(),
+            # how long after their scheduled release shippings reach a worker
+            "lag": StageStats(),
+        }
+        self._stopping = threading.Event()
+        self._poller_threads = []
+        self._worker_threads = []
+        self._ack_thread = None
+
+    @property
+    def running(self):
+        return bool(self._poller_threads or self._worker_threads)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self.heartbeat.start()
+        self._ack_thread = self._spawn(self._ack, "shipping-acker")
+        self._worker_threads = [
+            self._spawn(self._work, f"shipping-worker-{i}") for i in range(self.workers)
+        ]
+        self._poller_threads = [
+            self._spawn(self._poll, f"shipping-poller-{i}") for i in range(self.pollers)
+        ]
+
+    def stop(self, timeout=None):
+        # Pollers finish their current receive, workers drain what was
+        # already handed over and then exit.
+        self._stopping.set()
+        for thread in self._poller_threads:
+            thread.join(timeout)
+        for _ in self._worker_threads:
+            self.pending.put(_STOP)
+        for thread in self._worker_threads:
+            thread.join(timeout)
+        self.acks.put(_STOP)
+        if self._ack_thread is not None:
+            self._ack_thread.join(timeout)
+        self.heartbeat.stop(timeout)
+        self._poller_threads = []
+        self._worker_threads = []
+        self._ack_thread = None
+
+    def get_stats(self):
+        stats = {name: stage.snapshot() for name, stage in self.stats.items()}
+        stats["pending"] = self.pending.qsize()
+        stats["unacked"] = self.acks.qsize()
+        return stats
+
+    @staticmethod
+    def _spawn(target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _poll(self):
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            try:
+                messages = self.service.publisher.poll_shipping_messages(
+                    self.batch_size, self.wait_time, self.visibility_timeout
+                )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to poll shippings")
+                self.stats["poll"].record(time.monotonic() - started, 0, error=True)
+                self._stopping.wait(self.wait_time)
+                continue
+            self.stats["poll"].record(time.monotonic() - started, len(messages))
+
+            for message in messages:
+                # Time spent waiting in the hand-off queue counts against the
+                # visibility timeout too, so the heartbeat covers it.
+                self.heartbeat.track(message)
+                self.pending.put(message)
+
+    def _work(self):
+        while True:
+            message = self.pending.get()
+            if message is _STOP:
+                return
+            if message.release_at is not None:
+                self.stats["lag"].record(time.time() - message.release_at)
+            started = time.monotonic()
+            try:
+                self.service.process_shipping(message.shipping_id)
+            except ShippingTransitionRejected:
+                # Already processed by someone else; just acknowledge it.
+                self.stats["process"].record(time.monotonic() - started)
+                self.acks.put(message)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to process shipping %s", message.shipping_id)
+                self.heartbeat.untrack(message)
+                self.stats["process"].record(time.monotonic() - started, 0, error=True)
+            else:
+                self.stats["process"].record(time.monotonic() - started)
+                self.acks.put(message)
+
+    def _ack(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self.acks.get(timeout=self.ack_delay))
+            except queue.Empty:
+                continue
+            while len(batch) < SEND_BATCH_SIZE:
+                try:
+                    batch.append(self.acks.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                batch.remove(_STOP)
+                stopping = True
+                while not self.acks.empty():
+                    batch.append(self.acks.get_nowait())
+            if batch:
+                self._flush_acks(batch)
+
+    def _flush_acks(self, messages):
+        started = time.monotonic()
+        try:
+            failed = self.service.publisher.delete_shippings(messages)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to acknowledge %d shippings", len(messages))
+            failed = messages
+        for message in messages:
+            self.heartbeat.untrack(message)
+        self.stats["ack"].record(
+            time.monotonic() - started, len(messages) - len(failed), error=bool(failed)
+        )
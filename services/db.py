@@ -1,12 +1,122 @@
+import threading
+
 import boto3
-from .config import AWS_ENDPOINT_URL, AWS_REGION
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
+from . import memory
+from .config import (
+    AWS_BACKEND,
+    AWS_ENDPOINT_URL,
+    AWS_MAX_ATTEMPTS,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_REGION,
+    AWS_RETRY_MODE,
+    AWS_TCP_KEEPALIVE,
+)
 
-def get_dynamodb_resource():
-    return boto3.resource(
-        "dynamodb",
-        endpoint_url=AWS_ENDPOINT_URL,
-        region_name=AWS_REGION,
-        aws_access_key_id="test",
-        aws_secret_access_key="test",
+_lock = threading.Lock()
+_local = threading.local()
+_backend = AWS_BACKEND
+_session = None
+_generation = 0
+_clients = {}
+_queue_urls = {}
+
+
+def get_client_config():
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+        retries={"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
     )
+
+
+def _get_session():
+    # boto3 sessions are not thread-safe; they are only touched under _lock.
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        _session = boto3.session.Session(
+            region_name=AWS_REGION,
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        )
+    return _session
+
+
+def get_client(service_name):
+    # Clients are thread-safe, so one pooled client per service is shared by
+    # every repository and publisher in the process.
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                if _backend == "memory":
+                    client = memory.client(service_name, get_client_config())
+                else:
+                    client = _get_session().client(
+                        service_name,
+                        endpoint_url=AWS_ENDPOINT_URL,
+                        config=get_client_config(),
+                    )
+                _clients[service_name] = client
+    return client
+
+
+def get_dynamodb_resource():
+    # Resources are not thread-safe, so every thread gets its own, built once.
+    generation, resource = getattr(_local, "dynamodb", (None, None))
+    if generation != _generation:
+        with _lock:
+            generation = _generation
+            if _backend == "memory":
+                resource = memory.resource(get_client_config())
+            else:
+                resource = _get_session().resource(
+                    "dynamodb",
+                    endpoint_url=AWS_ENDPOINT_URL,
+                    config=get_client_config(),
+                )
+        _local.dynamodb = (generation, resource)
+    return resource
+
+
+def get_queue_url(queue_name, attributes=None):
+    # attributes are only used when the queue has to be created
+    queue_url = _queue_urls.get(queue_name)
+    if queue_url is not None:
+        return queue_url
+
+    client = get_client("sqs")
+    try:
+        queue_url = client.get_queue_url(QueueName=queue_name)["QueueUrl"]
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] not in (
+            "AWS.SimpleQueueService.NonExistentQueue",
+            "QueueDoesNotExist",
+        ):
+            raise
+        queue_url = client.create_queue(
+            QueueName=queue_name, Attributes=attributes or {}
+        )["QueueUrl"]
+    _queue_urls[queue_name] = queue_url
+    return queue_url
+
+
+def reset_clients():
+    global _session, _generation  # pylint: disable=global-statement
+    with _lock:
+        _session = None
+        _generation += 1
+        _clients.clear()
+        _queue_urls.clear()
+
+
+def use_backend(backend):
+    # "aws" or "memory"; clients and resources made before are dropped
+    global _backend  # pylint: disable=global-statement
+    if backend not in ("aws", "memory"):
+        raise ValueError(f"Unknown backend {backend}")
+    _backend = backend
+    reset_clients()
@@ -0,0 +1,273 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary
+
+from .config import SHIPPING_TABLE_NAME
+from .db import get_dynamodb_resource
+from .instrumentation import instrument
+
+# Export file layout: a sequence of gzip members, one per chunk. Each member
+# holds one JSON line {"segment": ..., "count": ..., "columns": {name:
+# [values]}} with a value per item in every column, None where an item lacks
+# the attribute. Concatenated gzip members are one valid gzip stream, so the
+# file can also be read with plain zcat.
+
+EXPORT_CHUNK_SIZE = 1000
+
+_DONE = object()
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, Binary):
+        return base64.b64encode(value.value).decode()
+    raise TypeError(f"Cannot export {type(value).__name__} values")
+
+
+def _to_columns(items):
+    names = sorted(set().union(*items))
+    return {name: [item.get(name) for item in items] for name in names}
+
+
+class _Checkpoint:
+    # Progress of an export: bytes of the output that hold complete chunks
+    # and, per segment, the key its scan continues from
+    def __init__(self, path, segments):
+        self.path = path
+        self.segments = segments
+        self.offset = 0
+        self.items = 0
+        self.chunks = 0
+        self.positions = {
+            segment: {"start_key": None, "done": False} for segment in range(segments)
+        }
+
+    @classmethod
+    def load(cls, path, segments):
+        checkpoint = cls(path, segments)
+        if path is None or not os.path.exists(path):
+            return checkpoint, False
+        with open(path, encoding="utf-8") as file:
+            state = json.load(file)
+        if state["segments"] != segments:
+            raise ValueError(
+                f"Checkpoint {path} was written for {state['segments']} segments"
+            )
+        checkpoint.offset = state["offset"]
+        checkpoint.items = state["items"]
+        checkpoint.chunks = state["chunks"]
+        checkpoint.positions = {
+            int(segment): position for segment, position in state["positions"].items()
+        }
+        return checkpoint, True
+
+    def save(self):
+        if self.path is None:
+            return
+        state = {
+            "segments": self.segments,
+            "offset": self.offset,
+            "items": self.items,
+            "chunks": self.chunks,
+            "positions": self.positions,
+        }
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(state, file, default=_encode)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def pending_segments(self):
+        return [
+            segment
+            for segment, position in self.positions.items()
+            if not position["done"]
+        ]
+
+
+@instrument
+class ShippingExporter:
+    # Dumps a table with a parallel Scan: every segment is scanned by a
+    # worker of the pool and its pages flow through a bounded queue to the
+    # single writer, so memory stays at a few chunks whatever the table size.
+
+    def __init__(
+        self,
+        table_name: str = SHIPPING_TABLE_NAME,
+        segments: int = 4,
+        workers: int = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+        max_pending: int = None,
+        compresslevel: int = 6,
+    ):
+        self.table_name = table_name
+        self.segments = segments
+        self.workers = workers or segments
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.workers
+        self.compresslevel = compresslevel
+
+    def export(self, path: str, checkpoint_path: str = None):
+        # Without checkpoint_path the export starts over on every call. With
+        # one, an interrupted export continues after the last complete chunk;
+        # the checkpoint is removed once the export is done.
+        checkpoint, resumed = _Checkpoint.load(checkpoint_path, self.segments)
+        pages = queue.Queue(maxsize=self.max_pending)
+        stopping = threading.Event()
+        pending = checkpoint.pending_segments()
+
+        with open(path, "r+b" if resumed else "wb") as output:
+            # drop whatever an interrupted run wrote after its last checkpoint
+            output.truncate(checkpoint.offset)
+            output.seek(checkpoint.offset)
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="shipping-export"
+            ) as executor:
+                for segment in pending:
+                    executor.submit(
+                        self._scan_into,
+                        segment,
+                        checkpoint.positions[segment]["start_key"],
+                        pages,
+                        stopping,
+                    )
+                try:
+                    self._write(output, checkpoint, pages, len(pending))
+                finally:
+                    stopping.set()
+
+        checkpoint.remove()
+        return {
+            "items": checkpoint.items,
+            "chunks": checkpoint.chunks,
+            "resumed": resumed,
+        }
+
+    def _write(self, output, checkpoint, pages, running):
+        while running:
+            segment, items, last_key = pages.get()
+            if items is _DONE:
+                running -= 1
+                if isinstance(last_key, Exception):
+                    raise last_key
+                continue
+            position = checkpoint.positions[segment]
+            if items:
+                line = json.dumps(
+                    {
+                        "segment": segment,
+                        "count": len(items),
+                        "columns": _to_columns(items),
+                    },
+                    default=_encode,
+                    separators=(",", ":"),
+                )
+                output.write(
+                    gzip.compress(
+                        line.encode() + b"\n", compresslevel=self.compresslevel
+                    )
+                )
+                output.flush()
+                os.fsync(output.fileno())
+                checkpoint.items += len(items)
+                checkpoint.chunks += 1
+            checkpoint.offset = output.tell()
+            position["start_key"] = last_key
+            position["done"] = last_key is None
+            checkpoint.save()
+
+    def _scan_into(self, segment, start_key, pages, stopping):
+        # runs on a pool thread; the result goes through the queue because
+        # nobody waits on the future
+        try:
+            for items, last_key in self._scan_segment(segment, start_key, stopping):
+                self._put(pages, (segment, items, last_key), stopping)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._put(pages, (segment, _DONE, exc), stopping)
+        else:
+            self._put(pages, (segment, _DONE, None), stopping)
+
+    def _scan_segment(self, segment, start_key, stopping):
+        # (items, key to continue from) per page, None as the key of the last
+        table = get_dynamodb_resource().Table(self.table_name)
+        params = {
+            "Segment": segment,
+            "TotalSegments": self.segments,
+            "Limit": self.chunk_size,
+        }
+        while not stopping.is_set():
+            if start_key is not None:
+                params["ExclusiveStartKey"] = start_key
+            response = table.scan(**params)
+            start_key = response.get("LastEvaluatedKey")
+            yield response.get("Items", []), start_key
+            if start_key is None:
+                return
+
+    @staticmethod
+    def _put(pages, entry, stopping):
+        # the writer stops reading after a failure, so never block for good
+        while not stopping.is_set():
+            try:
+                pages.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+def read_export(path: str):
+    # items of an export file, one chunk in memory at a time
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            columns = json.loads(line)["columns"]
+            names = list(columns)
+            for values in zip(*columns.values()):
+                yield {
+                    name: value
+                    for name, value in zip(names, values)
+                    if value is not None
+                }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the shipping table to a gzip columnar file."
+    )
+    parser.add_argument("output")
+    parser.add_argument("--table", default=SHIPPING_TABLE_NAME)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument(
+        "--checkpoint", default=None, help="defaults to OUTPUT.checkpoint"
+    )
+    args = parser.parse_args()
+
+    exporter = ShippingExporter(
+        args.table, args.segments, args.workers, args.chunk_size
+    )
+    result = exporter.export(
+        args.output, args.checkpoint or f"{args.output}.checkpoint"
+    )
+    print(
+        f"exported {result['items']} items in {result['chunks']} chunks"
+        f"{' (resumed)' if result['resumed'] else ''}"
+    )
+
+
+if __name__ == "__main__":
+    main()
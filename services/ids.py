@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# UUIDv7 layout: 48 bits of unix milliseconds, 4 version bits, 12 + 62 bits
+# of randomness with the 2 variant bits in between
+_VERSION = 0x7 << 76
+_VARIANT = 0b10 << 62
+_RANDOM_BITS = 74
+# the top random bit starts cleared, so a millisecond has room for 2**73 ids
+_SEED_MASK = (1 << (_RANDOM_BITS - 1)) - 1
+
+
+def _format(value):
+    digits = f"{value:032x}"
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+
+class IdGenerator:
+    # Interface for ID generators. set_id_generator() swaps the one used for
+    # new orders and shippings.
+
+    def new_id(self):
+        raise NotImplementedError
+
+
+class UUID4Generator(IdGenerator):
+    def new_id(self):
+        return str(uuid.uuid4())
+
+
+class UUID7Generator(IdGenerator):
+    # Time-ordered ids: their string form sorts by creation time, and ids made
+    # by one generator are strictly increasing even within a millisecond or
+    # when the clock steps back
+
+    def __init__(self, clock=time.time_ns):
+        self.clock = clock
+        self._last_ms = -1
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        now_ms = self.clock() // 1_000_000
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._counter = int.from_bytes(os.urandom(10), "big") & _SEED_MASK
+            else:
+                self._counter += 1
+                if self._counter >> _RANDOM_BITS:
+                    self._last_ms += 1
+                    self._counter = 0
+            timestamp, counter = self._last_ms, self._counter
+
+        random_a = counter >> 62
+        random_b = counter & ((1 << 62) - 1)
+        return _format(
+            timestamp << 80 | _VERSION | random_a << 64 | _VARIANT | random_b
+        )
+
+    @staticmethod
+    def lower_bound(moment: datetime):
+        # smallest id of the millisecond, for range conditions on ids
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        timestamp = int(moment.timestamp() * 1000)
+        return _format(timestamp << 80 | _VERSION | _VARIANT)
+
+    @staticmethod
+    def timestamp(id_value: str):
+        milliseconds = int(id_value.replace("-", "")[:12], 16)
+        return datetime.fromtimestamp(milliseconds / 1000, timezone.utc)
+
+
+_generator = UUID7Generator()
+
+
+def get_id_generator():
+    return _generator
+
+
+def set_id_generator(generator: IdGenerator):
+    global _generator  # pylint: disable=global-statement
+    _generator = generator
+
+
+def new_id():
+    return _generator.new_id()
@@ -0,0 +1,276 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+# Timing spans and counters for the hot path. Instrumented functions only
+# check one flag while instrumentation is disabled; once enabled, every call
+# becomes a span that is handed to the exporters together with its duration,
+# its parent span and whether it raised.
+
+Span = namedtuple("Span", "name parent started duration error")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Exporter:
+    # Interface for exporters passed to enable()
+
+    def on_span(self, span):
+        raise NotImplementedError
+
+    def on_count(self, name, value):
+        pass
+
+
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.exporters = ()
+
+
+_state = _State()
+
+
+def enable(*exporters):
+    _state.exporters = tuple(exporters)
+    _state.enabled = bool(exporters)
+
+
+def disable():
+    _state.enabled = False
+    _state.exporters = ()
+
+
+def is_enabled():
+    return _state.enabled
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, name):
+        self.name = name
+        self._token = None
+        self._started = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.name)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        _export(Span(self.name, _current_span.get(), self._started, duration, exc_type))
+        return False
+
+
+def _export(span):
+    for exporter in _state.exporters:
+        exporter.on_span(span)
+
+
+def span(name):
+    if not _state.enabled:
+        return _NOOP_SPAN
+    return _ActiveSpan(name)
+
+
+def count(name, value=1):
+    if not _state.enabled:
+        return
+    for exporter in _state.exporters:
+        exporter.on_count(name, value)
+
+
+def instrumented(name):
+    # Decorator timing every call of a function or coroutine function as the
+    # span name
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _state.enabled:
+                    return await func(*args, **kwargs)
+                with _ActiveSpan(name):
+                    return await func(*args, **kwargs)
+
+            wrapper = async_wrapper
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not _state.enabled:
+                    return func(*args, **kwargs)
+                with _ActiveSpan(name):
+                    return func(*args, **kwargs)
+
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    return decorate
+
+
+def instrument(cls):
+    # Class decorator instrumenting every public method as "Class.method";
+    # methods borrowed from an already instrumented class keep their span
+    for attribute, value in list(vars(cls).items()):
+        if attribute.startswith("_") or not inspect.isfunction(value):
+            continue
+        if getattr(value, "__instrumented__", False):
+            continue
+        setattr(cls, attribute, instrumented(f"{cls.__name__}.{attribute}")(value))
+    return cls
+
+
+class MemoryExporter(Exporter):
+    # Keeps the latest spans and per-span totals, for tests and debugging
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+        self.counters = Counter()
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def on_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+            calls, errors, total, longest = self._totals.get(
+                span.name, (0, 0, 0.0, 0.0)
+            )
+            self._totals[span.name] = (
+                calls + 1,
+                errors + (span.error is not None),
+                total + span.duration,
+                max(longest, span.duration),
+            )
+
+    def on_count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "calls": calls,
+                    "errors": errors,
+                    "total_s": total,
+                    "mean_s": total / calls,
+                    "max_s": longest,
+                }
+                for name, (calls, errors, total, longest) in self._totals.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+            self._totals.clear()
+
+
+class LoggingExporter(Exporter):
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger("services.instrumentation")
+        self.level = level
+
+    def on_span(self, span):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(
+            self.level,
+            "%s took %.3fms (parent %s)%s",
+            span.name,
+            span.duration * 1000,
+            span.parent,
+            f" and raised {span.error.__name__}" if span.error else "",
+        )
+
+    def on_count(self, name, value):
+        self.logger.log(self.level, "%s += %s", name, value)
+
+
+class PrometheusExporter(Exporter):
+    # Aggregates spans into histograms and counters and renders them in the
+    # Prometheus text exposition format
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, namespace="eshop", buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._errors = Counter()
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def on_span(self, span):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            histogram[0][bisect.bisect_left(self.buckets, span.duration)] += 1
+            histogram[1] += span.duration
+            if span.error is not None:
+                self._errors[span.name] += 1
+
+    def on_count(self, name, value):
+        with self._lock:
+            self._counters[name] += value
+
+    def render(self):
+        prefix = self.namespace
+        lines = [
+            f"# HELP {prefix}_span_duration_seconds Duration of instrumented calls.",
+            f"# TYPE {prefix}_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, (counts, total) in sorted(self._histograms.items()):
+                label = _label(name)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{prefix}_span_duration_seconds_bucket{{span="{label}",'
+                        f'le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'{prefix}_span_duration_seconds_sum{{span="{label}"}} {total}'
+                )
+                lines.append(
+                    f'{prefix}_span_duration_seconds_count{{span="{label}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(
+                f"# HELP {prefix}_span_errors_total Instrumented calls that raised."
+            )
+            lines.append(f"# TYPE {prefix}_span_errors_total counter")
+            for name, errors in sorted(self._errors.items()):
+                lines.append(
+                    f'{prefix}_span_errors_total{{span="{_label(name)}"}} {errors}'
+                )
+            lines.append(f"# HELP {prefix}_events_total Counted events.")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'{prefix}_events_total{{name="{_label(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
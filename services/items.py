@@ -0,0 +1,91 @@
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from boto3.dynamodb.conditions import Attr
+
+# Shipping item versions:
+#   1 (no item_version) - product_ids comma-joined, created_date and due_date
+#     as ISO strings
+#   2 - product_ids as a list, or as zlib-compressed JSON in product_ids_z
+#     once the list is longer than PRODUCT_IDS_COMPRESS_THRESHOLD bytes;
+#     created_ts and due_ts in epoch milliseconds
+# decode_item() turns either version into the version 2 shape with the
+# product ids always as a list.
+ITEM_VERSION = 2
+PRODUCT_IDS_COMPRESS_THRESHOLD = 1024
+
+# attributes as readers see them -> attributes stored by any version, for
+# projections
+STORED_ATTRIBUTES = {
+    "product_ids": ("product_ids", "product_ids_z"),
+    "created_ts": ("created_ts", "created_date"),
+    "due_ts": ("due_ts", "due_date"),
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def to_timestamp(moment: datetime):
+    # epoch milliseconds; naive datetimes are taken as UTC
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _EPOCH) // _MILLISECOND
+
+
+def from_timestamp(timestamp):
+    return _EPOCH + int(timestamp) * _MILLISECOND
+
+
+def encode_product_ids(product_ids: list):
+    product_ids = list(product_ids)
+    encoded = json.dumps(product_ids, separators=(",", ":")).encode()
+    if len(encoded) > PRODUCT_IDS_COMPRESS_THRESHOLD:
+        return {"product_ids_z": zlib.compress(encoded)}
+    return {"product_ids": product_ids}
+
+
+def stored_attributes(attributes: list):
+    return [
+        stored
+        for attribute in attributes
+        for stored in STORED_ATTRIBUTES.get(attribute, (attribute,))
+    ]
+
+
+def decode_item(item):
+    if item is None:
+        return None
+    decoded = dict(item)
+    if "product_ids_z" in decoded:
+        compressed = decoded.pop("product_ids_z")
+        decoded["product_ids"] = json.loads(
+            zlib.decompress(bytes(getattr(compressed, "value", compressed)))
+        )
+    elif isinstance(decoded.get("product_ids"), str):
+        joined = decoded["product_ids"]
+        decoded["product_ids"] = joined.split(",") if joined else []
+    for timestamp, legacy in (("created_ts", "created_date"), ("due_ts", "due_date")):
+        if timestamp in decoded:
+            decoded[timestamp] = int(decoded[timestamp])
+        elif legacy in decoded:
+            decoded[timestamp] = to_timestamp(
+                datetime.fromisoformat(decoded.pop(legacy))
+            )
+    if "item_version" in decoded:
+        decoded["item_version"] = int(decoded["item_version"])
+    return decoded
+
+
+def due_not_before(moment: datetime):
+    # condition on the stored due date of either version
+    return Attr("due_ts").gte(to_timestamp(moment)) | Attr("due_date").gte(
+        moment.isoformat()
+    )
+
+
+def due_before(moment: datetime):
+    return Attr("due_ts").lt(to_timestamp(moment)) | Attr("due_date").lt(
+        moment.isoformat()
+    )
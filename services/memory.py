@@ -0,0 +1,1211 @@
+import functools
+import hashlib
+import operator
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+# In-process stand-ins for the DynamoDB resource/client and the SQS client.
+# They implement the subset of the API the repositories and publishers use,
+# with the same request and response shapes and error codes, so the service
+# layer runs unchanged on top of them. State lives in this process only, so
+# every test worker gets its own tables and queues.
+
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+TRANSACT_LIMIT = 100
+SQS_BATCH_LIMIT = 10
+SQS_MAX_WAIT_SECONDS = 20
+DEFAULT_VISIBILITY_TIMEOUT = 30
+FIFO_DEDUPLICATION_INTERVAL = 300
+
+_COMPARISONS = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _error(code, message, operation_name, **extra):
+    return ClientError(
+        {"Error": {"Code": code, "Message": message}, **extra}, operation_name
+    )
+
+
+def matches(condition, item, names=None, values=None):
+    # Evaluates a boto3 condition builder object (Attr/Key) or a condition
+    # expression string against a plain item.
+    if isinstance(condition, str):
+        return _StringCondition(condition, names or {}, values or {}).evaluate(item)
+
+    expression = condition.get_expression()
+    operator_name = expression["operator"]
+    operands = expression["values"]
+    if operator_name == "AND":
+        return all(matches(operand, item) for operand in operands)
+    if operator_name == "OR":
+        return any(matches(operand, item) for operand in operands)
+    if operator_name == "NOT":
+        return not matches(operands[0], item)
+
+    name = operands[0].name
+    if operator_name == "attribute_exists":
+        return name in item
+    if operator_name == "attribute_not_exists":
+        return name not in item
+    return _compare(operator_name, item.get(name), operands[1:])
+
+
+def _compare(operator_name, value, operands):
+    if value is None:
+        return False
+    if operator_name == "IN":
+        return value in operands[0]
+    if operator_name == "BETWEEN":
+        return operands[0] <= value <= operands[1]
+    if operator_name == "begins_with":
+        return value.startswith(operands[0])
+    if operator_name == "contains":
+        return operands[0] in value
+    try:
+        return _COMPARISONS[operator_name](value, operands[0])
+    except TypeError:
+        return False
+
+
+class _StringCondition:
+    # The subset of the condition expression grammar the services use:
+    # comparisons, BETWEEN, IN, attribute_exists/attribute_not_exists and
+    # begins_with/contains, joined with AND and OR (AND binding tighter).
+    _TOKEN = re.compile(
+        r"\s*(?:(?P<function>attribute_exists|attribute_not_exists|begins_with|contains)"
+        r"\s*\((?P<arguments>[^)]*)\)"
+        r"|(?P<name>[#\w.]+)\s*(?:(?P<between>BETWEEN)\s+(?P<low>:\w+)\s+AND\s+(?P<high>:\w+)"
+        r"|(?P<in>IN)\s*\((?P<choices>[^)]*)\)"
+        r"|(?P<operator><>|<=|>=|=|<|>)\s*(?P<value>:\w+)))\s*",
+        re.IGNORECASE,
+    )
+    _JOINER = re.compile(r"(AND|OR)\s", re.IGNORECASE)
+
+    def __init__(self, expression, names, values):
+        self.names = names
+        self.values = values
+        # alternatives of clauses that all have to hold
+        self.alternatives = [[]]
+        position = 0
+        while True:
+            match = self._TOKEN.match(expression, position)
+            if match is None:
+                raise ValueError(f"Unsupported condition expression: {expression}")
+            self.alternatives[-1].append(match)
+            position = match.end()
+            if position == len(expression):
+                break
+            joiner = self._JOINER.match(expression, position)
+            if joiner is None:
+                raise ValueError(f"Unsupported condition expression: {expression}")
+            if joiner[1].upper() == "OR":
+                self.alternatives.append([])
+            position = joiner.end()
+
+    def evaluate(self, item):
+        return any(
+            all(self._evaluate(clause, item) for clause in clauses)
+            for clauses in self.alternatives
+        )
+
+    def _evaluate(self, clause, item):
+        if clause["function"]:
+            arguments = [a.strip() for a in clause["arguments"].split(",")]
+            name = _resolve_name(arguments[0], self.names)
+            function = clause["function"].lower()
+            if function == "attribute_exists":
+                return name in item
+            if function == "attribute_not_exists":
+                return name not in item
+            return _compare(function, item.get(name), [self.values[arguments[1]]])
+
+        value = item.get(_resolve_name(clause["name"], self.names))
+        if clause["between"]:
+            operands = [self.values[clause["low"]], self.values[clause["high"]]]
+            return _compare("BETWEEN", value, operands)
+        if clause["in"]:
+            choices = [self.values[c.strip()] for c in clause["choices"].split(",")]
+            return _compare("IN", value, [choices])
+        return _compare(clause["operator"], value, [self.values[clause["value"]]])
+
+
+def _resolve_name(token, names):
+    return names[token] if token.startswith("#") else token
+
+
+def _to_store(value):
+    # Mirrors the boto3 serializer: ints become Decimal, bytes Binary and
+    # floats are rejected
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        return {k: _to_store(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_store(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {_to_store(v) for v in value}
+    if isinstance(value, (bytes, bytearray)):
+        return Binary(bytes(value))
+    return value
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+def _operation(operation_name):
+    # Runs the before-call hooks and adds the ResponseMetadata boto3 returns
+    def decorate(method):
+        @functools.wraps(method)
+        def call(self, **params):
+            self.meta.events.emit(operation_name, params)
+            response = method(self, **params)
+            response["ResponseMetadata"] = {"HTTPStatusCode": 200, "RetryAttempts": 0}
+            return response
+
+        return call
+
+    return decorate
+
+
+class _Model:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Events:
+    # Just enough of botocore's event system for before-call hooks
+    def __init__(self):
+        self._handlers = []
+
+    def register(self, event_name, handler, **_):
+        if event_name.startswith("before-call"):
+            self._handlers.append(handler)
+
+    def unregister(self, event_name, handler=None, **_):
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def emit(self, operation_name, params):
+        for handler in self._handlers:
+            handler(model=_Model(operation_name), params=params)
+
+
+class _Meta:
+    def __init__(self, config=None, client=None):
+        self.config = config
+        self.client = client
+        self.events = _Events()
+
+
+class _Waiter:
+    def wait(self, **_):
+        return None
+
+
+class _Table:
+    def __init__(self, definition):
+        self.name = definition["TableName"]
+        self.key = [k["AttributeName"] for k in _ordered_key(definition["KeySchema"])]
+        self.indexes = {
+            index["IndexName"]: [
+                k["AttributeName"] for k in _ordered_key(index["KeySchema"])
+            ]
+            for index in definition.get("GlobalSecondaryIndexes", [])
+            + definition.get("LocalSecondaryIndexes", [])
+        }
+        self.definition = definition
+        self.items = {}
+
+    def key_of(self, key, operation_name):
+        if set(key) != set(self.key):
+            raise _error(
+                "ValidationException",
+                "The provided key element does not match the schema",
+                operation_name,
+            )
+        return tuple(key[name] for name in self.key)
+
+    def item_key(self, item, operation_name):
+        missing = [name for name in self.key if name not in item]
+        if missing:
+            raise _error(
+                "ValidationException",
+                f"One or more parameter values were invalid: Missing the key {missing[0]}",
+                operation_name,
+            )
+        return tuple(item[name] for name in self.key)
+
+
+def _ordered_key(key_schema):
+    return sorted(key_schema, key=lambda k: k["KeyType"] != "HASH")
+
+
+class _UpdateExpression:
+    _CLAUSE = re.compile(r"\b(SET|ADD|REMOVE|DELETE)\b", re.IGNORECASE)
+
+    def __init__(self, expression, names, values):
+        self.names = names
+        self.values = values
+        parts = self._CLAUSE.split(expression)
+        if parts[0].strip():
+            raise ValueError(f"Unsupported update expression: {expression}")
+        self.clauses = [
+            (parts[i].upper(), _split_top_level(parts[i + 1]))
+            for i in range(1, len(parts), 2)
+        ]
+
+    def apply(self, item):
+        # returns the names of the updated attributes
+        updated = []
+        for action, arguments in self.clauses:
+            for argument in arguments:
+                if action == "SET":
+                    target, value = (part.strip() for part in argument.split("=", 1))
+                    name = _resolve_name(target, self.names)
+                    item[name] = self._value(value, item)
+                elif action == "REMOVE":
+                    name = _resolve_name(argument.strip(), self.names)
+                    item.pop(name, None)
+                else:
+                    target, value = argument.split()
+                    name = _resolve_name(target, self.names)
+                    operand = self.values[value]
+                    current = item.get(name)
+                    if action == "ADD" and isinstance(operand, set):
+                        item[name] = (current or set()) | operand
+                    elif action == "ADD":
+                        item[name] = (current or Decimal(0)) + operand
+                    else:
+                        item[name] = (current or set()) - operand
+                        if not item[name]:
+                            del item[name]
+                updated.append(name)
+        return updated
+
+    def _value(self, expression, item):
+        expression = expression.strip()
+        for symbol, combine in (("+", operator.add), ("-", operator.sub)):
+            left, found, right = _partition_top_level(expression, symbol)
+            if found:
+                return combine(self._value(left, item), self._value(right, item))
+        if expression.startswith(":"):
+            return self.values[expression]
+        if expression.lower().startswith("if_not_exists("):
+            name, default = _split_top_level(expression[len("if_not_exists(") : -1])
+            name = _resolve_name(name.strip(), self.names)
+            return item[name] if name in item else self._value(default, item)
+        if expression.lower().startswith("list_append("):
+            first, second = _split_top_level(expression[len("list_append(") : -1])
+            return list(self._value(first, item)) + list(self._value(second, item))
+        return item.get(_resolve_name(expression, self.names))
+
+
+def _split_top_level(text, separator=","):
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _partition_top_level(text, symbol):
+    depth = 0
+    for position, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == symbol and depth == 0:
+            return text[:position], True, text[position + 1 :]
+    return text, False, ""
+
+
+def _project(item, projection, names):
+    if not projection:
+        return _copy(item)
+    attributes = [_resolve_name(a.strip(), names) for a in projection.split(",")]
+    return {name: _copy(item[name]) for name in attributes if name in item}
+
+
+def _condition_holds(params, item):
+    condition = params.get("ConditionExpression")
+    if condition is None:
+        return True
+    return matches(
+        condition,
+        item or {},
+        params.get("ExpressionAttributeNames"),
+        params.get("ExpressionAttributeValues"),
+    )
+
+
+class MemoryDynamoDBClient:
+    def __init__(self, config=None):
+        self.meta = _Meta(config)
+        self._tables = {}
+        self._lock = threading.RLock()
+
+    def reset(self):
+        with self._lock:
+            self._tables.clear()
+
+    def _table(self, name, operation_name):
+        table = self._tables.get(name)
+        if table is None:
+            raise _error(
+                "ResourceNotFoundException",
+                "Requested resource not found",
+                operation_name,
+            )
+        return table
+
+    # table management
+
+    @_operation("CreateTable")
+    def create_table(self, **params):
+        with self._lock:
+            if params["TableName"] in self._tables:
+                raise _error(
+                    "ResourceInUseException",
+                    f"Table already exists: {params['TableName']}",
+                    "CreateTable",
+                )
+            self._tables[params["TableName"]] = _Table(params)
+        return {"TableDescription": self._describe(params["TableName"])}
+
+    @_operation("DeleteTable")
+    def delete_table(self, **params):
+        with self._lock:
+            description = self._describe(params["TableName"], "DeleteTable")
+            del self._tables[params["TableName"]]
+        return {"TableDescription": description}
+
+    @_operation("UpdateTable")
+    def update_table(self, **params):
+        # index changes only; indexes are evaluated at query time, so a new
+        # one covers existing items at once
+        with self._lock:
+            table = self._table(params["TableName"], "UpdateTable")
+            definition = dict(table.definition)
+            indexes = list(definition.get("GlobalSecondaryIndexes", []))
+            for update in params.get("GlobalSecondaryIndexUpdates", []):
+                if "Create" in update:
+                    indexes.append(update["Create"])
+                elif "Delete" in update:
+                    name = update["Delete"]["IndexName"]
+                    indexes = [i for i in indexes if i["IndexName"] != name]
+            definition["GlobalSecondaryIndexes"] = indexes
+            if "AttributeDefinitions" in params:
+                definition["AttributeDefinitions"] = params["AttributeDefinitions"]
+            items = table.items
+            table = self._tables[params["TableName"]] = _Table(definition)
+            table.items = items
+        return {"TableDescription": self._describe(params["TableName"], "UpdateTable")}
+
+    @_operation("DescribeTable")
+    def describe_table(self, **params):
+        with self._lock:
+            return {"Table": self._describe(params["TableName"], "DescribeTable")}
+
+    @_operation("ListTables")
+    def list_tables(self, **params):
+        with self._lock:
+            return {"TableNames": sorted(self._tables)}
+
+    def get_waiter(self, waiter_name):
+        return _Waiter()
+
+    def _describe(self, name, operation_name="DescribeTable"):
+        table = self._table(name, operation_name)
+        return {
+            **table.definition,
+            "TableStatus": "ACTIVE",
+            "ItemCount": len(table.items),
+        }
+
+    # items
+
+    @_operation("GetItem")
+    def get_item(self, **params):
+        with self._lock:
+            table = self._table(params["TableName"], "GetItem")
+            item = table.items.get(table.key_of(params["Key"], "GetItem"))
+            if item is None:
+                return {}
+            return {
+                "Item": _project(
+                    item,
+                    params.get("ProjectionExpression"),
+                    params.get("ExpressionAttributeNames", {}),
+                )
+            }
+
+    @_operation("PutItem")
+    def put_item(self, **params):
+        with self._lock:
+            return self._put(params, "PutItem")
+
+    @_operation("UpdateItem")
+    def update_item(self, **params):
+        with self._lock:
+            return self._update(params, "UpdateItem")
+
+    @_operation("DeleteItem")
+    def delete_item(self, **params):
+        with self._lock:
+            return self._delete(params, "DeleteItem")
+
+    def _put(self, params, operation_name):
+        table = self._table(params["TableName"], operation_name)
+        item = _to_store(params["Item"])
+        key = table.item_key(item, operation_name)
+        old = table.items.get(key)
+        if not _condition_holds(params, old):
+            raise _error(
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+                operation_name,
+            )
+        table.items[key] = item
+        if params.get("ReturnValues") == "ALL_OLD" and old is not None:
+            return {"Attributes": _copy(old)}
+        return {}
+
+    def _update(self, params, operation_name):
+        table = self._table(params["TableName"], operation_name)
+        key = table.key_of(params["Key"], operation_name)
+        old = table.items.get(key)
+        if not _condition_holds(params, old):
+            raise _error(
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+                operation_name,
+            )
+        item = _copy(old) if old is not None else _copy(_to_store(params["Key"]))
+        updated = []
+        if params.get("UpdateExpression"):
+            updated = _UpdateExpression(
+                params["UpdateExpression"],
+                params.get("ExpressionAttributeNames", {}),
+                _to_store(params.get("ExpressionAttributeValues", {})),
+            ).apply(item)
+        table.items[key] = item
+
+        return_values = params.get("ReturnValues", "NONE")
+        if return_values == "ALL_NEW":
+            return {"Attributes": _copy(item)}
+        if return_values == "ALL_OLD" and old is not None:
+            return {"Attributes": _copy(old)}
+        if return_values == "UPDATED_NEW":
+            return {"Attributes": {n: _copy(item[n]) for n in updated if n in item}}
+        if return_values == "UPDATED_OLD" and old is not None:
+            return {"Attributes": {n: _copy(old[n]) for n in updated if n in old}}
+        return {}
+
+    def _delete(self, params, operation_name):
+        table = self._table(params["TableName"], operation_name)
+        key = table.key_of(params["Key"], operation_name)
+        old = table.items.get(key)
+        if not _condition_holds(params, old):
+            raise _error(
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+                operation_name,
+            )
+        table.items.pop(key, None)
+        if params.get("ReturnValues") == "ALL_OLD" and old is not None:
+            return {"Attributes": _copy(old)}
+        return {}
+
+    # batches and transactions
+
+    @_operation("BatchGetItem")
+    def batch_get_item(self, **params):
+        requests = params["RequestItems"]
+        if sum(len(request["Keys"]) for request in requests.values()) > BATCH_GET_LIMIT:
+            raise _error(
+                "ValidationException",
+                "Too many items requested for the BatchGetItem call",
+                "BatchGetItem",
+            )
+        responses = {}
+        with self._lock:
+            for name, request in requests.items():
+                table = self._table(name, "BatchGetItem")
+                keys = [table.key_of(key, "BatchGetItem") for key in request["Keys"]]
+                if len(set(keys)) != len(keys):
+                    raise _error(
+                        "ValidationException",
+                        "Provided list of item keys contains duplicates",
+                        "BatchGetItem",
+                    )
+                responses[name] = [
+                    _project(
+                        table.items[key],
+                        request.get("ProjectionExpression"),
+                        request.get("ExpressionAttributeNames", {}),
+                    )
+                    for key in keys
+                    if key in table.items
+                ]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    @_operation("BatchWriteItem")
+    def batch_write_item(self, **params):
+        requests = params["RequestItems"]
+        if sum(len(writes) for writes in requests.values()) > BATCH_WRITE_LIMIT:
+            raise _error(
+                "ValidationException",
+                "Too many items requested for the BatchWriteItem call",
+                "BatchWriteItem",
+            )
+        with self._lock:
+            for name, writes in requests.items():
+                for write in writes:
+                    if "PutRequest" in write:
+                        self._put(
+                            {"TableName": name, **write["PutRequest"]}, "BatchWriteItem"
+                        )
+                    else:
+                        self._delete(
+                            {"TableName": name, **write["DeleteRequest"]},
+                            "BatchWriteItem",
+                        )
+        return {"UnprocessedItems": {}}
+
+    @_operation("TransactWriteItems")
+    def transact_write_items(self, **params):
+        actions = params["TransactItems"]
+        if len(actions) > TRANSACT_LIMIT:
+            raise _error(
+                "ValidationException",
+                f"Member must have length less than or equal to {TRANSACT_LIMIT}",
+                "TransactWriteItems",
+            )
+        with self._lock:
+            targets = []
+            reasons = []
+            for action in actions:
+                ((kind, request),) = action.items()
+                table = self._table(request["TableName"], "TransactWriteItems")
+                if kind == "Put":
+                    key = table.item_key(
+                        _to_store(request["Item"]), "TransactWriteItems"
+                    )
+                else:
+                    key = table.key_of(request["Key"], "TransactWriteItems")
+                targets.append((table.name, key))
+                holds = _condition_holds(request, table.items.get(key))
+                reasons.append(
+                    {"Code": "None"}
+                    if holds
+                    else {
+                        "Code": "ConditionalCheckFailed",
+                        "Message": "The conditional request failed",
+                    }
+                )
+            if len(set(targets)) != len(targets):
+                raise _error(
+                    "ValidationException",
+                    "Transaction request cannot include multiple operations on one item",
+                    "TransactWriteItems",
+                )
+            if any(reason["Code"] != "None" for reason in reasons):
+                codes = ", ".join(reason["Code"] for reason in reasons)
+                raise _error(
+                    "TransactionCanceledException",
+                    f"Transaction cancelled, please refer cancellation reasons for "
+                    f"specific reasons [{codes}]",
+                    "TransactWriteItems",
+                    CancellationReasons=reasons,
+                )
+            for action in actions:
+                ((kind, request),) = action.items()
+                unconditional = {
+                    k: v for k, v in request.items() if k != "ConditionExpression"
+                }
+                if kind == "Put":
+                    self._put(unconditional, "TransactWriteItems")
+                elif kind == "Update":
+                    self._update(unconditional, "TransactWriteItems")
+                elif kind == "Delete":
+                    self._delete(unconditional, "TransactWriteItems")
+        return {}
+
+    # reads over many items
+
+    @_operation("Query")
+    def query(self, **params):
+        with self._lock:
+            table = self._table(params["TableName"], "Query")
+            key = (
+                table.indexes[params["IndexName"]]
+                if "IndexName" in params
+                else table.key
+            )
+            condition = params["KeyConditionExpression"]
+            names = params.get("ExpressionAttributeNames")
+            values = _to_store(params.get("ExpressionAttributeValues", {}))
+            candidates = [
+                item
+                for item in table.items.values()
+                if all(name in item for name in key)
+                and matches(condition, item, names, values)
+            ]
+
+            def order(item):
+                return (
+                    tuple(item[name] for name in key[1:]),
+                    tuple(item[name] for name in table.key),
+                )
+
+            return self._page(
+                table,
+                key,
+                candidates,
+                order,
+                params,
+                values,
+                reverse=not params.get("ScanIndexForward", True),
+            )
+
+    @_operation("Scan")
+    def scan(self, **params):
+        with self._lock:
+            table = self._table(params["TableName"], "Scan")
+            key = (
+                table.indexes[params["IndexName"]]
+                if "IndexName" in params
+                else table.key
+            )
+            values = _to_store(params.get("ExpressionAttributeValues", {}))
+            segments = params.get("TotalSegments", 1)
+            segment = params.get("Segment", 0)
+
+            def order(item):
+                primary = tuple(item[name] for name in table.key)
+                return (zlib.crc32(repr(primary).encode()), primary)
+
+            candidates = [
+                item
+                for item in table.items.values()
+                if all(name in item for name in key)
+                and order(item)[0] % segments == segment
+            ]
+            return self._page(table, key, candidates, order, params, values)
+
+    def _page(self, table, key, candidates, order, params, values, reverse=False):
+        candidates.sort(key=order, reverse=reverse)
+        start = params.get("ExclusiveStartKey")
+        if start is not None:
+            position = order(_to_store(start))
+            candidates = [
+                item
+                for item in candidates
+                if (order(item) < position if reverse else order(item) > position)
+            ]
+        limit = params.get("Limit")
+        page = candidates if limit is None else candidates[:limit]
+        names = params.get("ExpressionAttributeNames", {})
+        items = [
+            item
+            for item in page
+            if "FilterExpression" not in params
+            or matches(params["FilterExpression"], item, names, values)
+        ]
+        response = {"Count": len(items), "ScannedCount": len(page)}
+        if params.get("Select") != "COUNT":
+            response["Items"] = [
+                _project(item, params.get("ProjectionExpression"), names)
+                for item in items
+            ]
+        if limit is not None and len(candidates) > limit:
+            last = page[-1]
+            response["LastEvaluatedKey"] = {
+                name: _copy(last[name]) for name in dict.fromkeys(table.key + key)
+            }
+        return response
+
+
+class MemoryTable:
+    # Counterpart of boto3's dynamodb.Table resource
+    def __init__(self, client, name):
+        self.meta = _Meta(client=client)
+        self.name = name
+        self.table_name = name
+
+    def _params(self, params):
+        return {"TableName": self.name, **params}
+
+    def get_item(self, **params):
+        return self.meta.client.get_item(**self._params(params))
+
+    def put_item(self, **params):
+        return self.meta.client.put_item(**self._params(params))
+
+    def update_item(self, **params):
+        return self.meta.client.update_item(**self._params(params))
+
+    def delete_item(self, **params):
+        return self.meta.client.delete_item(**self._params(params))
+
+    def query(self, **params):
+        return self.meta.client.query(**self._params(params))
+
+    def scan(self, **params):
+        return self.meta.client.scan(**self._params(params))
+
+
+class MemoryDynamoDBResource:
+    def __init__(self, client):
+        self.meta = _Meta(client=client)
+
+    def Table(self, name):  # pylint: disable=invalid-name
+        return MemoryTable(self.meta.client, name)
+
+    def batch_get_item(self, **params):
+        return self.meta.client.batch_get_item(**params)
+
+    def batch_write_item(self, **params):
+        return self.meta.client.batch_write_item(**params)
+
+
+class _Message:
+    def __init__(self, body, attributes, visible_at):
+        self.message_id = str(uuid.uuid4())
+        self.body = body
+        self.attributes = attributes or {}
+        self.visible_at = visible_at
+        self.sent_at = time.time()
+        self.receive_count = 0
+        self.receipt_handle = None
+
+
+class _Queue:
+    def __init__(self, name, url, attributes):
+        self.name = name
+        self.url = url
+        self.attributes = {
+            "VisibilityTimeout": str(DEFAULT_VISIBILITY_TIMEOUT),
+            "DelaySeconds": "0",
+            **(attributes or {}),
+        }
+        self.messages = OrderedDict()
+        self.receipts = {}
+        # FIFO queues: deduplication id -> (message, expiry)
+        self.deduplication = {}
+
+    @property
+    def fifo(self):
+        return self.attributes.get("FifoQueue") == "true"
+
+
+class MemorySQSClient:
+    def __init__(self, config=None):
+        self.meta = _Meta(config)
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def reset(self):
+        with self._lock:
+            self._queues.clear()
+
+    def _queue(self, url, operation_name):
+        for queue in self._queues.values():
+            if queue.url == url:
+                return queue
+        raise _error(
+            "AWS.SimpleQueueService.NonExistentQueue",
+            "The specified queue does not exist",
+            operation_name,
+        )
+
+    # queues
+
+    @_operation("CreateQueue")
+    def create_queue(self, **params):
+        name = params["QueueName"]
+        with self._lock:
+            if name not in self._queues:
+                self._queues[name] = _Queue(
+                    name, f"memory://sqs/000000000000/{name}", params.get("Attributes")
+                )
+            return {"QueueUrl": self._queues[name].url}
+
+    @_operation("GetQueueUrl")
+    def get_queue_url(self, **params):
+        with self._lock:
+            queue = self._queues.get(params["QueueName"])
+            if queue is None:
+                raise _error(
+                    "AWS.SimpleQueueService.NonExistentQueue",
+                    "The specified queue does not exist",
+                    "GetQueueUrl",
+                )
+            return {"QueueUrl": queue.url}
+
+    @_operation("DeleteQueue")
+    def delete_queue(self, **params):
+        with self._lock:
+            del self._queues[self._queue(params["QueueUrl"], "DeleteQueue").name]
+        return {}
+
+    @_operation("PurgeQueue")
+    def purge_queue(self, **params):
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "PurgeQueue")
+            queue.messages.clear()
+            queue.receipts.clear()
+        return {}
+
+    @_operation("GetQueueAttributes")
+    def get_queue_attributes(self, **params):
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "GetQueueAttributes")
+            messages = queue.messages.values()
+            in_flight = sum(
+                1 for m in messages if m.visible_at > now and m.receive_count
+            )
+            delayed = sum(
+                1 for m in messages if m.visible_at > now and not m.receive_count
+            )
+            attributes = {
+                **queue.attributes,
+                "QueueArn": f"arn:aws:sqs:memory:000000000000:{queue.name}",
+                "ApproximateNumberOfMessages": str(len(messages) - in_flight - delayed),
+                "ApproximateNumberOfMessagesNotVisible": str(in_flight),
+                "ApproximateNumberOfMessagesDelayed": str(delayed),
+            }
+        requested = params.get("AttributeNames", ["All"])
+        if "All" not in requested:
+            attributes = {k: v for k, v in attributes.items() if k in requested}
+        return {"Attributes": attributes}
+
+    @_operation("SetQueueAttributes")
+    def set_queue_attributes(self, **params):
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "SetQueueAttributes")
+            queue.attributes.update(params["Attributes"])
+        return {}
+
+    # messages
+
+    @_operation("SendMessage")
+    def send_message(self, **params):
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "SendMessage")
+            message = self._enqueue(queue, params, "SendMessage")
+            self._changed.notify_all()
+        return self._sent(message)
+
+    @_operation("SendMessageBatch")
+    def send_message_batch(self, **params):
+        entries = self._check_batch(params["Entries"], "SendMessageBatch")
+        sent = {}
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "SendMessageBatch")
+            response = self._each_entry(
+                entries,
+                lambda entry: sent.__setitem__(
+                    entry["Id"], self._enqueue(queue, entry, "SendMessageBatch")
+                ),
+            )
+            self._changed.notify_all()
+        for entry in response["Successful"]:
+            entry.update(self._sent(sent[entry["Id"]]))
+        return response
+
+    def _enqueue(self, queue, params, operation_name):
+        deduplication_id = None
+        if queue.fifo:
+            deduplication_id = self._fifo_checks(queue, params, operation_name)
+            duplicate, expires_at = queue.deduplication.get(deduplication_id, (None, 0))
+            if expires_at > time.monotonic():
+                # accepted but not delivered again, as SQS does
+                return duplicate
+        delay = params.get("DelaySeconds", int(queue.attributes["DelaySeconds"]))
+        message = _Message(
+            params["MessageBody"],
+            params.get("MessageAttributes"),
+            time.monotonic() + delay,
+        )
+        message.group_id = params.get("MessageGroupId")
+        queue.messages[message.message_id] = message
+        if deduplication_id is not None:
+            queue.deduplication[deduplication_id] = (
+                message,
+                time.monotonic() + FIFO_DEDUPLICATION_INTERVAL,
+            )
+        return message
+
+    @staticmethod
+    def _fifo_checks(queue, params, operation_name):
+        # returns the deduplication id of a message for a FIFO queue
+        if "MessageGroupId" not in params:
+            raise _error(
+                "MissingParameter",
+                "The request must contain the parameter MessageGroupId.",
+                operation_name,
+            )
+        if "DelaySeconds" in params:
+            raise _error(
+                "InvalidParameterValue",
+                "FIFO queues don't support per-message delays, only per-queue delays",
+                operation_name,
+            )
+        deduplication_id = params.get("MessageDeduplicationId")
+        if deduplication_id is None:
+            if queue.attributes.get("ContentBasedDeduplication") != "true":
+                raise _error(
+                    "InvalidParameterValue",
+                    "The queue should either have ContentBasedDeduplication "
+                    "enabled or MessageDeduplicationId provided explicitly",
+                    operation_name,
+                )
+            deduplication_id = hashlib.sha256(
+                params["MessageBody"].encode()
+            ).hexdigest()
+        return deduplication_id
+
+    @staticmethod
+    def _sent(message):
+        return {
+            "MessageId": message.message_id,
+            "MD5OfMessageBody": hashlib.md5(message.body.encode()).hexdigest(),
+        }
+
+    @_operation("ReceiveMessage")
+    def receive_message(self, **params):
+        max_messages = params.get("MaxNumberOfMessages", 1)
+        wait_time = params.get("WaitTimeSeconds", 0)
+        if not 1 <= max_messages <= SQS_BATCH_LIMIT or wait_time > SQS_MAX_WAIT_SECONDS:
+            raise _error(
+                "InvalidParameterValue",
+                "MaxNumberOfMessages or WaitTimeSeconds is out of range",
+                "ReceiveMessage",
+            )
+        deadline = time.monotonic() + wait_time
+        with self._lock:
+            while True:
+                queue = self._queue(params["QueueUrl"], "ReceiveMessage")
+                now = time.monotonic()
+                visible = self._receivable(queue, now)
+                if visible or now >= deadline:
+                    break
+                upcoming = [
+                    m.visible_at for m in queue.messages.values() if m.visible_at > now
+                ]
+                self._changed.wait(min([deadline] + upcoming) - now)
+
+            timeout = params.get(
+                "VisibilityTimeout", int(queue.attributes["VisibilityTimeout"])
+            )
+            received = visible[:max_messages]
+            for message in received:
+                message.receive_count += 1
+                message.visible_at = now + timeout
+                # only the latest receipt handle of a message stays valid
+                queue.receipts.pop(message.receipt_handle, None)
+                message.receipt_handle = str(uuid.uuid4())
+                queue.receipts[message.receipt_handle] = message.message_id
+            if not received:
+                return {}
+            return {
+                "Messages": [self._received(message, params) for message in received]
+            }
+
+    @staticmethod
+    def _receivable(queue, now):
+        if not queue.fifo:
+            return [m for m in queue.messages.values() if m.visible_at <= now]
+        # a message group is held back while one of its messages is in flight
+        blocked = {
+            m.group_id
+            for m in queue.messages.values()
+            if m.visible_at > now and m.receive_count
+        }
+        return [
+            m
+            for m in queue.messages.values()
+            if m.visible_at <= now and m.group_id not in blocked
+        ]
+
+    @staticmethod
+    def _received(message, params):
+        result = {
+            "MessageId": message.message_id,
+            "ReceiptHandle": message.receipt_handle,
+            "MD5OfBody": hashlib.md5(message.body.encode()).hexdigest(),
+            "Body": message.body,
+        }
+        if params.get("AttributeNames"):
+            result["Attributes"] = {
+                "ApproximateReceiveCount": str(message.receive_count),
+                "SentTimestamp": str(int(message.sent_at * 1000)),
+            }
+        requested = params.get("MessageAttributeNames")
+        if requested and message.attributes:
+            result["MessageAttributes"] = {
+                name: value
+                for name, value in message.attributes.items()
+                if "All" in requested or ".*" in requested or name in requested
+            }
+        return result
+
+    @_operation("DeleteMessage")
+    def delete_message(self, **params):
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "DeleteMessage")
+            self._delete(queue, params["ReceiptHandle"], "DeleteMessage")
+        return {}
+
+    @_operation("DeleteMessageBatch")
+    def delete_message_batch(self, **params):
+        entries = self._check_batch(params["Entries"], "DeleteMessageBatch")
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "DeleteMessageBatch")
+            return self._each_entry(
+                entries,
+                lambda entry: self._delete(
+                    queue, entry["ReceiptHandle"], "DeleteMessageBatch"
+                ),
+            )
+
+    @_operation("ChangeMessageVisibility")
+    def change_message_visibility(self, **params):
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "ChangeMessageVisibility")
+            self._change_visibility(queue, params, "ChangeMessageVisibility")
+            self._changed.notify_all()
+        return {}
+
+    @_operation("ChangeMessageVisibilityBatch")
+    def change_message_visibility_batch(self, **params):
+        entries = self._check_batch(params["Entries"], "ChangeMessageVisibilityBatch")
+        with self._lock:
+            queue = self._queue(params["QueueUrl"], "ChangeMessageVisibilityBatch")
+            response = self._each_entry(
+                entries,
+                lambda entry: self._change_visibility(
+                    queue, entry, "ChangeMessageVisibilityBatch"
+                ),
+            )
+            self._changed.notify_all()
+            return response
+
+    def _delete(self, queue, receipt_handle, operation_name):
+        message_id = queue.receipts.pop(receipt_handle, None)
+        if message_id is None:
+            raise _error(
+                "ReceiptHandleIsInvalid",
+                "The input receipt handle is invalid",
+                operation_name,
+            )
+        queue.messages.pop(message_id, None)
+
+    def _change_visibility(self, queue, params, operation_name):
+        message = queue.messages.get(queue.receipts.get(params["ReceiptHandle"]))
+        if message is None or message.visible_at <= time.monotonic():
+            raise _error(
+                "MessageNotInflight",
+                "The message referred to is not in flight",
+                operation_name,
+            )
+        message.visible_at = time.monotonic() + params["VisibilityTimeout"]
+
+    @staticmethod
+    def _check_batch(entries, operation_name):
+        if len(entries) > SQS_BATCH_LIMIT:
+            raise _error(
+                "AWS.SimpleQueueService.TooManyEntriesInBatchRequest",
+                f"Maximum number of entries per request are {SQS_BATCH_LIMIT}",
+                operation_name,
+            )
+        if len({entry["Id"] for entry in entries}) != len(entries):
+            raise _error(
+                "AWS.SimpleQueueService.BatchEntryIdsNotDistinct",
+                "Two or more batch entries in the request have the same Id",
+                operation_name,
+            )
+        return entries
+
+    @staticmethod
+    def _each_entry(entries, action):
+        successful, failed = [], []
+        for entry in entries:
+            try:
+                action(entry)
+            except ClientError as exc:
+                failed.append(
+                    {
+                        "Id": entry["Id"],
+                        "SenderFault": True,
+                        "Code": exc.response["Error"]["Code"],
+                        "Message": exc.response["Error"]["Message"],
+                    }
+                )
+            else:
+                successful.append({"Id": entry["Id"]})
+        return {"Successful": successful, "Failed": failed}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_CLIENT_TYPES = {"dynamodb": MemoryDynamoDBClient, "sqs": MemorySQSClient}
+
+
+def client(service_name, config=None):
+    # one client, and so one set of tables or queues, per service and process
+    with _clients_lock:
+        if service_name not in _clients:
+            _clients[service_name] = _CLIENT_TYPES[service_name](config)
+        return _clients[service_name]
+
+
+def resource(config=None):
+    return MemoryDynamoDBResource(client("dynamodb", config))
+
+
+def reset():
+    # drops every table and queue of the process
+    with _clients_lock:
+        for memory_client in _clients.values():
+            memory_client.reset()
@@ -0,0 +1,23 @@
+import argparse
+
+from .db import get_client
+from .repository import ShippingRepository
+from .schema import migrate_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bring the tables and the shipping items up to the current "
+        "schema: add missing tables and indexes, then backfill the attributes "
+        "the indexes are keyed on."
+    )
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    migrate_tables(get_client("dynamodb"), poll_interval=args.poll_interval)
+    updated = ShippingRepository().backfill_index_attributes()
+    print(f"backfilled {updated} shipping items")
+
+
+if __name__ == "__main__":
+    main()
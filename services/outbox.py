@@ -0,0 +1,130 @@
+import logging
+import threading
+
+from boto3.dynamodb.conditions import Attr
+
+from .items import from_timestamp
+from .repository import ShippingTransitionRejected
+from .service import ShippingService
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        repository,
+        publisher,
+        batch_size: int = 100,
+        interval=1.0,
+        status_cache=None,
+        scheduler=None,
+    ):
+        self.repository = repository
+        self.publisher = publisher
+        # the ShippingScheduler of the service, if it defers shippings
+        self.scheduler = scheduler
+        self.status_cache = status_cache
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def drain_once(self):
+        return self._drain_batch()[0]
+
+    def _drain_batch(self):
+        # (published shipping ids, records read, records removed)
+        records = self.repository.get_outbox(self.batch_size)
+        shipping_ids = [record["shipping_id"] for record in records]
+        if not shipping_ids:
+            return [], 0, 0
+
+        # The status moves out of created before the message is visible to
+        # workers, so a worker can never have its result overwritten by the
+        # relay. A shipping that already left created was published by an
+        # earlier pass whose outbox delete did not go through; its record is
+        # only deleted.
+        to_publish = []
+        already_published = []
+        for shipping_id in shipping_ids:
+            try:
+                self.repository.update_shipping_status(
+                    shipping_id,
+                    ShippingService.SHIPPING_IN_PROGRESS,
+                    Attr("shipping_status").eq(ShippingService.SHIPPING_CREATED),
+                )
+            except ShippingTransitionRejected:
+                already_published.append(shipping_id)
+            else:
+                to_publish.append(shipping_id)
+            if self.status_cache is not None:
+                self.status_cache.invalidate(shipping_id)
+
+        message_ids = self._send(to_publish)
+        published = []
+        for shipping_id, message_id in zip(to_publish, message_ids):
+            if message_id is not None:
+                published.append(shipping_id)
+                continue
+            # back to created, so the next pass claims it again
+            try:
+                self.repository.update_shipping_status(
+                    shipping_id,
+                    ShippingService.SHIPPING_CREATED,
+                    Attr("shipping_status").eq(ShippingService.SHIPPING_IN_PROGRESS),
+                )
+            except ShippingTransitionRejected:
+                pass
+        done = published + already_published
+        failed = self.repository.delete_outbox(done)
+
+        return published, len(records), len(done) - len(failed)
+
+    def _send(self, shipping_ids):
+        if self.scheduler is None or not shipping_ids:
+            return self.publisher.send_new_shippings(shipping_ids)
+        # deferred shippings reach workers at their due date, as they do
+        # without the outbox
+        shippings = self.repository.get_shippings(shipping_ids, ["due_ts"])
+        return self.scheduler.schedule_many(
+            [
+                (shipping_id, from_timestamp(shippings[shipping_id]["due_ts"]))
+                for shipping_id in shipping_ids
+            ]
+        )
+
+    def drain(self):
+        # Stops at the first short page, or at a pass that removed nothing:
+        # records that cannot be published or deleted right now wait for
+        # the next run instead of being retried in a loop.
+        published = []
+        while True:
+            batch, read, removed = self._drain_batch()
+            published.extend(batch)
+            if read < self.batch_size or not removed:
+                return published
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="shipping-outbox-relay", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Outbox relay failed to drain the outbox")
+            self._stop.wait(self.interval)
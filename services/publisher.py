@@ -1,36 +1,265 @@
-import boto3
+import logging
+import threading
+import time
+from dataclasses import dataclass
 
-from .config import AWS_ENDPOINT_URL, AWS_REGION, SHIPPING_QUEUE
+from botocore.exceptions import ClientError
 
+from .config import SHIPPING_FIFO_QUEUE, SHIPPING_QUEUE
+from .db import get_client, get_queue_url
+from .instrumentation import instrument
 
+SEND_BATCH_SIZE = 10
+# longest DelaySeconds SQS accepts
+MAX_DELAY_SECONDS = 900
+FIFO_QUEUE_ATTRIBUTES = {"FifoQueue": "true"}
+
+logger = logging.getLogger(__name__)
+
+
+class ShippingNotPublished(RuntimeError):
+    def __init__(self, shipping_id):
+        super().__init__(f"Shipping {shipping_id} could not be published")
+        self.shipping_id = shipping_id
+
+
+@dataclass(frozen=True)
+class ShippingMessage:
+    shipping_id: str
+    receipt_handle: str
+    message_id: str
+    # wall clock time the shipping was scheduled to reach workers, if any
+    release_at: float = None
+
+
+@instrument
 class ShippingPublisher:
-    def __init__(self):
-        self.client = boto3.client(
-            "sqs",
-            endpoint_url=AWS_ENDPOINT_URL,
-            region_name=AWS_REGION,
-            aws_access_key_id="test",
-            aws_secret_access_key="test",
-        )
-        response = self.client.create_queue(QueueName=SHIPPING_QUEUE)
-        self.queue_url = response["QueueUrl"]
+    def __init__(self, fifo: bool = False):
+        # In FIFO mode the shipping id is the deduplication id, so publishing
+        # a shipping again within SQS' five minute deduplication interval
+        # sends nothing. Every shipping is its own message group: there is no
+        # ordering between shippings to keep, and workers are not held back.
+        self.client = get_client("sqs")
+        self.fifo = fifo
+        if fifo:
+            self.queue_url = get_queue_url(SHIPPING_FIFO_QUEUE, FIFO_QUEUE_ATTRIBUTES)
+        else:
+            self.queue_url = get_queue_url(SHIPPING_QUEUE)
 
     def send_new_shipping(self, shipping_id: str):
         response = self.client.send_message(
-            QueueUrl=self.queue_url, MessageBody=shipping_id
+            QueueUrl=self.queue_url, **self._message(shipping_id)
         )
 
         return response["MessageId"]
 
-    def poll_shipping(self, batch_size: int = 10):
+    def send_new_shippings(self, shipping_ids: list):
+        # message ids in input order, None for entries SQS did not accept
+        return self._send_batches(
+            [self._message(shipping_id) for shipping_id in shipping_ids]
+        )
+
+    def send_scheduled_shippings(self, schedule: list):
+        # (shipping_id, release_at) pairs; every message stays invisible until
+        # its release time, at most MAX_DELAY_SECONDS from now. Message ids in
+        # input order, None for entries SQS did not accept.
+        if self.fifo:
+            raise ValueError("FIFO queues do not support per-message delays")
+        now = time.time()
+        return self._send_batches(
+            [
+                {
+                    "MessageBody": shipping_id,
+                    "DelaySeconds": min(
+                        MAX_DELAY_SECONDS, max(0, int(release_at - now))
+                    ),
+                    "MessageAttributes": {
+                        "release_at": {
+                            "DataType": "Number",
+                            "StringValue": f"{release_at:.3f}",
+                        }
+                    },
+                }
+                for shipping_id, release_at in schedule
+            ]
+        )
+
+    def _message(self, shipping_id):
+        if not self.fifo:
+            return {"MessageBody": shipping_id}
+        return {
+            "MessageBody": shipping_id,
+            "MessageGroupId": shipping_id,
+            "MessageDeduplicationId": shipping_id,
+        }
+
+    def _send_batches(self, messages):
+        message_ids = []
+        for start in range(0, len(messages), SEND_BATCH_SIZE):
+            chunk = messages[start : start + SEND_BATCH_SIZE]
+            try:
+                response = self.client.send_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {"Id": str(index), **message}
+                        for index, message in enumerate(chunk)
+                    ],
+                )
+            except ClientError:
+                response = {}
+            sent = {
+                int(entry["Id"]): entry["MessageId"]
+                for entry in response.get("Successful", [])
+            }
+            message_ids.extend(sent.get(index) for index in range(len(chunk)))
+
+        return message_ids
+
+    def poll_shipping(self, batch_size: int = 10, wait_time: int = 10):
+        messages = self.poll_shipping_messages(batch_size, wait_time)
+
+        return [message.shipping_id for message in messages]
+
+    def poll_shipping_messages(
+        self, batch_size: int = 10, wait_time: int = 10, visibility_timeout=None
+    ):
+        params = {}
+        if visibility_timeout is not None:
+            params["VisibilityTimeout"] = visibility_timeout
         messages = self.client.receive_message(
             QueueUrl=self.queue_url,
             MessageAttributeNames=["All"],
             MaxNumberOfMessages=batch_size,
-            WaitTimeSeconds=10,
+            WaitTimeSeconds=wait_time,
+            **params,
         )
 
         if "Messages" not in messages:
             return []
 
-        return [msg["Body"] for msg in messages["Messages"]]
+        return [
+            ShippingMessage(
+                msg["Body"],
+                msg["ReceiptHandle"],
+                msg["MessageId"],
+                _release_at(msg),
+            )
+            for msg in messages["Messages"]
+        ]
+
+    def delete_shippings(self, messages: list):
+        # returns the messages that could not be deleted
+        return self._batch_messages(
+            self.client.delete_message_batch,
+            messages,
+            lambda message: {},
+        )
+
+    def extend_visibility(self, messages: list, visibility_timeout: int):
+        # returns the messages whose visibility could not be changed
+        return self._batch_messages(
+            self.client.change_message_visibility_batch,
+            messages,
+            lambda message: {"VisibilityTimeout": visibility_timeout},
+        )
+
+    def _batch_messages(self, operation, messages, extra):
+        failed = []
+        for start in range(0, len(messages), SEND_BATCH_SIZE):
+            chunk = messages[start : start + SEND_BATCH_SIZE]
+            entries = [
+                {
+                    "Id": str(index),
+                    "ReceiptHandle": message.receipt_handle,
+                    **extra(message),
+                }
+                for index, message in enumerate(chunk)
+            ]
+            try:
+                response = operation(QueueUrl=self.queue_url, Entries=entries)
+            except ClientError:
+                failed.extend(chunk)
+                continue
+            failed.extend(
+                chunk[int(entry["Id"])] for entry in response.get("Failed", [])
+            )
+
+        return failed
+
+
+def _release_at(message):
+    attribute = message.get("MessageAttributes", {}).get("release_at")
+    return None if attribute is None else float(attribute["StringValue"])
+
+
+class VisibilityHeartbeat:
+    def __init__(self, publisher, visibility_timeout: int = 30, interval=None):
+        self.publisher = publisher
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval or visibility_timeout / 3
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, message):
+        with self._lock:
+            self._deadlines[message] = time.monotonic() + self.visibility_timeout
+
+    def untrack(self, message):
+        with self._lock:
+            self._deadlines.pop(message, None)
+
+    def beat(self):
+        # Extend every message that would become visible again before the
+        # next beat has a chance to run.
+        now = time.monotonic()
+        with self._lock:
+            expiring = [
+                message
+                for message, deadline in self._deadlines.items()
+                if deadline - now <= 2 * self.interval
+            ]
+        if not expiring:
+            return []
+
+        failed = set(
+            self.publisher.extend_visibility(expiring, self.visibility_timeout)
+        )
+        deadline = now + self.visibility_timeout
+        with self._lock:
+            for message in expiring:
+                if message in self._deadlines and message not in failed:
+                    self._deadlines[message] = deadline
+
+        return [message for message in expiring if message not in failed]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="shipping-visibility-heartbeat", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.beat()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to extend shipping message visibility")
@@ -1,48 +1,611 @@
-from .config import SHIPPING_TABLE_NAME
+import heapq
+import threading
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+from .cache import LRUStatusCache
+from .config import (
+    IDEMPOTENCY_TABLE_NAME,
+    IDEMPOTENCY_TTL_SECONDS,
+    INVENTORY_TABLE_NAME,
+    SHIPPING_OUTBOX_TABLE_NAME,
+    SHIPPING_TABLE_NAME,
+)
 from .db import get_dynamodb_resource
+from .ids import UUID7Generator, new_id
+from .items import (
+    ITEM_VERSION,
+    decode_item,
+    encode_product_ids,
+    from_timestamp,
+    stored_attributes,
+    to_timestamp,
+)
+from .instrumentation import instrument
+from .schema import (
+    ORDER_SHIPPINGS_INDEX,
+    RECENT_SHIPPINGS_INDEX,
+    RECENT_SHIPPINGS_SHARDS,
+    STATUS_DUE_INDEX,
+)
+
+from boto3.dynamodb.conditions import Attr, Key
+from datetime import datetime, timedelta, timezone
+
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+BATCH_RETRIES = 5
+BATCH_RETRY_DELAY = 0.05
+TRANSACT_WRITE_SIZE = 100
+QUERY_PAGE_SIZE = 100
+
+
+class ShippingTransitionRejected(ValueError):
+    def __init__(self, shipping_id, status):
+        super().__init__(f"Shipping {shipping_id} cannot move to {status}")
+        self.shipping_id = shipping_id
+        self.status = status
 
-from uuid import uuid4
-from datetime import datetime, timezone
 
+def recent_shard(created_day: str, shard: int):
+    # created_shard key of RECENT_SHIPPINGS_INDEX
+    return f"{created_day}#{shard}"
 
-class ShippingRepository:
+
+def created_shard(created_day: str, shipping_id: str):
+    shard = zlib.crc32(shipping_id.encode()) % RECENT_SHIPPINGS_SHARDS
+    return recent_shard(created_day, shard)
+
+
+class _ThreadTables:
+    # Resources are not thread-safe, so a repository shared by worker
+    # threads resolves its tables through the resource of the calling thread
+    # on every use; the Table objects are kept per thread.
 
     def __init__(self):
-        dynamo_resource = get_dynamodb_resource()
-        self.table = dynamo_resource.Table(SHIPPING_TABLE_NAME)
+        self._local = threading.local()
 
-    def get_shipping(self, shipping_id):
-        response = self.table.get_item(Key={"shipping_id": shipping_id})
-        return response.get("Item")
+    @property
+    def resource(self):
+        return get_dynamodb_resource()
 
-    def create_shipping(
-        self,
+    def _table(self, name):
+        resource = get_dynamodb_resource()
+        local = self._local
+        if getattr(local, "resource", None) is not resource:
+            local.resource = resource
+            local.tables = {}
+        table = local.tables.get(name)
+        if table is None:
+            table = local.tables[name] = resource.Table(name)
+        return table
+
+
+class StockUnavailable(ValueError):
+    def __init__(self, available):
+        # product_id -> stock left for every product that could not be taken
+        products = ", ".join(f"{p} ({a} left)" for p, a in available.items())
+        super().__init__(f"Not enough stock: {products}")
+        self.available = available
+
+
+@instrument
+class ShippingRepository(_ThreadTables):
+
+    @property
+    def table(self):
+        return self._table(SHIPPING_TABLE_NAME)
+
+    @property
+    def outbox_table(self):
+        return self._table(SHIPPING_OUTBOX_TABLE_NAME)
+
+    @property
+    def idempotency_table(self):
+        return self._table(IDEMPOTENCY_TABLE_NAME)
+
+    def get_shipping(self, shipping_id, consistent=False):
+        response = self.table.get_item(
+            Key={"shipping_id": shipping_id}, ConsistentRead=consistent
+        )
+        return decode_item(response.get("Item"))
+
+    def get_shippings(self, shipping_ids: list, attributes: list = None):
+        # shipping_id -> item for every id that exists
+        params = {}
+        if attributes:
+            attributes = ["shipping_id"] + [
+                a for a in stored_attributes(attributes) if a != "shipping_id"
+            ]
+            names = {f"#a{i}": name for i, name in enumerate(attributes)}
+            params["ProjectionExpression"] = ", ".join(names)
+            params["ExpressionAttributeNames"] = names
+
+        items = {}
+        keys = [
+            {"shipping_id": shipping_id} for shipping_id in dict.fromkeys(shipping_ids)
+        ]
+        for start in range(0, len(keys), BATCH_GET_SIZE):
+            pending = {"Keys": keys[start : start + BATCH_GET_SIZE], **params}
+            for attempt in range(BATCH_RETRIES):
+                response = self.resource.batch_get_item(
+                    RequestItems={self.table.name: pending}
+                )
+                for item in response.get("Responses", {}).get(self.table.name, []):
+                    items[item["shipping_id"]] = decode_item(item)
+                pending = response.get("UnprocessedKeys", {}).get(self.table.name)
+                if not pending:
+                    break
+                time.sleep(BATCH_RETRY_DELAY * 2**attempt)
+            else:
+                for key in pending["Keys"]:
+                    item = self.table.get_item(Key=key, **params).get("Item")
+                    if item:
+                        items[item["shipping_id"]] = decode_item(item)
+
+        return items
+
+    @staticmethod
+    def build_item(
         shipping_type: str,
         product_ids: list,
         order_id: str,
         status: str,
         due_date: datetime,
     ):
-        shipping_id = str(uuid4())
-        item = {
+        created_date = datetime.now(timezone.utc)
+        shipping_id = new_id()
+        created_day = created_date.strftime("%Y-%m-%d")
+        return {
             "shipping_id": shipping_id,
+            "item_version": ITEM_VERSION,
             "shipping_type": shipping_type,
             "order_id": order_id,
-            "product_ids": ",".join(product_ids),
+            "order_key": str(order_id),
+            **encode_product_ids(product_ids),
             "shipping_status": status,
-            "created_date": datetime.now(timezone.utc).isoformat(),
-            "due_date": due_date.replace(tzinfo=timezone.utc).isoformat(),
+            "created_ts": to_timestamp(created_date),
+            "created_day": created_day,
+            "created_shard": created_shard(created_day, shipping_id),
+            "due_ts": to_timestamp(due_date),
         }
+
+    def get_recent_shippings(self, since: datetime, limit: int = 100):
+        # newest first; relies on the time-ordered ids of UUID7Generator
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        since = since.astimezone(timezone.utc)
+        lower_bound = UUID7Generator.lower_bound(since)
+        day = datetime.now(timezone.utc).date()
+        items = []
+        while day >= since.date() and len(items) < limit:
+            # the newest of every shard, merged; at most limit items are
+            # needed from any one shard
+            shards = [
+                self._recent_shard_items(
+                    recent_shard(day.isoformat(), shard),
+                    lower_bound,
+                    limit - len(items),
+                )
+                for shard in range(RECENT_SHIPPINGS_SHARDS)
+            ]
+            merged = heapq.merge(
+                *shards, key=lambda item: item["shipping_id"], reverse=True
+            )
+            items.extend(item for _, item in zip(range(limit - len(items)), merged))
+            day -= timedelta(days=1)
+
+        return items
+
+    def _recent_shard_items(self, shard_key, lower_bound, limit):
+        params = {
+            "IndexName": RECENT_SHIPPINGS_INDEX,
+            "KeyConditionExpression": Key("created_shard").eq(shard_key)
+            & Key("shipping_id").gte(lower_bound),
+            "ScanIndexForward": False,
+        }
+        items = []
+        while len(items) < limit:
+            response = self.table.query(Limit=limit - len(items), **params)
+            items.extend(map(decode_item, response.get("Items", [])))
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return items
+
+    def iter_order_shippings(self, order_id, page_size: int = QUERY_PAGE_SIZE):
+        # in creation order; pages are read as the caller iterates
+        return self._query(
+            ORDER_SHIPPINGS_INDEX, Key("order_key").eq(str(order_id)), page_size
+        )
+
+    def iter_shippings_by_status(
+        self,
+        status: str,
+        due_from: datetime = None,
+        due_until: datetime = None,
+        page_size: int = QUERY_PAGE_SIZE,
+    ):
+        # earliest due first, both due date bounds included
+        condition = Key("shipping_status").eq(status)
+        due_ts = Key("due_ts")
+        if due_from is not None and due_until is not None:
+            condition &= due_ts.between(to_timestamp(due_from), to_timestamp(due_until))
+        elif due_from is not None:
+            condition &= due_ts.gte(to_timestamp(due_from))
+        elif due_until is not None:
+            condition &= due_ts.lte(to_timestamp(due_until))
+        return self._query(STATUS_DUE_INDEX, condition, page_size)
+
+    def query_page(
+        self, index_name: str, key_condition, limit: int, start_key: dict = None
+    ):
+        # one page of an index query and the key to continue from, None after
+        # the last page
+        params = {}
+        if start_key is not None:
+            params["ExclusiveStartKey"] = start_key
+        response = self.table.query(
+            IndexName=index_name,
+            KeyConditionExpression=key_condition,
+            Limit=limit,
+            **params,
+        )
+        return response.get("Items", []), response.get("LastEvaluatedKey")
+
+    def _query(self, index_name, key_condition, page_size):
+        start_key = None
+        while True:
+            items, start_key = self.query_page(
+                index_name, key_condition, page_size, start_key
+            )
+            yield from map(decode_item, items)
+            if start_key is None:
+                return
+
+    def create_shipping(
+        self,
+        shipping_type: str,
+        product_ids: list,
+        order_id: str,
+        status: str,
+        due_date: datetime,
+    ):
+        item = self.build_item(shipping_type, product_ids, order_id, status, due_date)
         self.table.put_item(Item=item)
-        return shipping_id
+        return item["shipping_id"]
 
-    def update_shipping_status(self, shipping_id, status):
-        response = self.table.update_item(
-            Key={
-                "shipping_id": shipping_id,
+    def create_shipping_with_outbox(
+        self,
+        shipping_type: str,
+        product_ids: list,
+        order_id: str,
+        status: str,
+        due_date: datetime,
+    ):
+        item = self.build_item(shipping_type, product_ids, order_id, status, due_date)
+        outbox_record = {
+            "shipping_id": item["shipping_id"],
+            "created_ts": item["created_ts"],
+        }
+        self.resource.meta.client.transact_write_items(
+            TransactItems=[
+                {"Put": {"TableName": self.table.name, "Item": item}},
+                {"Put": {"TableName": self.outbox_table.name, "Item": outbox_record}},
+            ]
+        )
+        return item["shipping_id"]
+
+    def create_shipping_once(
+        self,
+        idempotency_key: str,
+        shipping_type: str,
+        product_ids: list,
+        order_id: str,
+        status: str,
+        due_date: datetime,
+        with_outbox: bool = False,
+    ):
+        # The shipping is written together with an idempotency record that
+        # may only be put if the key is new or expired, so retries under one
+        # key create one shipping. Returns (shipping_id, created); for a known
+        # key that is the shipping created the first time.
+        item = self.build_item(shipping_type, product_ids, order_id, status, due_date)
+        now = int(time.time())
+        record = {
+            "idempotency_key": idempotency_key,
+            "shipping_id": item["shipping_id"],
+            "created_ts": item["created_ts"],
+            "expires_at": now + IDEMPOTENCY_TTL_SECONDS,
+        }
+        writes = [
+            {
+                "Put": {
+                    "TableName": self.idempotency_table.name,
+                    "Item": record,
+                    "ConditionExpression": "attribute_not_exists(idempotency_key)"
+                    " OR expires_at < :now",
+                    "ExpressionAttributeValues": {":now": now},
+                }
             },
-            UpdateExpression="SET shipping_status = :sh_status",
-            ExpressionAttributeValues={":sh_status": status},
+            {"Put": {"TableName": self.table.name, "Item": item}},
+        ]
+        if with_outbox:
+            outbox_record = {
+                "shipping_id": item["shipping_id"],
+                "created_ts": item["created_ts"],
+            }
+            writes.append(
+                {"Put": {"TableName": self.outbox_table.name, "Item": outbox_record}}
+            )
+        try:
+            self.resource.meta.client.transact_write_items(TransactItems=writes)
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            shipping_id = self.get_idempotent_shipping_id(idempotency_key)
+            if shipping_id is None:
+                # cancelled by a conflicting write, not by a known key
+                raise
+            return shipping_id, False
+
+        return item["shipping_id"], True
+
+    def get_idempotent_shipping_id(self, idempotency_key: str):
+        response = self.idempotency_table.get_item(
+            Key={"idempotency_key": idempotency_key}, ConsistentRead=True
         )
+        record = response.get("Item")
+        if record is None or record["expires_at"] < int(time.time()):
+            return None
+        return record["shipping_id"]
+
+    def backfill_index_attributes(self, table=None, page_size: int = QUERY_PAGE_SIZE):
+        # Fills in order_key, due_ts and created_shard on items written before
+        # the indexes keyed on them existed, so that list_order_shippings, the
+        # status and due date queries and get_recent_shippings see every
+        # shipping. Run after schema.migrate_tables(); safe to run again.
+        # Returns the number of updated items.
+        table = table or self.table
+        params = {
+            "FilterExpression": Attr("order_key").not_exists()
+            | Attr("due_ts").not_exists()
+            | Attr("created_shard").not_exists(),
+            "Limit": page_size,
+        }
+        updated = 0
+        while True:
+            response = table.scan(**params)
+            for item in response.get("Items", []):
+                attributes = self._index_attributes(item)
+                if not attributes:
+                    continue
+                try:
+                    table.update_item(
+                        Key={"shipping_id": item["shipping_id"]},
+                        UpdateExpression="SET "
+                        + ", ".join(f"{name} = :{name}" for name in attributes),
+                        ConditionExpression="attribute_exists(shipping_id)",
+                        ExpressionAttributeValues={
+                            f":{name}": value for name, value in attributes.items()
+                        },
+                    )
+                except ClientError as exc:
+                    # deleted since the scan read it
+                    if (
+                        exc.response["Error"]["Code"]
+                        != "ConditionalCheckFailedException"
+                    ):
+                        raise
+                    continue
+                updated += 1
+            if "LastEvaluatedKey" not in response:
+                return updated
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    @staticmethod
+    def _index_attributes(item):
+        attributes = {}
+        if "order_key" not in item and "order_id" in item:
+            attributes["order_key"] = str(item["order_id"])
+        if "due_ts" not in item and "due_date" in item:
+            attributes["due_ts"] = to_timestamp(
+                datetime.fromisoformat(item["due_date"])
+            )
+        if "created_shard" not in item:
+            if "created_day" in item:
+                day = item["created_day"]
+            elif "created_ts" in item:
+                day = from_timestamp(item["created_ts"]).strftime("%Y-%m-%d")
+            elif "created_date" in item:
+                created_date = datetime.fromisoformat(item["created_date"])
+                if created_date.tzinfo is not None:
+                    created_date = created_date.astimezone(timezone.utc)
+                day = created_date.strftime("%Y-%m-%d")
+            else:
+                return attributes
+            attributes["created_shard"] = created_shard(day, item["shipping_id"])
+        return attributes
+
+    def get_outbox(self, limit: int = 100):
+        response = self.outbox_table.scan(Limit=limit)
+        return response.get("Items", [])
+
+    def delete_outbox(self, shipping_ids: list):
+        requests = [
+            {"DeleteRequest": {"Key": {"shipping_id": shipping_id}}}
+            for shipping_id in shipping_ids
+        ]
+        unprocessed = self.batch_write(requests, self.outbox_table)
+        return [
+            request["DeleteRequest"]["Key"]["shipping_id"] for request in unprocessed
+        ]
+
+    def create_shippings(self, shippings: list, status: str):
+        # shippings are dicts of create_shipping arguments; the result keeps
+        # their order and holds None for every item that was not written
+        items = [
+            self.build_item(
+                shipping["shipping_type"],
+                shipping["product_ids"],
+                shipping["order_id"],
+                status,
+                shipping["due_date"],
+            )
+            for shipping in shippings
+        ]
+        unprocessed = self.batch_write([{"PutRequest": {"Item": i}} for i in items])
+        failed = {
+            request["PutRequest"]["Item"]["shipping_id"] for request in unprocessed
+        }
+
+        return [
+            None if item["shipping_id"] in failed else item["shipping_id"]
+            for item in items
+        ]
+
+    def batch_write(self, requests: list, table=None):
+        table = table or self.table
+        unprocessed = []
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            pending = requests[start : start + BATCH_WRITE_SIZE]
+            for attempt in range(BATCH_RETRIES):
+                try:
+                    response = self.resource.batch_write_item(
+                        RequestItems={table.name: pending}
+                    )
+                except ClientError:
+                    break
+                pending = response.get("UnprocessedItems", {}).get(table.name, [])
+                if not pending:
+                    break
+                time.sleep(BATCH_RETRY_DELAY * 2**attempt)
+            unprocessed.extend(pending)
+
+        return unprocessed
+
+    def update_shipping_status(self, shipping_id, status, condition=None):
+        params = {}
+        if condition is not None:
+            params = {"ConditionExpression": condition, "ReturnValues": "ALL_NEW"}
+        try:
+            response = self.table.update_item(
+                Key={
+                    "shipping_id": shipping_id,
+                },
+                UpdateExpression="SET shipping_status = :sh_status",
+                ExpressionAttributeValues={":sh_status": status},
+                **params,
+            )
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            raise ShippingTransitionRejected(shipping_id, status) from exc
 
         return response
+
+
+@instrument
+class InventoryRepository(_ThreadTables):
+
+    def __init__(self, stock_cache=None):
+        super().__init__()
+        # short-lived local view of hot products for availability checks;
+        # the conditional writes below stay the source of truth
+        if stock_cache is None:
+            stock_cache = LRUStatusCache(max_size=1000, ttl=1.0)
+        self.stock_cache = stock_cache
+
+    @property
+    def table(self):
+        return self._table(INVENTORY_TABLE_NAME)
+
+    def set_stock(self, product_id, amount: int):
+        self.table.put_item(Item={"product_id": product_id, "stock": int(amount)})
+        self.stock_cache.set(product_id, int(amount))
+
+    def get_stock(self, product_id, consistent=False):
+        stock = None if consistent else self.stock_cache.get(product_id)
+        if stock is None:
+            item = self.table.get_item(
+                Key={"product_id": product_id}, ConsistentRead=consistent
+            ).get("Item")
+            stock = int(item["stock"]) if item else 0
+            self.stock_cache.set(product_id, stock)
+        return stock
+
+    def is_available(self, product_id, amount: int):
+        return self.get_stock(product_id) >= amount
+
+    def add_stock(self, product_id, amount: int):
+        response = self.table.update_item(
+            Key={"product_id": product_id},
+            UpdateExpression="ADD stock :delta",
+            ExpressionAttributeValues={":delta": int(amount)},
+            ReturnValues="UPDATED_NEW",
+        )
+        stock = int(response["Attributes"]["stock"])
+        self.stock_cache.set(product_id, stock)
+        return stock
+
+    def take(self, product_id, amount: int):
+        # stock never goes below zero, the table rejects the decrement instead
+        try:
+            response = self.table.update_item(
+                Key={"product_id": product_id},
+                **self._take_expression(amount),
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            stock = self.get_stock(product_id, consistent=True)
+            raise StockUnavailable({product_id: stock}) from exc
+
+        stock = int(response["Attributes"]["stock"])
+        self.stock_cache.set(product_id, stock)
+        return stock
+
+    def take_all(self, lines: dict):
+        # product_id -> amount; every line is taken in one transaction or none is
+        if len(lines) > TRANSACT_WRITE_SIZE:
+            raise ValueError(f"Cannot take more than {TRANSACT_WRITE_SIZE} products")
+        try:
+            self.resource.meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Update": {
+                            "TableName": self.table.name,
+                            "Key": {"product_id": product_id},
+                            **self._take_expression(amount),
+                        }
+                    }
+                    for product_id, amount in lines.items()
+                ]
+            )
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            stocks = {p: self.get_stock(p, consistent=True) for p in lines}
+            unavailable = {p: s for p, s in stocks.items() if s < lines[p]}
+            if not unavailable:
+                # cancelled by a conflicting write, not by the stock condition
+                raise
+            raise StockUnavailable(unavailable) from exc
+        finally:
+            # the transaction returns no new values
+            for product_id in lines:
+                self.stock_cache.invalidate(product_id)
+
+    @staticmethod
+    def _take_expression(amount):
+        return {
+            "UpdateExpression": "ADD stock :delta",
+            "ConditionExpression": "stock >= :amount",
+            "ExpressionAttributeValues": {
+                ":delta": -int(amount),
+                ":amount": int(amount),
+            },
+        }
@@ -0,0 +1,213 @@
+import heapq
+import logging
+import threading
+import time
+
+from .consumer import StageStats
+from .instrumentation import instrument
+from .items import from_timestamp
+from .publisher import MAX_DELAY_SECONDS, ShippingNotPublished
+from .repository import QUERY_PAGE_SIZE
+from .service import ShippingService
+
+logger = logging.getLogger(__name__)
+
+# schedule result of a shipping kept by the scheduler until it is close enough
+# to its release time for an SQS delay
+DEFERRED = "deferred"
+
+
+@instrument
+class ShippingScheduler:
+    # Releases shippings to workers shortly before they are due instead of
+    # right away. Shippings within MAX_DELAY_SECONDS of their release time go
+    # straight to SQS with a matching DelaySeconds; later ones wait in a heap
+    # ordered by release time and are handed to SQS in batches as soon as
+    # they get within that range.
+    #
+    # The heap lives in this process only, while its shippings are already
+    # in progress in the table. Given the repository, start() re-seeds the
+    # heap from the status index, so a restart loses nothing; see recover().
+
+    def __init__(
+        self,
+        publisher,
+        lead=1.0,
+        max_delay=MAX_DELAY_SECONDS,
+        batch_window=1.0,
+        clock=time.time,
+        repository=None,
+    ):
+        self.publisher = publisher
+        self.repository = repository
+        # seconds before the due date a shipping reaches workers
+        self.lead = lead
+        self.max_delay = max_delay
+        # deferred shippings due this close together are handed over at once
+        self.batch_window = batch_window
+        self.clock = clock
+        self.stats = {"handoff": StageStats()}
+        self._heap = []
+        self._condition = threading.Condition()
+        self._retry_at = None
+        self._stopping = False
+        self._thread = None
+
+    def schedule(self, shipping_id, due_date):
+        # the message id or DEFERRED; raises if SQS did not accept the message
+        result = self.schedule_many([(shipping_id, due_date)])[0]
+        if result is None:
+            raise ShippingNotPublished(shipping_id)
+        return result
+
+    def schedule_many(self, shippings):
+        # (shipping_id, due_date) pairs; returns per shipping its message id,
+        # DEFERRED if it was kept for later or None if SQS did not accept it
+        now = self.clock()
+        results = [None] * len(shippings)
+        to_send = []
+        positions = []
+        with self._condition:
+            first = self._heap[0] if self._heap else None
+            for position, (shipping_id, due_date) in enumerate(shippings):
+                release_at = due_date.timestamp() - self.lead
+                if release_at - now > self.max_delay:
+                    heapq.heappush(self._heap, (release_at, shipping_id))
+                    results[position] = DEFERRED
+                else:
+                    to_send.append((shipping_id, release_at))
+                    positions.append(position)
+            if self._heap and self._heap[0] != first:
+                self._condition.notify()
+
+        if to_send:
+            message_ids = self.publisher.send_scheduled_shippings(to_send)
+            for position, message_id in zip(positions, message_ids):
+                results[position] = message_id
+
+        return results
+
+    def release_due(self):
+        # hands every deferred shipping that is now within the SQS delay range
+        # to the queue and returns their ids; failed ones are retried later
+        now = self.clock()
+        horizon = now + self.max_delay + self.batch_window
+        with self._condition:
+            due = []
+            while self._heap and self._heap[0][0] <= horizon:
+                due.append(heapq.heappop(self._heap))
+        if not due:
+            return []
+
+        try:
+            message_ids = self.publisher.send_scheduled_shippings(
+                [(shipping_id, release_at) for release_at, shipping_id in due]
+            )
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to hand %d shippings to the queue", len(due))
+            message_ids = [None] * len(due)
+        released = []
+        failed = []
+        for entry, message_id in zip(due, message_ids):
+            if message_id is None:
+                failed.append(entry)
+                continue
+            released.append(entry[1])
+            # lag of the hand-off behind the moment the shipping came within
+            # the SQS delay range
+            self.stats["handoff"].record(max(0.0, now - (entry[0] - self.max_delay)))
+        with self._condition:
+            for entry in failed:
+                heapq.heappush(self._heap, entry)
+            self._retry_at = now + self.batch_window if failed else None
+
+        return released
+
+    def recover(self):
+        # Schedules again every in progress shipping that is not deferred
+        # here. Shippings that became overdue while nothing ran go out without
+        # a delay, so workers fail them instead of leaving them in progress.
+        # Shippings released before the restart get a second message;
+        # processing only moves active shippings, so the duplicate is acked
+        # without effect. The index is eventually consistent, so shippings
+        # written a moment ago may be missed. Returns the number of shippings
+        # scheduled.
+        with self._condition:
+            deferred = {shipping_id for _, shipping_id in self._heap}
+        recovered = 0
+        batch = []
+        shippings = self.repository.iter_shippings_by_status(
+            ShippingService.SHIPPING_IN_PROGRESS
+        )
+        for shipping in shippings:
+            if shipping["shipping_id"] in deferred:
+                continue
+            batch.append((shipping["shipping_id"], from_timestamp(shipping["due_ts"])))
+            if len(batch) == QUERY_PAGE_SIZE:
+                recovered += self._schedule_recovered(batch)
+                batch = []
+        if batch:
+            recovered += self._schedule_recovered(batch)
+
+        return recovered
+
+    def _schedule_recovered(self, batch):
+        # shippings SQS did not accept are deferred and retried like failed
+        # hand-offs
+        results = self.schedule_many(batch)
+        with self._condition:
+            for (shipping_id, due_date), result in zip(batch, results):
+                if result is None:
+                    release_at = due_date.timestamp() - self.lead
+                    heapq.heappush(self._heap, (release_at, shipping_id))
+                    self._retry_at = self.clock() + self.batch_window
+        return len(batch)
+
+    def deferred_count(self):
+        with self._condition:
+            return len(self._heap)
+
+    def get_stats(self):
+        stats = {name: stage.snapshot() for name, stage in self.stats.items()}
+        stats["deferred"] = self.deferred_count()
+        return stats
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.repository is not None:
+            self.recover()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="shipping-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _next_wait(self):
+        # seconds until the first deferred shipping can be handed over, None
+        # while nothing is deferred
+        if not self._heap:
+            return None
+        wake_at = self._heap[0][0] - self.max_delay - self.batch_window
+        if self._retry_at is not None:
+            wake_at = max(wake_at, self._retry_at)
+        return max(0.0, wake_at - self.clock())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                wait = self._next_wait()
+                if not self._stopping and wait != 0.0:
+                    self._condition.wait(wait)
+                if self._stopping:
+                    return
+            self.release_due()
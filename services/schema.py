@@ -0,0 +1,154 @@
+import time
+
+from .config import (
+    IDEMPOTENCY_TABLE_NAME,
+    INVENTORY_TABLE_NAME,
+    SHIPPING_OUTBOX_TABLE_NAME,
+    SHIPPING_TABLE_NAME,
+)
+
+# shipping ids are time-ordered, so within a day they sort by creation time.
+# The hash key is created_shard, "<day>#<n>" with n picked from the shipping
+# id, so a day's writes spread over RECENT_SHIPPINGS_SHARDS partitions
+# instead of one; readers query every shard of a day and merge.
+RECENT_SHIPPINGS_INDEX = "RecentShippingsIndex"
+RECENT_SHIPPINGS_SHARDS = 8
+# shippings of one order in creation order; keyed by order_key, the order id
+# as a string, because order ids are not always strings
+ORDER_SHIPPINGS_INDEX = "OrderShippingsIndex"
+# shippings in one status ordered by due date; items written before item
+# version 2 have no due_ts and are not in it
+STATUS_DUE_INDEX = "StatusDueIndex"
+
+SHIPPING_TABLE = {
+    "TableName": SHIPPING_TABLE_NAME,
+    "KeySchema": [{"AttributeName": "shipping_id", "KeyType": "HASH"}],
+    "AttributeDefinitions": [
+        {"AttributeName": "shipping_id", "AttributeType": "S"},
+        {"AttributeName": "created_shard", "AttributeType": "S"},
+        {"AttributeName": "order_key", "AttributeType": "S"},
+        {"AttributeName": "shipping_status", "AttributeType": "S"},
+        {"AttributeName": "due_ts", "AttributeType": "N"},
+    ],
+    "GlobalSecondaryIndexes": [
+        {
+            "IndexName": RECENT_SHIPPINGS_INDEX,
+            "KeySchema": [
+                {"AttributeName": "created_shard", "KeyType": "HASH"},
+                {"AttributeName": "shipping_id", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+        },
+        {
+            "IndexName": ORDER_SHIPPINGS_INDEX,
+            "KeySchema": [
+                {"AttributeName": "order_key", "KeyType": "HASH"},
+                {"AttributeName": "shipping_id", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+        },
+        {
+            "IndexName": STATUS_DUE_INDEX,
+            "KeySchema": [
+                {"AttributeName": "shipping_status", "KeyType": "HASH"},
+                {"AttributeName": "due_ts", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+        },
+    ],
+    "BillingMode": "PAY_PER_REQUEST",
+}
+
+SHIPPING_OUTBOX_TABLE = {
+    "TableName": SHIPPING_OUTBOX_TABLE_NAME,
+    "KeySchema": [{"AttributeName": "shipping_id", "KeyType": "HASH"}],
+    "AttributeDefinitions": [{"AttributeName": "shipping_id", "AttributeType": "S"}],
+    "BillingMode": "PAY_PER_REQUEST",
+}
+
+INVENTORY_TABLE = {
+    "TableName": INVENTORY_TABLE_NAME,
+    "KeySchema": [{"AttributeName": "product_id", "KeyType": "HASH"}],
+    "AttributeDefinitions": [{"AttributeName": "product_id", "AttributeType": "S"}],
+    "BillingMode": "PAY_PER_REQUEST",
+}
+
+# idempotency_key -> shipping_id; expires_at (epoch seconds) can be used as
+# the table's TTL attribute
+IDEMPOTENCY_TABLE = {
+    "TableName": IDEMPOTENCY_TABLE_NAME,
+    "KeySchema": [{"AttributeName": "idempotency_key", "KeyType": "HASH"}],
+    "AttributeDefinitions": [
+        {"AttributeName": "idempotency_key", "AttributeType": "S"}
+    ],
+    "BillingMode": "PAY_PER_REQUEST",
+}
+
+TABLES = [SHIPPING_TABLE, SHIPPING_OUTBOX_TABLE, INVENTORY_TABLE, IDEMPOTENCY_TABLE]
+
+
+def create_tables(dynamo_client):
+    existing_tables = dynamo_client.list_tables()["TableNames"]
+    for table in TABLES:
+        if table["TableName"] in existing_tables:
+            continue
+        dynamo_client.create_table(**table)
+        dynamo_client.get_waiter("table_exists").wait(TableName=table["TableName"])
+
+
+def delete_tables(dynamo_client):
+    for table in TABLES:
+        dynamo_client.delete_table(TableName=table["TableName"])
+
+
+def migrate_tables(dynamo_client, tables=None, poll_interval=5.0):
+    # Brings tables made by earlier versions up to their definition here:
+    # missing tables are created, missing indexes added and indexes whose key
+    # changed rebuilt. DynamoDB takes one index change per UpdateTable and
+    # builds new indexes in the background, so every change waits for the
+    # table to settle. Attributes the new indexes are keyed on are filled in
+    # by ShippingRepository.backfill_index_attributes().
+    tables = TABLES if tables is None else tables
+    existing_tables = dynamo_client.list_tables()["TableNames"]
+    for table in tables:
+        name = table["TableName"]
+        if name not in existing_tables:
+            dynamo_client.create_table(**table)
+            dynamo_client.get_waiter("table_exists").wait(TableName=name)
+            continue
+        current = {
+            index["IndexName"]: index["KeySchema"]
+            for index in dynamo_client.describe_table(TableName=name)["Table"].get(
+                "GlobalSecondaryIndexes", []
+            )
+        }
+        for index in table.get("GlobalSecondaryIndexes", []):
+            key_schema = current.get(index["IndexName"])
+            if key_schema == index["KeySchema"]:
+                continue
+            if key_schema is not None:
+                dynamo_client.update_table(
+                    TableName=name,
+                    GlobalSecondaryIndexUpdates=[
+                        {"Delete": {"IndexName": index["IndexName"]}}
+                    ],
+                )
+                _wait_for_indexes(dynamo_client, name, poll_interval)
+            dynamo_client.update_table(
+                TableName=name,
+                AttributeDefinitions=table["AttributeDefinitions"],
+                GlobalSecondaryIndexUpdates=[{"Create": index}],
+            )
+            _wait_for_indexes(dynamo_client, name, poll_interval)
+
+
+def _wait_for_indexes(dynamo_client, table_name, poll_interval):
+    while True:
+        description = dynamo_client.describe_table(TableName=table_name)["Table"]
+        statuses = [description.get("TableStatus", "ACTIVE")] + [
+            index.get("IndexStatus", "ACTIVE")
+            for index in description.get("GlobalSecondaryIndexes", [])
+        ]
+        if all(status == "ACTIVE" for status in statuses):
+            return
+        time.sleep(poll_interval)
@@ -1,71 +1,384 @@
 import os
 import sys
-from .repository import ShippingRepository
-from .publisher import ShippingPublisher
+from boto3.dynamodb.conditions import Attr
+
+from .repository import ShippingRepository, ShippingTransitionRejected
+from .publisher import ShippingNotPublished, ShippingPublisher
+from .cache import LRUStatusCache
+from .instrumentation import count, instrument
+from .items import due_before, due_not_before, to_timestamp
 from datetime import datetime, timezone
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 
+@instrument
 class ShippingService:
     SHIPPING_CREATED: str = "created"
     SHIPPING_IN_PROGRESS: str = "in progress"
     SHIPPING_COMPLETED: str = "completed"
     SHIPPING_FAILED: str = "failed"
+    ACTIVE_STATUSES = (SHIPPING_CREATED, SHIPPING_IN_PROGRESS)
+    # keys of a create_shippings request, in the order they are checked
+    REQUEST_KEYS = ("shipping_type", "due_date", "order_id", "product_ids")
 
-    def __init__(self, repository, publisher):
+    def __init__(
+        self,
+        repository,
+        publisher,
+        use_outbox=False,
+        status_cache=None,
+        scheduler=None,
+        idempotent=False,
+        idempotency_cache=None,
+    ):
         self.repository = repository
         self.publisher = publisher
+        self.use_outbox = use_outbox
+        self.status_cache = status_cache
+        # releases shippings to workers close to their due date; without it
+        # they are published right away
+        self.scheduler = scheduler
+        # idempotent services key every shipping by order and shipping type;
+        # a key can also be passed to create_shipping explicitly. Only
+        # create_shipping, and Order.place_order through it, is idempotent:
+        # create_shippings and AsyncShippingService create a new shipping on
+        # every call.
+        self.idempotent = idempotent
+        # idempotency key -> shipping id of recent creations, so hot retries
+        # skip the round trip
+        if idempotency_cache is None:
+            idempotency_cache = LRUStatusCache(max_size=10000, ttl=60.0)
+        self.idempotency_cache = idempotency_cache
 
     @staticmethod
     def list_available_shipping_type():
         return ["Нова Пошта", "Укр Пошта", "Meest Express", "Самовивіз"]
 
-    def create_shipping(self, shipping_type, product_ids, order_id, due_date):
+    def validate_shipping(self, shipping_type, due_date):
         if shipping_type not in self.list_available_shipping_type():
             raise ValueError("Shipping type is not available")
 
         if due_date <= datetime.now(timezone.utc):
             raise ValueError("Shipping due datetime must be greater than datetime now")
 
+    @staticmethod
+    def idempotency_key(order_id, shipping_type):
+        return f"{order_id}#{shipping_type}"
+
+    def create_shipping(
+        self, shipping_type, product_ids, order_id, due_date, idempotency_key=None
+    ):
+        self.validate_shipping(shipping_type, due_date)
+
+        if idempotency_key is None and self.idempotent:
+            idempotency_key = self.idempotency_key(order_id, shipping_type)
+        if idempotency_key is not None:
+            return self._create_shipping_once(
+                idempotency_key, shipping_type, product_ids, order_id, due_date
+            )
+
+        if self.use_outbox:
+            # One transactional write; OutboxRelay publishes the shipping and
+            # moves it to in progress outside of the request.
+            return self.repository.create_shipping_with_outbox(
+                shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date
+            )
+
         shipping_id = self.repository.create_shipping(
             shipping_type, product_ids, order_id, self.SHIPPING_CREATED, due_date
         )
+        self._publish(shipping_id, due_date)
 
-        self.publisher.send_new_shipping(shipping_id)
-        self.repository.update_shipping_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+        return shipping_id
+
+    def _create_shipping_once(
+        self, idempotency_key, shipping_type, product_ids, order_id, due_date
+    ):
+        shipping_id = self.idempotency_cache.get(idempotency_key)
+        if shipping_id is not None:
+            count("shipping.duplicates")
+            return shipping_id
+
+        shipping_id, created = self.repository.create_shipping_once(
+            idempotency_key,
+            shipping_type,
+            product_ids,
+            order_id,
+            self.SHIPPING_CREATED,
+            due_date,
+            with_outbox=self.use_outbox,
+        )
+        if not created:
+            count("shipping.duplicates")
+        # A duplicate publishes only if the first attempt stopped before
+        # doing so: the claim out of created lets one overlapping call
+        # through. Only a key whose shipping is known to be published is
+        # cached, so later retries still reach the table while another call
+        # may yet fail to publish and move the shipping back to created.
+        if self.use_outbox or self._publish(shipping_id, due_date):
+            published = True
+        else:
+            published = self._claimed_elsewhere(shipping_id, due_date)
+        if published:
+            self.idempotency_cache.set(idempotency_key, shipping_id)
 
         return shipping_id
 
+    def _claimed_elsewhere(self, shipping_id, due_date):
+        # after a lost claim; True once the shipping is certainly published
+        shipping = self.repository.get_shipping(shipping_id, consistent=True)
+        if shipping is None:
+            raise ShippingNotPublished(shipping_id)
+        status = shipping["shipping_status"]
+        if status == self.SHIPPING_CREATED:
+            # the call that claimed it failed to publish and rolled back
+            return self._publish(shipping_id, due_date)
+        # in progress is also what a call that is still publishing has set
+        return status in (self.SHIPPING_COMPLETED, self.SHIPPING_FAILED)
+
+    def _publish(self, shipping_id, due_date):
+        # The status moves forward before the message is visible to workers,
+        # so a worker that processes it right away is never overwritten; a
+        # failed publish moves the shipping back to created. Returns False if
+        # the shipping was no longer created.
+        try:
+            self.repository.update_shipping_status(
+                shipping_id,
+                self.SHIPPING_IN_PROGRESS,
+                Attr("shipping_status").eq(self.SHIPPING_CREATED),
+            )
+        except ShippingTransitionRejected:
+            self._invalidate_status(shipping_id)
+            return False
+        self._cache_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+
+        try:
+            if self.scheduler is not None:
+                self.scheduler.schedule(shipping_id, due_date)
+            else:
+                self.publisher.send_new_shipping(shipping_id)
+        except Exception:
+            self._rollback_to_created(shipping_id)
+            raise
+
+        return True
+
+    def _rollback_to_created(self, shipping_id):
+        try:
+            self.repository.update_shipping_status(
+                shipping_id,
+                self.SHIPPING_CREATED,
+                Attr("shipping_status").eq(self.SHIPPING_IN_PROGRESS),
+            )
+        except ShippingTransitionRejected:
+            pass
+        self._invalidate_status(shipping_id)
+
+    def create_shippings(self, requests):
+        results, accepted = self._validate_requests(requests)
+        if not accepted:
+            return results
+
+        # Items are written straight as in progress so that the batch path
+        # needs no follow-up status update; shippings that could not be
+        # published are moved back to created.
+        shipping_ids = self.repository.create_shippings(
+            [request for request, _ in accepted], self.SHIPPING_IN_PROGRESS
+        )
+        written = self._record_written(accepted, shipping_ids)
+
+        if self.scheduler is not None:
+            due_dates = {
+                result["shipping_id"]: request["due_date"]
+                for request, result in accepted
+            }
+            message_ids = self.scheduler.schedule_many(
+                [
+                    (result["shipping_id"], due_dates[result["shipping_id"]])
+                    for result in written
+                ]
+            )
+        else:
+            message_ids = self.publisher.send_new_shippings(
+                [result["shipping_id"] for result in written]
+            )
+        for result in self._record_unpublished(written, message_ids):
+            self.repository.update_shipping_status(
+                result["shipping_id"], self.SHIPPING_CREATED
+            )
+
+        return results
+
+    def _validate_requests(self, requests):
+        results = []
+        accepted = []
+        for request in requests:
+            result = {
+                "order_id": request.get("order_id"),
+                "shipping_id": None,
+                "shipping_status": None,
+                "error": None,
+            }
+            results.append(result)
+            result["error"] = self._request_error(request)
+            if result["error"] is None:
+                accepted.append((request, result))
+
+        return results, accepted
+
+    def _request_error(self, request):
+        # Everything the repository and the publisher rely on is checked here,
+        # so one malformed request fails on its own instead of the batch.
+        for key in self.REQUEST_KEYS:
+            if request.get(key) is None:
+                return f"Shipping request is missing {key}"
+        if not isinstance(request["due_date"], datetime):
+            return "Shipping due_date must be a datetime"
+        if request["due_date"].tzinfo is None:
+            return "Shipping due_date must be timezone aware"
+        if not isinstance(request["product_ids"], (list, tuple)):
+            return "Shipping product_ids must be a list"
+        try:
+            self.validate_shipping(request["shipping_type"], request["due_date"])
+        except ValueError as exc:
+            return str(exc)
+
+        return None
+
+    def _record_written(self, accepted, shipping_ids):
+        written = []
+        for (_, result), shipping_id in zip(accepted, shipping_ids):
+            if shipping_id is None:
+                result["error"] = "Shipping could not be saved"
+                continue
+            result["shipping_id"] = shipping_id
+            result["shipping_status"] = self.SHIPPING_IN_PROGRESS
+            self._cache_status(shipping_id, self.SHIPPING_IN_PROGRESS)
+            written.append(result)
+
+        return written
+
+    def _record_unpublished(self, written, message_ids):
+        unpublished = []
+        for result, message_id in zip(written, message_ids):
+            if message_id is None:
+                self._cache_status(result["shipping_id"], self.SHIPPING_CREATED)
+                result["shipping_status"] = self.SHIPPING_CREATED
+                result["error"] = "Shipping could not be published"
+                unpublished.append(result)
+
+        return unpublished
+
     def process_shipping_batch(self):
         result = []
-        shipping = self.publisher.poll_shipping()
-        for shipping_id in shipping:
-            shipping = self.process_shipping(shipping_id)
-            result.append(shipping)
+        processed = []
+        messages = self.publisher.poll_shipping_messages()
+        shippings = self.repository.get_shippings(
+            [message.shipping_id for message in messages], ["due_ts"]
+        )
+        try:
+            for message in messages:
+                shipping = shippings.get(message.shipping_id)
+                try:
+                    result.append(self.process_shipping(message.shipping_id, shipping))
+                except ShippingTransitionRejected:
+                    pass
+                processed.append(message)
+        finally:
+            # Acknowledge what went through; the rest comes back after the
+            # visibility timeout.
+            if processed:
+                self.publisher.delete_shippings(processed)
 
         return result
 
-    def process_shipping(self, shipping_id):
-        shipping = self.repository.get_shipping(shipping_id)
-        if datetime.fromisoformat(shipping["due_date"]) < datetime.now(timezone.utc):
-            return self.fail_shipping(shipping_id)
+    def process_shipping(self, shipping_id, shipping=None):
+        now = datetime.now(timezone.utc)
+        if shipping is not None:
+            if shipping["due_ts"] < to_timestamp(now):
+                return self.fail_shipping(shipping_id)
+            return self.complete_shipping(shipping_id)
 
-        return self.complete_shipping(shipping_id)
+        # Without the item at hand the due date check is pushed into the
+        # update itself, so a shipping is usually processed in one call.
+        try:
+            return self.complete_shipping(shipping_id, due_not_before(now))
+        except ShippingTransitionRejected:
+            return self.fail_shipping(shipping_id, due_before(now))
 
     def check_status(self, shipping_id):
+        if self.status_cache is not None:
+            status = self.status_cache.get(shipping_id)
+            if status is not None:
+                return status
+
         shipping = self.repository.get_shipping(shipping_id)
+        self._cache_status(shipping_id, shipping["shipping_status"])
 
         return shipping["shipping_status"]
 
-    def fail_shipping(self, shipping_id):
-        response = self.repository.update_shipping_status(
-            shipping_id, self.SHIPPING_FAILED
-        )
+    def check_statuses(self, shipping_ids):
+        statuses = {}
+        if self.status_cache is not None:
+            for shipping_id in shipping_ids:
+                statuses[shipping_id] = self.status_cache.get(shipping_id)
+
+        missing = [
+            shipping_id for shipping_id in shipping_ids if not statuses.get(shipping_id)
+        ]
+        if missing:
+            shippings = self.repository.get_shippings(missing, ["shipping_status"])
+            for shipping_id in missing:
+                status = shippings.get(shipping_id, {}).get("shipping_status")
+                if status is not None:
+                    self._cache_status(shipping_id, status)
+                statuses[shipping_id] = status
+
+        return statuses
+
+    def list_order_shippings(self, order_id):
+        # one indexed query; the index is eventually consistent, so a shipping
+        # created a moment ago may be missing
+        return list(self.repository.iter_order_shippings(order_id))
+
+    def iter_shippings_by_status(self, status, due_from=None, due_until=None):
+        return self.repository.iter_shippings_by_status(status, due_from, due_until)
+
+    def transition_shipping(self, shipping_id, status, condition=None):
+        # Only active shippings move; anything else, including a shipping
+        # that was already completed or failed, raises
+        # ShippingTransitionRejected. Returns the updated item.
+        return self._transition(shipping_id, status, condition)["Attributes"]
+
+    def fail_shipping(self, shipping_id, condition=None):
+        response = self._transition(shipping_id, self.SHIPPING_FAILED, condition)
         return response["ResponseMetadata"]
 
-    def complete_shipping(self, shipping_id):
-        response = self.repository.update_shipping_status(
-            shipping_id, self.SHIPPING_COMPLETED
-        )
+    def complete_shipping(self, shipping_id, condition=None):
+        response = self._transition(shipping_id, self.SHIPPING_COMPLETED, condition)
         return response["ResponseMetadata"]
+
+    def _transition(self, shipping_id, status, condition=None):
+        allowed = Attr("shipping_status").is_in(list(self.ACTIVE_STATUSES))
+        if condition is not None:
+            allowed = allowed & condition
+        try:
+            response = self.repository.update_shipping_status(
+                shipping_id, status, allowed
+            )
+        except ShippingTransitionRejected:
+            # Somebody else moved the shipping; whatever we cached is stale.
+            self._invalidate_status(shipping_id)
+            raise
+        self._cache_status(shipping_id, status)
+
+        return response
+
+    def _cache_status(self, shipping_id, status):
+        if self.status_cache is not None:
+            self.status_cache.set(shipping_id, status)
+
+    def _invalidate_status(self, shipping_id):
+        if self.status_cache is not None:
+            self.status_cache.invalidate(shipping_id)
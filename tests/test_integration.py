@@ -1,13 +1,40 @@
+import threading
 import uuid
 
-import boto3
 from app.eshop import Product, Shipment, ShoppingCart, Order
+from app.inventory import OutOfStockError, PersistentInventory
 import random
 from services import ShippingService
-from services.repository import ShippingRepository
-from services.publisher import ShippingPublisher
+from services.repository import (
+    InventoryRepository,
+    ShippingRepository,
+    ShippingTransitionRejected,
+    StockUnavailable,
+)
+from services.publisher import ShippingMessage, ShippingPublisher, VisibilityHeartbeat
+from services.outbox import OutboxRelay
+from services.consumer import ShippingConsumer
+from services.scheduler import DEFERRED, ShippingScheduler
+from services.export import ShippingExporter, read_export
+from services.items import from_timestamp, to_timestamp
+from services.cache import LRUStatusCache
+from services import db
+from services.aio import (
+    AsyncShippingPublisher,
+    AsyncShippingRepository,
+    AsyncShippingService,
+)
+import asyncio
 from datetime import datetime, time, timedelta, timezone
-from services.config import AWS_ENDPOINT_URL, AWS_REGION, SHIPPING_QUEUE
+from services.config import SHIPPING_QUEUE
+from services.schema import (
+    ORDER_SHIPPINGS_INDEX,
+    RECENT_SHIPPINGS_INDEX,
+    SHIPPING_TABLE,
+    STATUS_DUE_INDEX,
+    migrate_tables,
+)
+from boto3.dynamodb.conditions import Key
 import pytest
 
 
@@ -17,7 +44,7 @@ import pytest
         ("order_1", "shipping_1"),
         ("order_i2hur2937r9", "shipping_1!!!!"),
         (8662354, 123456),
-        (str(uuid.uuid4()), str(uuid.uuid4())),
+        pytest.param(str(uuid.uuid4()), str(uuid.uuid4()), id="random-uuids"),
     ],
 )
 def test_place_order_with_mocked_repo(mocker, order_id, shipping_id):
@@ -87,13 +114,7 @@ def test_when_place_order_then_shipping_in_queue(dynamo_resource):
         due_date=datetime.now(timezone.utc) + timedelta(minutes=1),
     )
 
-    sqs_client = boto3.client(
-        "sqs",
-        endpoint_url=AWS_ENDPOINT_URL,
-        region_name=AWS_REGION,
-        aws_access_key_id="test",
-        aws_secret_access_key="test",
-    )
+    sqs_client = db.get_client("sqs")
     queue_url = sqs_client.get_queue_url(QueueName=SHIPPING_QUEUE)["QueueUrl"]
     response = sqs_client.receive_message(
         QueueUrl=queue_url, MaxNumberOfMessages=1, WaitTimeSeconds=10
@@ -134,10 +155,13 @@ def test_shipping_repository_create_and_get_integration(
     assert shipping["shipping_id"] == shipping_id
     assert shipping["order_id"] == order_id
     assert shipping["shipping_type"] == shipping_type
-    assert shipping["product_ids"] == ",".join(product_ids)
+    assert shipping["product_ids"] == product_ids
     assert shipping["shipping_status"] == status
-    assert "created_date" in shipping
-    assert "due_date" in shipping
+    assert shipping["item_version"] == 2
+    assert "created_ts" in shipping
+    assert from_timestamp(shipping["due_ts"]) == due_date.replace(
+        microsecond=due_date.microsecond // 1000 * 1000
+    )
 
 
 def test_shipping_repository_update_status_integration(dynamo_resource):
@@ -213,13 +237,7 @@ def test_create_shipping_with_real_service():
     assert shipping is not None
     assert shipping["shipping_status"] == service.SHIPPING_IN_PROGRESS
 
-    sqs_client = boto3.client(
-        "sqs",
-        endpoint_url=AWS_ENDPOINT_URL,
-        region_name=AWS_REGION,
-        aws_access_key_id="test",
-        aws_secret_access_key="test",
-    )
+    sqs_client = db.get_client("sqs")
     queue_url = sqs_client.get_queue_url(QueueName=SHIPPING_QUEUE)["QueueUrl"]
 
     message_found = False
@@ -342,3 +360,1297 @@ def test_create_shipping_with_past_due_date_fails():
     assert "Shipping due datetime must be greater than datetime now" in str(
         excinfo.value
     )
+
+
+def test_create_shippings_with_real_service():
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    shipping_type = service.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    requests = [
+        {
+            "shipping_type": shipping_type,
+            "product_ids": [f"bulk_product_{i}"],
+            "order_id": f"bulk_order_{i}",
+            "due_date": due_date,
+        }
+        for i in range(30)
+    ]
+    requests.append(
+        {
+            "shipping_type": "Новий тип доставки",
+            "product_ids": ["bulk_product_invalid"],
+            "order_id": "bulk_order_invalid",
+            "due_date": due_date,
+        }
+    )
+
+    results = service.create_shippings(requests)
+
+    assert len(results) == len(requests)
+    assert results[-1]["shipping_id"] is None
+    assert results[-1]["error"] == "Shipping type is not available"
+
+    for request, result in zip(requests[:-1], results[:-1]):
+        assert result["error"] is None
+        assert result["order_id"] == request["order_id"]
+        shipping = service.repository.get_shipping(result["shipping_id"])
+        assert shipping["order_id"] == request["order_id"]
+        assert shipping["shipping_status"] == service.SHIPPING_IN_PROGRESS
+
+
+def test_create_shippings_reports_partial_failures(mocker):
+    mock_repo = mocker.Mock()
+    mock_publisher = mocker.Mock()
+    service = ShippingService(mock_repo, mock_publisher)
+    shipping_type = ShippingService.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    mock_repo.create_shippings.return_value = ["shipping_1", None, "shipping_3"]
+    mock_publisher.send_new_shippings.return_value = ["message_1", None]
+
+    requests = [
+        {
+            "shipping_type": shipping_type,
+            "product_ids": ["product"],
+            "order_id": f"order_{i}",
+            "due_date": due_date,
+        }
+        for i in range(3)
+    ]
+    requests.insert(1, {"shipping_type": shipping_type, "order_id": "order_x"})
+
+    results = service.create_shippings(requests)
+
+    assert [result["shipping_id"] for result in results] == [
+        "shipping_1",
+        None,
+        None,
+        "shipping_3",
+    ]
+    assert results[0]["error"] is None
+    assert results[1]["error"] == "Shipping request is missing due_date"
+    assert results[2]["error"] == "Shipping could not be saved"
+    assert results[3]["error"] == "Shipping could not be published"
+    assert results[3]["shipping_status"] == service.SHIPPING_CREATED
+
+    mock_publisher.send_new_shippings.assert_called_with(["shipping_1", "shipping_3"])
+    mock_repo.update_shipping_status.assert_called_once_with(
+        "shipping_3", service.SHIPPING_CREATED
+    )
+
+
+@pytest.mark.parametrize(
+    "request_update, error",
+    [
+        ({"product_ids": None}, "Shipping request is missing product_ids"),
+        ({"order_id": None}, "Shipping request is missing order_id"),
+        ({"due_date": "2099-01-01"}, "Shipping due_date must be a datetime"),
+        (
+            {"due_date": datetime(2099, 1, 1)},
+            "Shipping due_date must be timezone aware",
+        ),
+        ({"product_ids": "product"}, "Shipping product_ids must be a list"),
+    ],
+)
+def test_create_shippings_rejects_malformed_requests(mocker, request_update, error):
+    mock_repo = mocker.Mock()
+    mock_publisher = mocker.Mock()
+    service = ShippingService(mock_repo, mock_publisher)
+    mock_repo.create_shippings.return_value = ["shipping_1"]
+    mock_publisher.send_new_shippings.return_value = ["message_1"]
+    valid = {
+        "shipping_type": ShippingService.list_available_shipping_type()[0],
+        "product_ids": ["product"],
+        "order_id": "order_1",
+        "due_date": datetime.now(timezone.utc) + timedelta(hours=1),
+    }
+    malformed = {**valid, "order_id": "order_2"}
+    malformed.update(request_update)
+    malformed = {key: value for key, value in malformed.items() if value is not None}
+
+    results = service.create_shippings([valid, malformed])
+
+    assert results[0]["shipping_id"] == "shipping_1"
+    assert results[1]["shipping_id"] is None
+    assert results[1]["error"] == error
+    mock_repo.create_shippings.assert_called_once_with(
+        [valid], service.SHIPPING_IN_PROGRESS
+    )
+
+
+def test_shipping_repository_batch_write_retries_unprocessed(mocker):
+    repo = ShippingRepository()
+    mocker.patch("services.repository.time.sleep")
+    batch_write_item = mocker.patch.object(repo.resource, "batch_write_item")
+
+    requests = [{"PutRequest": {"Item": {"shipping_id": str(i)}}} for i in range(30)]
+    batch_write_item.side_effect = [
+        {"UnprocessedItems": {repo.table.name: requests[:2]}},
+        {"UnprocessedItems": {}},
+        {"UnprocessedItems": {}},
+    ]
+
+    unprocessed = repo.batch_write(requests)
+
+    assert unprocessed == []
+    chunks = [
+        call.kwargs["RequestItems"][repo.table.name]
+        for call in batch_write_item.call_args_list
+    ]
+    assert chunks == [requests[:25], requests[:2], requests[25:]]
+
+
+def test_create_shipping_with_outbox_writes_item_and_outbox_record(mocker):
+    mock_publisher = mocker.Mock()
+    service = ShippingService(ShippingRepository(), mock_publisher, use_outbox=True)
+    shipping_type = service.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    shipping_id = service.create_shipping(
+        shipping_type, ["outbox_product"], "outbox_order", due_date
+    )
+
+    assert service.check_status(shipping_id) == service.SHIPPING_CREATED
+    outbox = service.repository.outbox_table.get_item(Key={"shipping_id": shipping_id})
+    assert "Item" in outbox
+    mock_publisher.send_new_shipping.assert_not_called()
+    mock_publisher.send_new_shippings.assert_not_called()
+
+    service.repository.delete_outbox([shipping_id])
+
+
+def test_outbox_relay_publishes_and_moves_status_forward(mocker):
+    repo = ShippingRepository()
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shippings.side_effect = lambda ids: [
+        f"message_{shipping_id}" for shipping_id in ids
+    ]
+    service = ShippingService(repo, mock_publisher, use_outbox=True)
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    shipping_ids = [
+        service.create_shipping(
+            service.list_available_shipping_type()[0],
+            [f"relay_product_{i}"],
+            f"relay_order_{i}",
+            due_date,
+        )
+        for i in range(3)
+    ]
+
+    relay = OutboxRelay(repo, mock_publisher, batch_size=2)
+    published = relay.drain()
+
+    assert sorted(published) == sorted(shipping_ids)
+    assert repo.get_outbox() == []
+    for shipping_id in shipping_ids:
+        assert service.check_status(shipping_id) == service.SHIPPING_IN_PROGRESS
+
+
+def test_outbox_relay_keeps_unpublished_records(mocker):
+    repo = ShippingRepository()
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shippings.side_effect = lambda ids: [None for _ in ids]
+    service = ShippingService(repo, mock_publisher, use_outbox=True)
+
+    shipping_id = service.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["relay_product"],
+        "relay_order",
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+
+    relay = OutboxRelay(repo, mock_publisher)
+    assert relay.drain() == []
+    assert [record["shipping_id"] for record in repo.get_outbox()] == [shipping_id]
+
+    repo.delete_outbox([shipping_id])
+
+
+def make_messages(*shipping_ids):
+    return [
+        ShippingMessage(shipping_id, f"receipt_{shipping_id}", f"message_{shipping_id}")
+        for shipping_id in shipping_ids
+    ]
+
+
+def test_shipping_consumer_processes_polled_shippings_concurrently(mocker):
+    mock_service = mocker.Mock()
+    batches = [
+        make_messages("shipping_1", "shipping_2", "shipping_3"),
+        make_messages("shipping_4"),
+    ]
+    mock_service.publisher.delete_shippings.return_value = []
+    mock_service.publisher.poll_shipping_messages.side_effect = lambda *args: (
+        batches.pop(0) if batches else []
+    )
+    processing = threading.Barrier(2, timeout=5)
+    mock_service.process_shipping.side_effect = lambda shipping_id: (
+        processing.wait() if shipping_id in ("shipping_1", "shipping_2") else None
+    )
+
+    consumer = ShippingConsumer(mock_service, workers=2, wait_time=0)
+    consumer.start()
+    deadline = datetime.now() + timedelta(seconds=5)
+    while mock_service.process_shipping.call_count < 4 and datetime.now() < deadline:
+        threading.Event().wait(0.01)
+    consumer.stop(timeout=5)
+
+    processed = sorted(
+        call.args[0] for call in mock_service.process_shipping.call_args_list
+    )
+    assert processed == ["shipping_1", "shipping_2", "shipping_3", "shipping_4"]
+    stats = consumer.get_stats()
+    assert stats["poll"]["count"] == 4
+    assert stats["process"]["count"] == 4
+    assert stats["process"]["errors"] == 0
+    assert stats["ack"]["count"] == 4
+    assert not consumer.running
+
+    acked = [
+        message.shipping_id
+        for call in mock_service.publisher.delete_shippings.call_args_list
+        for message in call.args[0]
+    ]
+    assert sorted(acked) == processed
+
+
+def test_shipping_consumer_drains_pending_shippings_on_stop(mocker):
+    mock_service = mocker.Mock()
+    polled = threading.Event()
+
+    def poll_shipping_messages(*args):
+        if polled.is_set():
+            return []
+        polled.set()
+        return make_messages(*[f"shipping_{i}" for i in range(5)])
+
+    mock_service.publisher.delete_shippings.return_value = []
+    mock_service.publisher.poll_shipping_messages.side_effect = poll_shipping_messages
+    mock_service.process_shipping.side_effect = [
+        None,
+        ValueError("boom"),
+        None,
+        None,
+        None,
+    ]
+
+    consumer = ShippingConsumer(mock_service, workers=1, max_pending=2, wait_time=0)
+    consumer.start()
+    polled.wait(5)
+    consumer.stop(timeout=5)
+
+    assert mock_service.process_shipping.call_count == 5
+    stats = consumer.get_stats()
+    assert stats["process"]["count"] == 4
+    assert stats["process"]["errors"] == 1
+    assert stats["pending"] == 0
+    assert stats["unacked"] == 0
+
+    acked = [
+        message.shipping_id
+        for call in mock_service.publisher.delete_shippings.call_args_list
+        for message in call.args[0]
+    ]
+    assert "shipping_1" not in acked
+    assert len(acked) == 4
+
+
+def test_shipping_publisher_deletes_acknowledged_messages():
+    publisher = ShippingPublisher()
+    shipping_id = str(uuid.uuid4())
+    publisher.send_new_shipping(shipping_id)
+
+    messages = []
+    for _ in range(10):
+        messages = [
+            message
+            for message in publisher.poll_shipping_messages(wait_time=1)
+            if message.shipping_id == shipping_id
+        ]
+        if messages:
+            break
+
+    assert len(messages) == 1
+    assert messages[0].receipt_handle
+    assert publisher.extend_visibility(messages, 60) == []
+    assert publisher.delete_shippings(messages) == []
+
+
+def test_process_shipping_batch_acknowledges_processed_messages(mocker):
+    mock_repo = mocker.Mock()
+    mock_publisher = mocker.Mock()
+    service = ShippingService(mock_repo, mock_publisher)
+    messages = make_messages("shipping_1", "shipping_2", "shipping_3")
+    mock_publisher.poll_shipping_messages.return_value = messages
+    mocker.patch.object(
+        service,
+        "process_shipping",
+        side_effect=[{"HTTPStatusCode": 200}, {"HTTPStatusCode": 200}, KeyError()],
+    )
+
+    with pytest.raises(KeyError):
+        service.process_shipping_batch()
+
+    mock_publisher.delete_shippings.assert_called_once_with(messages[:2])
+    mock_repo.get_shippings.assert_called_once_with(
+        ["shipping_1", "shipping_2", "shipping_3"], ["due_ts"]
+    )
+
+
+def test_visibility_heartbeat_extends_only_expiring_messages(mocker):
+    mock_publisher = mocker.Mock()
+    mock_publisher.extend_visibility.return_value = []
+    heartbeat = VisibilityHeartbeat(mock_publisher, visibility_timeout=30, interval=5)
+    fresh, expiring, finished = make_messages("fresh", "expiring", "finished")
+
+    monotonic = mocker.patch("services.publisher.time.monotonic", return_value=100.0)
+    heartbeat.track(expiring)
+    heartbeat.track(finished)
+    monotonic.return_value = 121.0
+    heartbeat.track(fresh)
+    heartbeat.untrack(finished)
+
+    assert heartbeat.beat() == [expiring]
+    mock_publisher.extend_visibility.assert_called_once_with([expiring], 30)
+    assert heartbeat.beat() == []
+
+
+def test_shipping_repository_get_shippings_in_chunks(dynamo_resource):
+    repo = ShippingRepository()
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    shipping_ids = repo.create_shippings(
+        [
+            {
+                "shipping_type": "Нова Пошта",
+                "product_ids": [f"bulk_read_product_{i}"],
+                "order_id": f"bulk_read_order_{i}",
+                "due_date": due_date,
+            }
+            for i in range(120)
+        ],
+        "created",
+    )
+    shippings = repo.get_shippings(shipping_ids + ["missing"], ["shipping_status"])
+
+    assert sorted(shippings) == sorted(shipping_ids)
+    for shipping_id, shipping in shippings.items():
+        assert shipping == {"shipping_id": shipping_id, "shipping_status": "created"}
+
+
+def test_shipping_repository_get_shippings_retries_unprocessed_keys(mocker):
+    repo = ShippingRepository()
+    mocker.patch("services.repository.time.sleep")
+    batch_get_item = mocker.patch.object(repo.resource, "batch_get_item")
+    table = repo.table.name
+    batch_get_item.side_effect = [
+        {
+            "Responses": {table: [{"shipping_id": "shipping_1"}]},
+            "UnprocessedKeys": {table: {"Keys": [{"shipping_id": "shipping_2"}]}},
+        },
+        {"Responses": {table: [{"shipping_id": "shipping_2"}]}},
+    ]
+
+    shippings = repo.get_shippings(["shipping_1", "shipping_2", "shipping_1"])
+
+    assert shippings == {
+        "shipping_1": {"shipping_id": "shipping_1"},
+        "shipping_2": {"shipping_id": "shipping_2"},
+    }
+    assert batch_get_item.call_args_list[1].kwargs["RequestItems"] == {
+        table: {"Keys": [{"shipping_id": "shipping_2"}]}
+    }
+
+
+def test_check_statuses_with_real_service():
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    shipping_type = service.list_available_shipping_type()[0]
+    due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+    in_progress_id = service.create_shipping(
+        shipping_type, ["status_product"], "status_order", due_date
+    )
+    created_id = service.repository.create_shipping(
+        shipping_type, ["status_product"], "status_order", "created", due_date
+    )
+
+    shipments = [
+        Shipment(in_progress_id, service),
+        Shipment(created_id, service),
+        Shipment("missing", service),
+    ]
+
+    assert Shipment.check_statuses(shipments) == {
+        in_progress_id: service.SHIPPING_IN_PROGRESS,
+        created_id: service.SHIPPING_CREATED,
+        "missing": None,
+    }
+
+
+def test_process_shipping_is_single_conditional_update(mocker):
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    shipping_id = service.repository.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["conditional_product"],
+        "conditional_order",
+        service.SHIPPING_IN_PROGRESS,
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    get_item = mocker.spy(service.repository.table, "get_item")
+    update_item = mocker.spy(service.repository.table, "update_item")
+
+    result = service.process_shipping(shipping_id)
+
+    assert result["HTTPStatusCode"] == 200
+    assert get_item.call_count == 0
+    assert update_item.call_count == 1
+    assert service.check_status(shipping_id) == service.SHIPPING_COMPLETED
+
+
+def test_process_shipping_twice_is_rejected():
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    shipping_id = service.repository.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["conditional_product"],
+        "conditional_order",
+        service.SHIPPING_IN_PROGRESS,
+        datetime.now(timezone.utc) - timedelta(hours=1),
+    )
+
+    service.process_shipping(shipping_id)
+    with pytest.raises(ShippingTransitionRejected) as excinfo:
+        service.process_shipping(shipping_id)
+
+    assert excinfo.value.shipping_id == shipping_id
+    assert service.check_status(shipping_id) == service.SHIPPING_FAILED
+
+    with pytest.raises(ShippingTransitionRejected):
+        service.process_shipping("missing-shipping")
+    assert service.repository.get_shipping("missing-shipping") is None
+
+
+def test_transition_shipping_returns_new_attributes():
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    shipping_id = service.repository.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["conditional_product"],
+        "transition_order",
+        service.SHIPPING_CREATED,
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+
+    attributes = service.transition_shipping(shipping_id, service.SHIPPING_COMPLETED)
+
+    assert attributes["shipping_id"] == shipping_id
+    assert attributes["order_id"] == "transition_order"
+    assert attributes["shipping_status"] == service.SHIPPING_COMPLETED
+    with pytest.raises(ShippingTransitionRejected):
+        service.transition_shipping(shipping_id, service.SHIPPING_FAILED)
+
+
+def test_outbox_relay_skips_already_processed_shippings(mocker):
+    repo = ShippingRepository()
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shippings.return_value = []
+    service = ShippingService(repo, mock_publisher, use_outbox=True)
+    shipping_id = service.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["relay_product"],
+        "relay_order",
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    service.complete_shipping(shipping_id)
+
+    relay = OutboxRelay(repo, mock_publisher)
+
+    assert relay.drain() == []
+    mock_publisher.send_new_shippings.assert_called_once_with([])
+    assert repo.get_outbox() == []
+    assert service.check_status(shipping_id) == service.SHIPPING_COMPLETED
+
+
+def test_outbox_relay_does_not_republish_when_deletes_fail(mocker):
+    repo = ShippingRepository()
+    mock_publisher = mocker.Mock()
+    mock_publisher.send_new_shippings.side_effect = lambda ids: [
+        f"message_{shipping_id}" for shipping_id in ids
+    ]
+    service = ShippingService(repo, mock_publisher, use_outbox=True)
+    shipping_id = service.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["relay_product"],
+        "relay_order",
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    mocker.patch.object(
+        repo, "delete_outbox", side_effect=lambda shipping_ids: shipping_ids
+    )
+
+    relay = OutboxRelay(repo, mock_publisher, batch_size=1)
+    assert relay.drain() == [shipping_id]
+    assert relay.drain() == []
+
+    mock_publisher.send_new_shippings.assert_called_with([])
+    assert mock_publisher.send_new_shippings.call_count == 2
+    assert service.check_status(shipping_id) == service.SHIPPING_IN_PROGRESS
+    mocker.stopall()
+    repo.delete_outbox([shipping_id])
+
+
+def test_outbox_relay_defers_through_the_scheduler(mocker):
+    repo = ShippingRepository()
+    mock_publisher = mocker.Mock()
+    scheduler = mocker.Mock()
+    scheduler.schedule_many.side_effect = lambda schedule: [DEFERRED for _ in schedule]
+    service = ShippingService(repo, mock_publisher, use_outbox=True)
+    due_date = datetime.now(timezone.utc) + timedelta(days=2)
+    shipping_id = service.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["relay_product"],
+        "deferred_relay_order",
+        due_date,
+    )
+
+    relay = OutboxRelay(repo, mock_publisher, scheduler=scheduler)
+    assert relay.drain() == [shipping_id]
+
+    mock_publisher.send_new_shippings.assert_not_called()
+    [(scheduled_id, scheduled_due)] = scheduler.schedule_many.call_args.args[0]
+    assert scheduled_id == shipping_id
+    assert to_timestamp(scheduled_due) == to_timestamp(due_date)
+    assert repo.get_outbox() == []
+
+
+def test_check_status_is_served_from_status_cache(mocker):
+    mock_repo = mocker.Mock()
+    mock_repo.get_shipping.return_value = {"shipping_status": "in progress"}
+    cache = LRUStatusCache()
+    service = ShippingService(mock_repo, mocker.Mock(), status_cache=cache)
+
+    shipment = Shipment("shipping_1", service)
+    assert shipment.check_shipping_status() == "in progress"
+    assert shipment.check_shipping_status() == "in progress"
+
+    mock_repo.get_shipping.assert_called_once_with("shipping_1")
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_status_transitions_update_status_cache(mocker):
+    mock_repo = mocker.Mock()
+    mock_repo.create_shipping.return_value = "shipping_1"
+    mock_repo.update_shipping_status.return_value = {"ResponseMetadata": {}}
+    cache = LRUStatusCache()
+    service = ShippingService(mock_repo, mocker.Mock(), status_cache=cache)
+
+    service.create_shipping(
+        service.list_available_shipping_type()[0],
+        ["product"],
+        "order_1",
+        datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    assert service.check_status("shipping_1") == service.SHIPPING_IN_PROGRESS
+
+    service.complete_shipping("shipping_1")
+    assert service.check_status("shipping_1") == service.SHIPPING_COMPLETED
+
+    mock_repo.update_shipping_status.side_effect = ShippingTransitionRejected(
+        "shipping_1", service.SHIPPING_FAILED
+    )
+    with pytest.raises(ShippingTransitionRejected):
+        service.fail_shipping("shipping_1")
+    assert cache.get("shipping_1") is None
+    mock_repo.get_shipping.assert_not_called()
+
+
+def test_check_statuses_reads_only_cache_misses(mocker):
+    mock_repo = mocker.Mock()
+    mock_repo.get_shippings.return_value = {
+        "shipping_2": {"shipping_id": "shipping_2", "shipping_status": "failed"}
+    }
+    cache = LRUStatusCache()
+    cache.set("shipping_1", "completed")
+    service = ShippingService(mock_repo, mocker.Mock(), status_cache=cache)
+
+    statuses = service.check_statuses(["shipping_1", "shipping_2", "shipping_3"])
+
+    assert statuses == {
+        "shipping_1": "completed",
+        "shipping_2": "failed",
+        "shipping_3": None,
+    }
+    mock_repo.get_shippings.assert_called_once_with(
+        ["shipping_2", "shipping_3"], ["shipping_status"]
+    )
+    assert cache.get("shipping_2") == "failed"
+
+
+def test_repositories_and_publishers_share_pooled_clients():
+    first_publisher = ShippingPublisher()
+    second_publisher = ShippingPublisher()
+
+    assert first_publisher.client is second_publisher.client
+    assert first_publisher.queue_url == second_publisher.queue_url
+    config = first_publisher.client.meta.config
+    assert config.max_pool_connections == db.AWS_MAX_POOL_CONNECTIONS
+    assert config.retries["mode"] == db.AWS_RETRY_MODE
+
+    assert ShippingRepository().resource is ShippingRepository().resource
+
+    resources = []
+    thread = threading.Thread(
+        target=lambda: resources.append(ShippingRepository().resource)
+    )
+    thread.start()
+    thread.join()
+    assert resources[0] is not ShippingRepository().resource
+
+
+def test_queue_url_lookup_is_cached(mocker):
+    get_queue_url = mocker.spy(db.get_client("sqs"), "get_queue_url")
+    mocker.patch.dict(db._queue_urls, clear=True)
+
+    first = db.get_queue_url(SHIPPING_QUEUE)
+    second = db.get_queue_url(SHIPPING_QUEUE)
+
+    assert first == second
+    assert get_queue_url.call_count == 1
+
+
+def test_async_shipping_service_creates_and_processes_shippings():
+    async def scenario():
+        service = AsyncShippingService(
+            AsyncShippingRepository(), AsyncShippingPublisher()
+        )
+        cart = ShoppingCart()
+        cart.add_product(
+            Product(available_amount=10, name="AsyncProduct", price=10.0), amount=2
+        )
+        order = Order(cart, service, "async_order")
+
+        shipping_id = await order.place_order_async(
+            service.list_available_shipping_type()[0],
+            datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        created_status = await service.check_status(shipping_id)
+        result = await service.process_shipping(shipping_id)
+        statuses = await service.check_statuses([shipping_id, "missing"])
+        return shipping_id, created_status, result, statuses
+
+    shipping_id, created_status, result, statuses = asyncio.run(scenario())
+
+    assert created_status == ShippingService.SHIPPING_IN_PROGRESS
+    assert result["HTTPStatusCode"] == 200
+    assert statuses == {
+        shipping_id: ShippingService.SHIPPING_COMPLETED,
+        "missing": None,
+    }
+    shipping = ShippingRepository().get_shipping(shipping_id)
+    assert shipping["order_id"] == "async_order"
+    assert shipping["product_ids"] == ["AsyncProduct"]
+
+
+def test_async_create_shipping_publishes_and_updates_concurrently(mocker):
+    repository = mocker.AsyncMock()
+    repository.create_shipping.return_value = "shipping_1"
+    publisher = mocker.AsyncMock()
+
+    async def scenario():
+        started = []
+        release = asyncio.Event()
+
+        async def send_new_shipping(shipping_id):
+            started.append("publish")
+            if len(started) == 2:
+                release.set()
+            await release.wait()
+            return "message_1"
+
+        async def update_shipping_status(shipping_id, status, condition=None):
+            started.append("update")
+            if len(started) == 2:
+                release.set()
+            await release.wait()
+            return {"ResponseMetadata": {}}
+
+        publisher.send_new_shipping.side_effect = send_new_shipping
+        repository.update_shipping_status.side_effect = update_shipping_status
+        service = AsyncShippingService(repository, publisher)
+        shipping_id = await asyncio.wait_for(
+            service.create_shipping(
+                service.list_available_shipping_type()[0],
+                ["product"],
+                "order_1",
+                datetime.now(timezone.utc) + timedelta(hours=1),
+            ),
+            timeout=5,
+        )
+        return shipping_id, started
+
+    shipping_id, started = asyncio.run(scenario())
+
+    assert shipping_id == "shipping_1"
+    assert sorted(started) == ["publish", "update"]
+    status_call = repository.update_shipping_status.await_args
+    assert status_call.args[:2] == ("shipping_1", ShippingService.SHIPPING_IN_PROGRESS)
+
+
+def test_async_create_shipping_rolls_back_when_publish_fails(mocker):
+    repository = mocker.AsyncMock()
+    repository.create_shipping.return_value = "shipping_1"
+    repository.update_shipping_status.return_value = {"ResponseMetadata": {}}
+    publisher = mocker.AsyncMock()
+    publisher.send_new_shipping.side_effect = RuntimeError("SQS is down")
+    service = AsyncShippingService(repository, publisher)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(
+            service.create_shipping(
+                service.list_available_shipping_type()[0],
+                ["product"],
+                "order_1",
+                datetime.now(timezone.utc) + timedelta(hours=1),
+            )
+        )
+
+    rollback = repository.update_shipping_status.await_args_list[-1]
+    assert rollback.args[:2] == ("shipping_1", ShippingService.SHIPPING_CREATED)
+
+
+def test_inventory_repository_never_takes_below_zero():
+    repository = InventoryRepository()
+    product_id = f"product-{uuid.uuid4()}"
+    repository.set_stock(product_id, 3)
+
+    assert repository.take(product_id, 2) == 1
+    with pytest.raises(StockUnavailable) as error:
+        repository.take(product_id, 2)
+
+    assert error.value.available == {product_id: 1}
+    assert repository.get_stock(product_id, consistent=True) == 1
+
+
+def test_inventory_repository_takes_all_lines_or_none():
+    repository = InventoryRepository()
+    first, second, third = (f"product-{uuid.uuid4()}" for _ in range(3))
+    repository.set_stock(first, 5)
+    repository.set_stock(second, 1)
+
+    with pytest.raises(StockUnavailable) as error:
+        repository.take_all({first: 2, second: 2, third: 1})
+
+    assert error.value.available == {second: 1, third: 0}
+    assert repository.get_stock(first, consistent=True) == 5
+
+    repository.take_all({first: 2, second: 1})
+    assert repository.get_stock(first) == 3
+    assert repository.get_stock(second) == 0
+
+
+def test_inventory_repository_serves_hot_products_from_cache(mocker):
+    repository = InventoryRepository()
+    product_id = f"product-{uuid.uuid4()}"
+    repository.set_stock(product_id, 4)
+    repository.stock_cache.clear()
+    get_item = mocker.spy(repository.table, "get_item")
+
+    assert repository.is_available(product_id, 4)
+    assert not repository.is_available(product_id, 5)
+    assert repository.is_available(product_id, 1)
+    assert get_item.call_count == 1
+
+
+def test_cart_submit_with_persistent_inventory():
+    inventory = PersistentInventory()
+    suffix = uuid.uuid4()
+    first = Product(f"first-{suffix}", 10, 5, inventory=inventory)
+    second = Product(f"second-{suffix}", 20, 2, inventory=inventory)
+    inventory.register(first, second)
+
+    cart = ShoppingCart(inventory=inventory)
+    cart.add_product(first, 3)
+    cart.add_product(second, 2)
+    inventory.repository.set_stock(str(second), 1)
+    with pytest.raises(OutOfStockError):
+        cart.submit_cart_order()
+    assert second.available_amount == 1
+
+    inventory.repository.set_stock(str(second), 2)
+    assert cart.submit_cart_order() == [str(first), str(second)]
+    assert inventory.repository.get_stock(str(first), consistent=True) == 2
+    assert inventory.repository.get_stock(str(second), consistent=True) == 0
+
+
+def test_default_cart_reserves_in_each_products_inventory():
+    inventory = PersistentInventory()
+    suffix = uuid.uuid4()
+    lamp = Product(f"lamp-{suffix}", 10, 5, inventory=inventory)
+    local = Product(f"local-{suffix}", 5, 4)
+    inventory.register(lamp)
+
+    cart = ShoppingCart()
+    cart.add_product(lamp, 3)
+    cart.add_product(local, 1)
+    cart.submit_cart_order()
+    assert lamp.available_amount == 2
+    assert local.available_amount == 3
+    assert inventory.repository.get_stock(str(lamp), consistent=True) == 2
+
+    # the line short of stock releases what the other inventory held
+    cart.add_product(lamp, 1)
+    cart.add_product(local, 2)
+    inventory.repository.set_stock(str(lamp), 0)
+    with pytest.raises(OutOfStockError) as error:
+        cart.submit_cart_order()
+    assert [line["product"] for line in error.value.unavailable] == [str(lamp)]
+    assert local.available_amount == 3
+
+
+def test_get_recent_shippings_returns_newest_first(dynamo_resource):
+    repository = ShippingRepository()
+    since = datetime.now(timezone.utc)
+    due_date = since + timedelta(days=1)
+    shipping_ids = [
+        repository.create_shipping(
+            "Nova Poshta", ["Product"], f"recent-{i}", "created", due_date
+        )
+        for i in range(5)
+    ]
+
+    recent = repository.get_recent_shippings(since)
+    assert [item["shipping_id"] for item in recent] == shipping_ids[::-1]
+    assert recent[0]["created_day"] == since.strftime("%Y-%m-%d")
+
+    latest = repository.get_recent_shippings(since, limit=2)
+    assert [item["shipping_id"] for item in latest] == shipping_ids[:2:-1]
+
+
+def test_recent_shippings_span_shards_and_time_zones(dynamo_resource):
+    repository = ShippingRepository()
+    now = datetime.now(timezone.utc)
+    # a zone where it is already the next day for most of the UTC day
+    ahead = timezone(timedelta(hours=23 - now.hour, minutes=59))
+    since = now.astimezone(ahead)
+    shipping_ids = [
+        repository.create_shipping(
+            "Nova Poshta", ["Product"], f"sharded-{i}", "created", now + timedelta(1)
+        )
+        for i in range(20)
+    ]
+
+    recent = repository.get_recent_shippings(since)
+    assert [item["shipping_id"] for item in recent] == shipping_ids[::-1]
+    assert len({item["created_shard"] for item in recent}) > 1
+
+
+def test_scheduled_shipping_reaches_workers_near_due_date():
+    publisher = ShippingPublisher()
+    # a queue of its own, so messages left by other tests cannot crowd it out
+    publisher.queue_url = db.get_client("sqs").create_queue(
+        QueueName=f"scheduled-{uuid.uuid4()}"
+    )["QueueUrl"]
+    scheduler = ShippingScheduler(publisher, lead=1.0)
+    shipping_id = str(uuid.uuid4())
+    due_date = datetime.now(timezone.utc) + timedelta(seconds=3)
+    assert scheduler.schedule(shipping_id, due_date) is not None
+
+    def poll(wait_time):
+        return [
+            message
+            for message in publisher.poll_shipping_messages(wait_time=wait_time)
+            if message.shipping_id == shipping_id
+        ]
+
+    assert poll(0) == []
+    messages = []
+    for _ in range(10):
+        messages = poll(1)
+        if messages:
+            break
+
+    assert len(messages) == 1
+    assert messages[0].release_at == pytest.approx(due_date.timestamp() - 1.0)
+    assert datetime.now(timezone.utc) >= due_date - timedelta(seconds=2)
+    assert publisher.delete_shippings(messages) == []
+    db.get_client("sqs").delete_queue(QueueUrl=publisher.queue_url)
+
+
+def test_order_shippings_are_queried_page_by_page(dynamo_resource, mocker):
+    repository = ShippingRepository()
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    order_id = random.randint(10**8, 10**9)
+    shipping_ids = [
+        repository.create_shipping(
+            "Nova Poshta", ["Product"], order_id, "created", due_date
+        )
+        for _ in range(5)
+    ]
+    query = mocker.spy(repository.table, "query")
+
+    shippings = repository.iter_order_shippings(order_id, page_size=2)
+    assert query.call_count == 0
+    assert next(shippings)["shipping_id"] == shipping_ids[0]
+    assert query.call_count == 1
+    assert [item["shipping_id"] for item in shippings] == shipping_ids[1:]
+    assert query.call_count == 3
+
+
+def test_shippings_by_status_are_ordered_by_due_date(dynamo_resource):
+    repository = ShippingRepository()
+    status = f"waiting-{uuid.uuid4()}"
+    start = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    shipping_ids = [
+        repository.create_shipping(
+            "Nova Poshta", ["Product"], "order", status, start + timedelta(hours=hours)
+        )
+        for hours in (3, 1, 2, 4)
+    ]
+
+    ordered = repository.iter_shippings_by_status(status, page_size=3)
+    assert [item["shipping_id"] for item in ordered] == [
+        shipping_ids[1],
+        shipping_ids[2],
+        shipping_ids[0],
+        shipping_ids[3],
+    ]
+    window = repository.iter_shippings_by_status(
+        status, start + timedelta(hours=2), start + timedelta(hours=3)
+    )
+    assert [item["shipping_id"] for item in window] == [
+        shipping_ids[2],
+        shipping_ids[0],
+    ]
+    assert [
+        item["shipping_id"]
+        for item in repository.iter_shippings_by_status(
+            status, due_until=start + timedelta(hours=1)
+        )
+    ] == [shipping_ids[1]]
+
+
+def test_order_lists_its_shipments(dynamo_resource):
+    service = ShippingService(ShippingRepository(), ShippingPublisher())
+    product = Product(f"listed-{uuid.uuid4()}", 10, 10)
+    cart = ShoppingCart()
+    order = Order(cart, service)
+    due_date = datetime.now(timezone.utc) + timedelta(minutes=5)
+    shipping_ids = []
+    for _ in range(2):
+        cart.add_product(product, 1)
+        shipping_ids.append(order.place_order("Нова Пошта", due_date))
+
+    shipments = order.list_shipments()
+    assert [shipment.shipping_id for shipment in shipments] == shipping_ids
+    assert Shipment.check_statuses(shipments) == {
+        shipping_id: "in progress" for shipping_id in shipping_ids
+    }
+
+
+def seed_export_shippings(count):
+    repository = ShippingRepository()
+    order_id = f"export-{uuid.uuid4()}"
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    return repository.create_shippings(
+        [
+            {
+                "shipping_type": "Nova Poshta",
+                "product_ids": [f"product-{i}"],
+                "order_id": order_id,
+                "due_date": due_date,
+            }
+            for i in range(count)
+        ],
+        "created",
+    )
+
+
+def test_export_scans_segments_in_parallel(dynamo_resource, tmp_path):
+    shipping_ids = seed_export_shippings(30)
+    output = tmp_path / "shippings.jsonl.gz"
+
+    result = ShippingExporter(segments=3, chunk_size=4).export(str(output))
+
+    exported = {item["shipping_id"]: item for item in read_export(str(output))}
+    assert len(exported) == result["items"]
+    assert result["chunks"] >= 30 // 4
+    assert not result["resumed"]
+    for index, shipping_id in enumerate(shipping_ids):
+        assert exported[shipping_id]["product_ids"] == [f"product-{index}"]
+        assert exported[shipping_id]["shipping_status"] == "created"
+
+
+def test_interrupted_export_resumes_from_checkpoint(dynamo_resource, tmp_path):
+    class InterruptedExporter(ShippingExporter):
+        def _scan_segment(self, segment, start_key, stopping):
+            pages = super()._scan_segment(segment, start_key, stopping)
+            yield next(pages)
+            raise RuntimeError("interrupted")
+
+    shipping_ids = seed_export_shippings(30)
+    output = tmp_path / "shippings.jsonl.gz"
+    checkpoint = tmp_path / "shippings.checkpoint"
+
+    with pytest.raises(RuntimeError):
+        InterruptedExporter(segments=3, chunk_size=4).export(
+            str(output), str(checkpoint)
+        )
+    assert checkpoint.exists()
+    # a chunk that was being written when the export stopped
+    with open(output, "ab") as file:
+        file.write(b"\x1f\x8b partial chunk")
+
+    result = ShippingExporter(segments=3, chunk_size=4).export(
+        str(output), str(checkpoint)
+    )
+
+    exported = [item["shipping_id"] for item in read_export(str(output))]
+    assert result["resumed"]
+    assert len(exported) == len(set(exported)) == result["items"]
+    assert set(shipping_ids) <= set(exported)
+    assert not checkpoint.exists()
+
+
+def test_legacy_shipping_items_are_still_processed(dynamo_resource):
+    repository = ShippingRepository()
+    service = ShippingService(repository, ShippingPublisher())
+    now = datetime.now(timezone.utc)
+    legacy = {
+        "upcoming": now + timedelta(days=1),
+        "overdue": now - timedelta(days=1),
+    }
+    items = {name: f"legacy-{name}-{uuid.uuid4()}" for name in legacy}
+    for name, due_date in legacy.items():
+        repository.table.put_item(
+            Item={
+                "shipping_id": items[name],
+                "order_id": "legacy-order",
+                "product_ids": "Стіл,Стілець",
+                "shipping_status": "in progress",
+                "created_date": now.isoformat(),
+                "due_date": due_date.isoformat(),
+            }
+        )
+
+    shipping = repository.get_shipping(items["upcoming"])
+    assert shipping["product_ids"] == ["Стіл", "Стілець"]
+    assert shipping["due_ts"] == to_timestamp(legacy["upcoming"])
+
+    service.process_shipping(items["upcoming"])
+    service.process_shipping(items["overdue"])
+    assert service.check_status(items["upcoming"]) == "completed"
+    assert service.check_status(items["overdue"]) == "failed"
+
+
+def test_large_orders_store_compressed_product_ids(dynamo_resource):
+    repository = ShippingRepository()
+    product_ids = [f"product, number {i}" for i in range(300)]
+    shipping_id = repository.create_shipping(
+        "Nova Poshta",
+        product_ids,
+        "large-order",
+        "created",
+        datetime.now(timezone.utc) + timedelta(days=1),
+    )
+
+    stored = repository.table.get_item(Key={"shipping_id": shipping_id})["Item"]
+    assert "product_ids" not in stored
+    assert repository.get_shipping(shipping_id)["product_ids"] == product_ids
+    assert repository.get_shippings([shipping_id], ["product_ids"]) == {
+        shipping_id: {"shipping_id": shipping_id, "product_ids": product_ids}
+    }
+
+
+def _drain(publisher):
+    # every shipping id currently in the queue, deleting what was read
+    shipping_ids = []
+    while True:
+        messages = publisher.poll_shipping_messages(batch_size=10, wait_time=1)
+        if not messages:
+            return shipping_ids
+        shipping_ids.extend(message.shipping_id for message in messages)
+        publisher.delete_shippings(messages)
+
+
+def test_retried_shipping_creation_creates_one_shipping(dynamo_resource):
+    publisher = ShippingPublisher(fifo=True)
+    _drain(publisher)
+    order_id = f"idempotent-order-{uuid.uuid4()}"
+    due_date = datetime.now(timezone.utc) + timedelta(minutes=1)
+
+    # separate services, as if the retry reached another instance
+    shipping_ids = {
+        ShippingService(
+            ShippingRepository(), publisher, idempotent=True
+        ).create_shipping("Нова Пошта", ["Стіл"], order_id, due_date)
+        for _ in range(3)
+    }
+
+    assert len(shipping_ids) == 1
+    shipping_id = shipping_ids.pop()
+    assert [
+        s["shipping_id"] for s in ShippingRepository().iter_order_shippings(order_id)
+    ] == [shipping_id]
+    assert _drain(publisher) == [shipping_id]
+
+
+def test_fifo_publisher_drops_repeated_sends():
+    publisher = ShippingPublisher(fifo=True)
+    _drain(publisher)
+    shipping_id = f"fifo-{uuid.uuid4()}"
+
+    publisher.send_new_shipping(shipping_id)
+    publisher.send_new_shippings([shipping_id, shipping_id])
+
+    assert _drain(publisher) == [shipping_id]
+    with pytest.raises(ValueError):
+        publisher.send_scheduled_shippings([(shipping_id, 0.0)])
+
+
+def test_worker_result_is_not_overwritten_by_create_shipping(mocker):
+    status_cache = LRUStatusCache()
+    publisher = mocker.Mock()
+    service = ShippingService(
+        ShippingRepository(), publisher, status_cache=status_cache
+    )
+    # a worker picks the message up before create_shipping returns
+    publisher.send_new_shipping.side_effect = service.process_shipping
+
+    shipping_id = service.create_shipping(
+        "Нова Пошта",
+        ["Стіл"],
+        "raced-order",
+        datetime.now(timezone.utc) + timedelta(minutes=1),
+    )
+
+    assert service.repository.get_shipping(shipping_id)["shipping_status"] == (
+        "completed"
+    )
+    assert service.check_status(shipping_id) == "completed"
+
+
+def test_failed_publish_moves_shipping_back_to_created(mocker):
+    publisher = mocker.Mock()
+    publisher.send_new_shipping.side_effect = RuntimeError("queue unavailable")
+    repository = ShippingRepository()
+    service = ShippingService(repository, publisher)
+    create_shipping = mocker.spy(repository, "create_shipping")
+
+    with pytest.raises(RuntimeError):
+        service.create_shipping(
+            "Нова Пошта",
+            ["Стіл"],
+            "unpublished-order",
+            datetime.now(timezone.utc) + timedelta(minutes=1),
+        )
+
+    shipping_id = create_shipping.spy_return
+    assert repository.get_shipping(shipping_id)["shipping_status"] == "created"
+
+
+def test_overlapping_retry_does_not_publish_twice(mocker):
+    publisher = mocker.Mock()
+    order_id = f"overlapping-order-{uuid.uuid4()}"
+    due_date = datetime.now(timezone.utc) + timedelta(minutes=1)
+
+    def create():
+        # a new service per call, as if the retry reached another instance
+        service = ShippingService(ShippingRepository(), publisher, idempotent=True)
+        return service.create_shipping("Нова Пошта", ["Стіл"], order_id, due_date)
+
+    retried = []
+    # the client times out and retries while the first call is publishing
+    publisher.send_new_shipping.side_effect = lambda shipping_id: retried.append(
+        create()
+    )
+
+    shipping_id = create()
+
+    assert retried == [shipping_id]
+    publisher.send_new_shipping.assert_called_once_with(shipping_id)
+
+
+def test_repository_tables_are_per_thread():
+    repository = ShippingRepository()
+    tables = {}
+
+    def resolve(name):
+        tables[name] = (repository.table, repository.resource)
+
+    workers = [threading.Thread(target=resolve, args=(n,)) for n in ("a", "b")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert tables["a"][0] is not tables["b"][0]
+    for table, resource in tables.values():
+        assert table.meta.client is resource.meta.client
+    assert repository.table is repository.table
+    assert repository.table is not tables["a"][0]
+
+
+def test_migration_indexes_legacy_shipping_table(dynamo_resource):
+    client = db.get_client("dynamodb")
+    legacy = {
+        "TableName": f"LegacyShippingTable-{uuid.uuid4()}",
+        "KeySchema": SHIPPING_TABLE["KeySchema"],
+        "AttributeDefinitions": [
+            {"AttributeName": "shipping_id", "AttributeType": "S"},
+            {"AttributeName": "created_day", "AttributeType": "S"},
+        ],
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": RECENT_SHIPPINGS_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "created_day", "KeyType": "HASH"},
+                    {"AttributeName": "shipping_id", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+        "BillingMode": "PAY_PER_REQUEST",
+    }
+    client.create_table(**legacy)
+    table = dynamo_resource.Table(legacy["TableName"])
+    due_date = datetime.now(timezone.utc) + timedelta(days=1)
+    table.put_item(
+        Item={
+            "shipping_id": "legacy-shipping",
+            "order_id": "legacy-order",
+            "product_ids": "Стіл",
+            "shipping_status": "in progress",
+            "created_date": datetime.now(timezone.utc).isoformat(),
+            "created_day": "2024-05-01",
+            "due_date": due_date.isoformat(),
+        }
+    )
+
+    try:
+        migrate_tables(
+            client, [{**SHIPPING_TABLE, "TableName": legacy["TableName"]}], 0.1
+        )
+        repository = ShippingRepository()
+        assert repository.backfill_index_attributes(table) == 1
+        assert repository.backfill_index_attributes(table) == 0
+
+        indexes = client.describe_table(TableName=legacy["TableName"])["Table"][
+            "GlobalSecondaryIndexes"
+        ]
+        assert {index["IndexName"]: index["KeySchema"] for index in indexes} == {
+            index["IndexName"]: index["KeySchema"]
+            for index in SHIPPING_TABLE["GlobalSecondaryIndexes"]
+        }
+        by_order = table.query(
+            IndexName=ORDER_SHIPPINGS_INDEX,
+            KeyConditionExpression=Key("order_key").eq("legacy-order"),
+        )["Items"]
+        assert [item["shipping_id"] for item in by_order] == ["legacy-shipping"]
+        by_due = table.query(
+            IndexName=STATUS_DUE_INDEX,
+            KeyConditionExpression=Key("shipping_status").eq("in progress")
+            & Key("due_ts").eq(to_timestamp(due_date)),
+        )["Items"]
+        assert [item["shipping_id"] for item in by_due] == ["legacy-shipping"]
+        assert by_order[0]["created_shard"].startswith("2024-05-01#")
+    finally:
+        client.delete_table(TableName=legacy["TableName"])
@@ -1,6 +1,28 @@
+import asyncio
+import threading
 import unittest
-from unittest.mock import MagicMock
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, call, patch
 from app.eshop import Product, Shipment, ShoppingCart, Order
+from app.catalog import Catalog, ProductIndex, ProductView, SlottedProduct
+from app.inventory import Inventory, OutOfStockError
+from app.pricing import CartCheck, check_carts
+from services.cache import LRUStatusCache
+from services import instrumentation
+from services.ids import UUID7Generator
+from services.items import decode_item, encode_product_ids, to_timestamp
+from services.instrumentation import MemoryExporter, PrometheusExporter
+from services.memory import (
+    MemoryDynamoDBResource,
+    MemoryDynamoDBClient,
+    MemorySQSClient,
+)
+from services.publisher import ShippingNotPublished
+from services.scheduler import DEFERRED, ShippingScheduler
+from services.repository import ShippingTransitionRejected
+from services.schema import SHIPPING_TABLE
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 from services.service import ShippingService
 
 
@@ -163,6 +185,40 @@ class TestOrder(unittest.TestCase):
             "Express", ["OrderProduct"], self.order.order_id, due_date
         )
 
+    def test_every_order_gets_its_own_id(self):
+        # Кожне замовлення отримує власний ідентифікатор
+        another = Order(cart=self.cart, shipping_service=self.shipping_service)
+        self.assertNotEqual(self.order.order_id, another.order_id)
+        self.assertLess(self.order.order_id, another.order_id)
+
+    def test_list_shipments(self):
+        # Замовлення повертає свої доставки з одного запиту до сервісу
+        self.shipping_service.list_order_shippings.return_value = [
+            {"shipping_id": "shipping-1"},
+            {"shipping_id": "shipping-2"},
+        ]
+        shipments = self.order.list_shipments()
+        self.shipping_service.list_order_shippings.assert_called_once_with(
+            self.order.order_id
+        )
+        self.assertEqual(
+            [s.shipping_id for s in shipments], ["shipping-1", "shipping-2"]
+        )
+        self.assertIs(shipments[0].shipping_service, self.shipping_service)
+
+    def test_place_order_async(self):
+        # Перевірка асинхронного розміщення замовлення
+        async_service = AsyncMock()
+        async_service.create_shipping.return_value = "shipping-456"
+        order = Order(cart=self.cart, shipping_service=async_service)
+
+        shipping_id = asyncio.run(order.place_order_async("Express"))
+
+        self.assertEqual(shipping_id, "shipping-456")
+        self.assertEqual(self.product.available_amount, 6)
+        args = async_service.create_shipping.await_args.args
+        self.assertEqual(args[:3], ("Express", ["OrderProduct"], order.order_id))
+
 
 class TestShipment(unittest.TestCase):
     def setUp(self):
@@ -178,6 +234,1038 @@ class TestShipment(unittest.TestCase):
         self.assertEqual(status, "in_progress", "Статус доставки має бути in_progress")
         self.shipping_service.check_status.assert_called_with("shipping-123")
 
+    def test_check_statuses_reads_once_per_service(self):
+        # Перевірка статусів кількох доставок одним запитом на сервіс
+        self.shipping_service.check_statuses.return_value = {
+            "shipping-123": "in_progress",
+            "shipping-456": "completed",
+        }
+        other_service = MagicMock(spec=ShippingService)
+        other_service.check_statuses.return_value = {"shipping-789": "failed"}
+        shipments = [
+            self.shipment,
+            Shipment(
+                shipping_id="shipping-456", shipping_service=self.shipping_service
+            ),
+            Shipment(shipping_id="shipping-789", shipping_service=other_service),
+        ]
+
+        statuses = Shipment.check_statuses(shipments)
+
+        self.assertEqual(
+            statuses,
+            {
+                "shipping-123": "in_progress",
+                "shipping-456": "completed",
+                "shipping-789": "failed",
+            },
+        )
+        self.shipping_service.check_statuses.assert_called_once_with(
+            ["shipping-123", "shipping-456"]
+        )
+        other_service.check_statuses.assert_called_once_with(["shipping-789"])
+
+
+class TestInventory(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4, reservation_ttl=60)
+        self.product = Product(
+            name="StockProduct",
+            price=10.0,
+            available_amount=10,
+            inventory=self.inventory,
+        )
+
+    def test_reserve_holds_stock(self):
+        # Резервування одразу зменшує доступну кількість
+        self.inventory.reserve(self.product, 4)
+        self.assertEqual(self.product.available_amount, 6)
+        self.assertFalse(self.product.is_available(7))
+
+    def test_reserve_insufficient_amount(self):
+        # Не можна зарезервувати більше, ніж є в наявності
+        with self.assertRaises(ValueError):
+            self.inventory.reserve(self.product, 11)
+        self.assertEqual(self.product.available_amount, 10)
+
+    def test_release_returns_stock(self):
+        # Звільнення резерву повертає товар
+        reservation = self.inventory.reserve(self.product, 4)
+        self.assertTrue(self.inventory.release(reservation))
+        self.assertFalse(self.inventory.release(reservation))
+        self.assertEqual(self.product.available_amount, 10)
+
+    def test_commit_keeps_stock_taken(self):
+        # Підтверджений резерв не повертається
+        reservation = self.inventory.reserve(self.product, 4)
+        self.inventory.commit(reservation)
+        self.assertTrue(reservation.committed)
+        self.assertFalse(self.inventory.release(reservation))
+        self.assertEqual(self.product.available_amount, 6)
+
+    def test_expired_reservation_is_released(self):
+        # Прострочений резерв повертає товар і не може бути підтверджений
+        with patch("app.inventory.time.monotonic", return_value=100.0):
+            reservation = self.inventory.reserve(self.product, 4)
+        with patch("app.inventory.time.monotonic", return_value=161.0):
+            with self.assertRaises(ValueError):
+                self.inventory.commit(reservation)
+        self.assertEqual(self.product.available_amount, 10)
+
+    def test_concurrent_buy_does_not_oversell(self):
+        # Паралельні покупки не продають більше, ніж є на складі
+        product = Product(
+            name="HotProduct", price=1.0, available_amount=100, inventory=self.inventory
+        )
+        sold = []
+
+        def checkout():
+            for _ in range(50):
+                try:
+                    product.buy(1)
+                    sold.append(1)
+                except ValueError:
+                    pass
+
+        threads = [threading.Thread(target=checkout) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(sold), 100)
+        self.assertEqual(product.available_amount, 0)
+
+
+class TestTransactionalCartSubmit(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4)
+        self.cart = ShoppingCart(inventory=self.inventory)
+        self.first = Product("First", 10.0, 5, inventory=self.inventory)
+        self.second = Product("Second", 20.0, 5, inventory=self.inventory)
+        self.third = Product("Third", 30.0, 5, inventory=self.inventory)
+
+    def test_submit_is_all_or_nothing(self):
+        # Якщо один рядок недоступний, жоден товар не списується
+        self.cart.add_product(self.first, 3)
+        self.cart.add_product(self.second, 4)
+        self.cart.add_product(self.third, 5)
+        self.second.available_amount = 1
+        self.third.available_amount = 2
+
+        with self.assertRaises(OutOfStockError) as context:
+            self.cart.submit_cart_order()
+
+        self.assertEqual(
+            context.exception.unavailable,
+            [
+                {"product": "Second", "requested": 4, "available": 1},
+                {"product": "Third", "requested": 5, "available": 2},
+            ],
+        )
+        self.assertIsInstance(context.exception, ValueError)
+        self.assertEqual(self.first.available_amount, 5)
+        self.assertEqual(len(self.cart.products), 3, "Кошик не має очищатися")
+
+    def test_submit_takes_every_line(self):
+        # Успішне оформлення списує всі рядки
+        self.cart.add_product(self.first, 3)
+        self.cart.add_product(self.second, 4)
+        self.assertEqual(self.cart.submit_cart_order(), ["First", "Second"])
+        self.assertEqual(self.first.available_amount, 2)
+        self.assertEqual(self.second.available_amount, 1)
+
+    def test_overlapping_carts_do_not_deadlock(self):
+        # Кошики з однаковими товарами в різному порядку не блокують один одного
+        products = [
+            Product(f"Shared{i}", 1.0, 10000, inventory=self.inventory)
+            for i in range(8)
+        ]
+
+        def checkout(ordered):
+            for _ in range(200):
+                cart = ShoppingCart(inventory=self.inventory)
+                for product in ordered:
+                    cart.add_product(product, 1)
+                cart.submit_cart_order()
+
+        threads = [
+            threading.Thread(target=checkout, args=(products,)),
+            threading.Thread(target=checkout, args=(list(reversed(products)),)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        for product in products:
+            self.assertEqual(product.available_amount, 10000 - 400)
+
+
+class TestCartTotals(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4)
+        self.cart = ShoppingCart(inventory=self.inventory)
+        self.cheap = Product("Cheap", 0.1, 100, inventory=self.inventory)
+        self.other = Product("Other", 0.2, 100, inventory=self.inventory)
+
+    def test_subtotal_is_exact(self):
+        # Сума рахується без похибки float
+        self.cart.add_product(self.cheap, 3)
+        self.cart.add_product(self.other, 1)
+        self.assertEqual(self.cart.subtotal, Decimal("0.5"))
+        self.assertEqual(self.cart.calculate_total(), 0.5)
+        self.assertEqual(self.cart.line_count, 2)
+        self.assertEqual(self.cart.item_count, 4)
+
+    def test_totals_follow_every_change(self):
+        # Заміна, видалення та оформлення оновлюють суму
+        self.cart.add_product(self.cheap, 3)
+        self.cart.add_product(self.other, 2)
+        self.cart.add_product(self.cheap, 1)
+        self.assertEqual(self.cart.subtotal, Decimal("0.5"))
+        self.assertEqual(list(self.cart.products), [self.cheap, self.other])
+
+        self.cart.remove_product(self.other)
+        self.assertEqual(self.cart.subtotal, Decimal("0.1"))
+        self.assertEqual(self.cart.item_count, 1)
+
+        self.cart.submit_cart_order()
+        self.assertEqual(self.cart.subtotal, Decimal(0))
+        self.assertEqual(self.cart.item_count, 0)
+
+    def test_reprice_takes_current_prices(self):
+        # Рядки зберігають ціну на момент додавання до reprice()
+        self.cart.add_product(self.cheap, 2)
+        self.cheap.price = 0.3
+        self.assertEqual(self.cart.subtotal, Decimal("0.2"))
+        self.assertEqual(self.cart.reprice(), Decimal("0.6"))
+        self.cart.remove_product(self.cheap)
+        self.assertEqual(self.cart.subtotal, Decimal(0))
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4)
+        self.catalog = Catalog(inventory=self.inventory)
+        self.catalog.extend([("First", 10, 5), ("Second", 2.5, 0)])
+
+    def test_views_read_and_write_columns(self):
+        # Представлення працює напряму з колонками каталогу
+        view = self.catalog["First"]
+        self.assertIsInstance(view, ProductView)
+        self.assertEqual(
+            (view.name, view.price, view.available_amount), ("First", 10.0, 5)
+        )
+        view.buy(3)
+        self.assertEqual(self.catalog.stock[0], 2)
+        self.assertFalse(view.is_available(3))
+        with self.assertRaises(ValueError):
+            view.buy(3)
+
+    def test_lookup_and_iteration(self):
+        # Пошук за назвою та ітерація у порядку додавання
+        self.assertIn("Second", self.catalog)
+        self.assertIsNone(self.catalog.get("Missing"))
+        self.assertEqual([str(p) for p in self.catalog], ["First", "Second"])
+        self.assertTrue(self.catalog.is_available("First", 5))
+        self.assertFalse(self.catalog.is_available("Second", 1))
+        self.assertFalse(self.catalog.is_available("Missing", 0))
+        with self.assertRaises(ValueError):
+            self.catalog.add("First", 1, 1)
+
+    def test_views_can_be_bought_through_a_cart(self):
+        # Представлення можна покласти в кошик
+        cart = ShoppingCart(inventory=self.inventory)
+        cart.add_product(self.catalog["First"], 4)
+        self.assertEqual(cart.calculate_total(), 40.0)
+        cart.submit_cart_order()
+        self.assertEqual(self.catalog["First"].available_amount, 1)
+
+    def test_slotted_product_has_no_dict(self):
+        # Компактний продукт не має __dict__ і поводиться як Product
+        product = SlottedProduct("Slotted", 3, 2, inventory=self.inventory)
+        self.assertFalse(hasattr(product, "__dict__"))
+        self.assertEqual(product, SlottedProduct("Slotted", 1, 1))
+        product.buy(2)
+        self.assertFalse(product.is_available(1))
+        with self.assertRaises(ValueError):
+            SlottedProduct("Broken", 1, "many")
+
+
+class TestProductIndex(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4)
+        self.products = [
+            Product(f"Product{i}", 10 * i, i % 3, inventory=self.inventory)
+            for i in range(1, 10)
+        ]
+        self.index = ProductIndex(self.products, inventory=self.inventory)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_lookup_by_name_follows_product_equality(self):
+        # Пошук за назвою збігається з Product.__eq__
+        self.assertIs(self.index.get("Product4"), self.products[3])
+        self.assertIn(Product("Product4", 1, 1), self.index)
+        self.assertIsNone(self.index.get("Missing"))
+        with self.assertRaises(ValueError):
+            self.index.add(Product("Product4", 1, 1))
+
+    def test_price_range(self):
+        # Діапазон цін включає обидві межі
+        found = self.index.price_range(30, 60)
+        self.assertEqual([p.name for p in found], [f"Product{i}" for i in range(3, 7)])
+        in_stock = self.index.price_range(30, 60, in_stock_only=True)
+        self.assertEqual([p.name for p in in_stock], ["Product4", "Product5"])
+
+    def test_stock_changes_update_bitmap(self):
+        # Купівля та повернення товару оновлюють бітмапу
+        self.assertEqual(self.index.count_in_stock(), 6)
+        self.products[0].buy(1)
+        self.assertFalse(self.index.is_in_stock(self.products[0]))
+
+        cart = ShoppingCart(inventory=self.inventory)
+        cart.add_product(self.products[1], 2)
+        cart.submit_cart_order()
+        self.assertEqual(self.index.count_in_stock(), 4)
+
+        reservation = self.inventory.reserve(self.products[3], 1)
+        self.assertFalse(self.index.is_in_stock(self.products[3]))
+        self.inventory.release(reservation)
+        self.assertTrue(self.index.is_in_stock(self.products[3]))
+        self.assertEqual(
+            [p.name for p in self.index.in_stock()],
+            ["Product4", "Product5", "Product7", "Product8"],
+        )
+
+    def test_remove_and_reprice(self):
+        # Видалення та зміна ціни оновлюють індекси без перебудови
+        self.index.remove(self.products[4])
+        self.assertNotIn(self.products[4], self.index)
+        self.index.reprice(self.products[0], 55)
+        self.assertEqual(self.products[0].price, 55.0)
+        found = self.index.price_range(50, 60)
+        self.assertEqual([p.name for p in found], ["Product1", "Product6"])
+
+        replacement = Product("Replacement", 5, 1, inventory=self.inventory)
+        self.index.add(replacement)
+        self.assertEqual(len(self.index), 9)
+        self.assertTrue(self.index.is_in_stock(replacement))
+        self.assertEqual(self.index.price_range(0, 9), [replacement])
+
+    def test_dropped_index_stops_following_inventory(self):
+        # Індекс без посилань відписується від складу, with-блок закриває його
+        import gc
+
+        with ProductIndex(self.products, inventory=self.inventory) as index:
+            self.assertEqual(len(self.inventory._listeners), 2)
+        self.assertEqual(len(self.inventory._listeners), 1)
+
+        index = ProductIndex(self.products, inventory=self.inventory)
+        self.assertEqual(len(self.inventory._listeners), 2)
+        del index
+        gc.collect()
+        self.assertEqual(len(self.inventory._listeners), 1)
+        self.products[0].buy(1)
+        self.assertFalse(self.index.is_in_stock(self.products[0]))
+
+
+class TestCheckCarts(unittest.TestCase):
+    def setUp(self):
+        self.inventory = Inventory(stripes=4)
+        self.first = Product("First", 10, 5, inventory=self.inventory)
+        self.second = Product("Second", 2.5, 3, inventory=self.inventory)
+
+    def make_cart(self, *lines):
+        cart = ShoppingCart(inventory=self.inventory)
+        for product, amount in lines:
+            cart.add_product(product, amount)
+        return cart
+
+    def test_totals_and_availability_per_cart(self):
+        # Суми та доступність рахуються для кожного кошика окремо
+        carts = [
+            self.make_cart((self.first, 2), (self.second, 3)),
+            self.make_cart(),
+            self.make_cart((self.second, 1)),
+        ]
+        self.second.available_amount = 2
+        self.first.price = 12.0
+
+        self.assertEqual(
+            check_carts(carts),
+            [
+                CartCheck(31.5, False, ["Second"]),
+                CartCheck(0.0, True),
+                CartCheck(2.5, True),
+            ],
+        )
+
+    def test_matches_per_cart_calculation(self):
+        # Результат збігається з покроковим розрахунком
+        carts = [
+            self.make_cart((self.first, 1 + i % 5), (self.second, 1 + i % 3))
+            for i in range(50)
+        ]
+        for cart, check in zip(carts, check_carts(carts)):
+            self.assertAlmostEqual(check.total, cart.calculate_total())
+            self.assertEqual(
+                check.available,
+                all(p.is_available(amount) for p, amount in cart.products.items()),
+            )
+
+    def test_price_and_stock_read_once_per_product(self):
+        # Ціна та залишок спільного товару читаються один раз на всі кошики
+        carts = [self.make_cart((self.first, 1 + i % 3)) for i in range(10)]
+        with patch.object(
+            Product, "price", new_callable=PropertyMock, return_value=4.0, create=True
+        ) as price:
+            checks = check_carts(carts)
+        self.assertEqual(price.call_count, 1)
+        self.assertEqual(
+            [c.total for c in checks], [4.0 * (1 + i % 3) for i in range(10)]
+        )
+
+    def test_no_carts(self):
+        # Порожній список кошиків
+        self.assertEqual(check_carts([]), [])
+
+
+class TestUUID7Generator(unittest.TestCase):
+    def test_ids_increase_within_a_millisecond(self):
+        # Ідентифікатори зростають навіть в межах однієї мілісекунди
+        generator = UUID7Generator(clock=lambda: 1_700_000_000_000_000_000)
+        ids = [generator.new_id() for _ in range(1000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(i[14] == "7" and i[19] in "89ab" for i in ids))
+
+    def test_ids_increase_when_clock_steps_back(self):
+        # Годинник, що йде назад, не ламає порядок
+        ticks = iter([5_000_000_000, 4_000_000_000, 6_000_000_000])
+        generator = UUID7Generator(clock=lambda: next(ticks))
+        first, second, third = (generator.new_id() for _ in range(3))
+        self.assertLess(first, second)
+        self.assertLess(second, third)
+
+    def test_ids_are_unique_across_threads(self):
+        # Генератор безпечний для багатьох потоків
+        generator = UUID7Generator()
+        results = [[] for _ in range(8)]
+
+        def generate(result):
+            result.extend(generator.new_id() for _ in range(2000))
+
+        threads = [threading.Thread(target=generate, args=(r,)) for r in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ids = [i for result in results for i in result]
+        self.assertEqual(len(set(ids)), len(ids))
+        for result in results:
+            self.assertEqual(result, sorted(result))
+
+    def test_lower_bound_and_timestamp(self):
+        # Нижня межа та час створення відповідають мілісекунді
+        from datetime import datetime, timezone
+
+        moment = datetime(2024, 5, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+        clock = int(moment.timestamp() * 1000) * 1_000_000
+        id_value = UUID7Generator(clock=lambda: clock).new_id()
+        self.assertEqual(UUID7Generator.timestamp(id_value), moment)
+        self.assertLessEqual(UUID7Generator.lower_bound(moment), id_value)
+        self.assertGreater(
+            UUID7Generator.lower_bound(moment.replace(microsecond=124000)), id_value
+        )
+
+
+class TestMemoryDynamoDB(unittest.TestCase):
+    def setUp(self):
+        self.client = MemoryDynamoDBClient()
+        self.client.create_table(**SHIPPING_TABLE)
+        self.table = MemoryDynamoDBResource(self.client).Table(
+            SHIPPING_TABLE["TableName"]
+        )
+
+    def put(self, shipping_id, status, day="2024-05-01"):
+        self.table.put_item(
+            Item={
+                "shipping_id": shipping_id,
+                "shipping_status": status,
+                "created_shard": f"{day}#0",
+            }
+        )
+
+    def test_conditional_update(self):
+        # Умовне оновлення відхиляється так само, як у DynamoDB
+        self.put("a", "created")
+        response = self.table.update_item(
+            Key={"shipping_id": "a"},
+            UpdateExpression="SET shipping_status = :s ADD attempts :one",
+            ConditionExpression=Attr("shipping_status").is_in(["created"]),
+            ExpressionAttributeValues={":s": "completed", ":one": 1},
+            ReturnValues="ALL_NEW",
+        )
+        self.assertEqual(response["Attributes"]["shipping_status"], "completed")
+        self.assertEqual(response["Attributes"]["attempts"], Decimal(1))
+
+        with self.assertRaises(ClientError) as context:
+            self.table.update_item(
+                Key={"shipping_id": "a"},
+                UpdateExpression="SET shipping_status = :s",
+                ConditionExpression="shipping_status = :created",
+                ExpressionAttributeValues={":s": "failed", ":created": "created"},
+            )
+        self.assertEqual(
+            context.exception.response["Error"]["Code"],
+            "ConditionalCheckFailedException",
+        )
+
+    def test_transaction_reports_every_failed_condition(self):
+        # Транзакція не змінює нічого, якщо хоч одна умова не виконана
+        self.put("a", "created")
+        with self.assertRaises(ClientError) as context:
+            self.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Put": {
+                            "TableName": self.table.name,
+                            "Item": {"shipping_id": "b"},
+                        }
+                    },
+                    {
+                        "Update": {
+                            "TableName": self.table.name,
+                            "Key": {"shipping_id": "a"},
+                            "UpdateExpression": "SET shipping_status = :s",
+                            "ConditionExpression": "attribute_not_exists(#id)",
+                            "ExpressionAttributeNames": {"#id": "shipping_id"},
+                            "ExpressionAttributeValues": {":s": "failed"},
+                        }
+                    },
+                ]
+            )
+        response = context.exception.response
+        self.assertEqual(response["Error"]["Code"], "TransactionCanceledException")
+        self.assertEqual(
+            [reason["Code"] for reason in response["CancellationReasons"]],
+            ["None", "ConditionalCheckFailed"],
+        )
+        self.assertNotIn("Item", self.table.get_item(Key={"shipping_id": "b"}))
+
+    def test_query_pages_through_index(self):
+        # Запит по індексу повертає сторінки у зворотному порядку
+        for shipping_id in "abcde":
+            self.put(shipping_id, "created")
+        self.put("f", "created", day="2024-05-02")
+        params = {
+            "IndexName": SHIPPING_TABLE["GlobalSecondaryIndexes"][0]["IndexName"],
+            "KeyConditionExpression": Key("created_shard").eq("2024-05-01#0")
+            & Key("shipping_id").gte("b"),
+            "ScanIndexForward": False,
+            "Limit": 3,
+        }
+        first = self.table.query(**params)
+        second = self.table.query(ExclusiveStartKey=first["LastEvaluatedKey"], **params)
+        self.assertEqual([i["shipping_id"] for i in first["Items"]], ["e", "d", "c"])
+        self.assertEqual([i["shipping_id"] for i in second["Items"]], ["b"])
+        self.assertNotIn("LastEvaluatedKey", second)
+
+    def test_batch_limits_and_float_values(self):
+        # Ліміти пакетних операцій і заборона float
+        with self.assertRaises(ClientError):
+            self.client.batch_get_item(
+                RequestItems={
+                    self.table.name: {
+                        "Keys": [{"shipping_id": str(i)} for i in range(101)]
+                    }
+                }
+            )
+        with self.assertRaises(TypeError):
+            self.table.put_item(Item={"shipping_id": "a", "price": 1.5})
+
+
+class TestMemorySQS(unittest.TestCase):
+    def setUp(self):
+        self.client = MemorySQSClient()
+        self.queue_url = self.client.create_queue(QueueName="queue")["QueueUrl"]
+
+    def test_visibility_timeout_and_delete(self):
+        # Неприбране повідомлення повертається після тайм-ауту видимості
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody="first")
+        received = self.client.receive_message(
+            QueueUrl=self.queue_url, VisibilityTimeout=0.05
+        )["Messages"]
+        self.assertEqual(received[0]["Body"], "first")
+        self.assertNotIn(
+            "Messages", self.client.receive_message(QueueUrl=self.queue_url)
+        )
+
+        again = self.client.receive_message(QueueUrl=self.queue_url, WaitTimeSeconds=1)[
+            "Messages"
+        ]
+        self.assertEqual(again[0]["MessageId"], received[0]["MessageId"])
+        response = self.client.delete_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[
+                {"Id": "old", "ReceiptHandle": received[0]["ReceiptHandle"]},
+                {"Id": "new", "ReceiptHandle": again[0]["ReceiptHandle"]},
+            ],
+        )
+        self.assertEqual([e["Id"] for e in response["Successful"]], ["new"])
+        self.assertEqual([e["Id"] for e in response["Failed"]], ["old"])
+
+    def test_long_poll_wakes_up_on_send(self):
+        # Довге опитування завершується, щойно надходить повідомлення
+        timer = threading.Timer(
+            0.05,
+            lambda: self.client.send_message(QueueUrl=self.queue_url, MessageBody="x"),
+        )
+        timer.start()
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url, WaitTimeSeconds=5, MaxNumberOfMessages=10
+        )
+        timer.join()
+        self.assertEqual([m["Body"] for m in response["Messages"]], ["x"])
+
+    def test_fifo_deduplication_and_groups(self):
+        # FIFO-черга відкидає повторне повідомлення з тим самим ідентифікатором
+        # дедуплікації і не видає наступне повідомлення групи, поки попереднє
+        # в обробці
+        url = self.client.create_queue(
+            QueueName="queue.fifo", Attributes={"FifoQueue": "true"}
+        )["QueueUrl"]
+        first = self.client.send_message(
+            QueueUrl=url,
+            MessageBody="a",
+            MessageGroupId="g",
+            MessageDeduplicationId="a",
+        )
+        repeated = self.client.send_message(
+            QueueUrl=url,
+            MessageBody="a",
+            MessageGroupId="g",
+            MessageDeduplicationId="a",
+        )
+        self.assertEqual(first["MessageId"], repeated["MessageId"])
+        self.client.send_message(
+            QueueUrl=url,
+            MessageBody="b",
+            MessageGroupId="g",
+            MessageDeduplicationId="b",
+        )
+
+        received = self.client.receive_message(QueueUrl=url, MaxNumberOfMessages=10)[
+            "Messages"
+        ]
+        self.assertEqual([m["Body"] for m in received], ["a", "b"])
+        self.assertNotIn("Messages", self.client.receive_message(QueueUrl=url))
+
+        with self.assertRaises(ClientError):
+            self.client.send_message(QueueUrl=url, MessageBody="c")
+
+    def test_missing_queue(self):
+        # Неіснуюча черга дає ту ж помилку, що й SQS
+        with self.assertRaises(ClientError) as context:
+            self.client.get_queue_url(QueueName="missing")
+        self.assertEqual(
+            context.exception.response["Error"]["Code"],
+            "AWS.SimpleQueueService.NonExistentQueue",
+        )
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.exporter = MemoryExporter()
+        instrumentation.enable(self.exporter)
+        self.addCleanup(instrumentation.disable)
+        self.product = Product(name="SpanProduct", price=5.0, available_amount=10)
+        self.cart = ShoppingCart()
+        self.cart.add_product(self.product, 2)
+        self.repository = MagicMock()
+        self.repository.create_shipping.return_value = "shipping-1"
+        self.service = ShippingService(self.repository, MagicMock())
+
+    def test_place_order_spans_are_nested(self):
+        # Кожен виклик стає спаном із батьківським спаном замовлення
+        from datetime import datetime, timedelta, timezone
+
+        order = Order(cart=self.cart, shipping_service=self.service)
+        order.place_order("Нова Пошта", datetime.now(timezone.utc) + timedelta(1))
+
+        parents = {span.name: span.parent for span in self.exporter.spans}
+        self.assertEqual(
+            parents,
+            {
+                "ShoppingCart.submit_cart_order": "Order.place_order",
+                "ShippingService.validate_shipping": "ShippingService.create_shipping",
+                "ShippingService.create_shipping": "Order.place_order",
+                "Order.place_order": None,
+            },
+        )
+
+    def test_errors_are_counted(self):
+        # Виняток позначає спан як помилковий і не поглинається
+        with self.assertRaises(ValueError):
+            self.service.validate_shipping("Unknown", None)
+        stats = self.exporter.stats()["ShippingService.validate_shipping"]
+        self.assertEqual((stats["calls"], stats["errors"]), (1, 1))
+        self.assertIs(self.exporter.spans[-1].error, ValueError)
+
+    def test_disabled_records_nothing(self):
+        # Вимкнене інструментування нічого не записує
+        instrumentation.disable()
+        self.cart.submit_cart_order()
+        instrumentation.count("orders")
+        self.assertEqual(len(self.exporter.spans), 0)
+        self.assertEqual(self.exporter.counters, {})
+
+    def test_borrowed_methods_keep_their_span(self):
+        # Спільні з синхронним сервісом методи не обгортаються вдруге
+        from services.aio import AsyncShippingService
+
+        self.assertIs(
+            AsyncShippingService.validate_shipping, ShippingService.validate_shipping
+        )
+        self.assertEqual(
+            AsyncShippingService.create_shipping.__qualname__,
+            "AsyncShippingService.create_shipping",
+        )
+
+    def test_prometheus_exporter(self):
+        # Експорт у текстовому форматі Prometheus
+        exporter = PrometheusExporter(buckets=(0.5, 1.0))
+        instrumentation.enable(exporter)
+        with self.assertRaises(ValueError):
+            with instrumentation.span("checkout"):
+                raise ValueError("boom")
+        instrumentation.count("orders", 3)
+
+        text = exporter.render()
+        self.assertIn(
+            'eshop_span_duration_seconds_bucket{span="checkout",le="0.5"} 1', text
+        )
+        self.assertIn(
+            'eshop_span_duration_seconds_bucket{span="checkout",le="+Inf"} 1', text
+        )
+        self.assertIn('eshop_span_duration_seconds_count{span="checkout"} 1', text)
+        self.assertIn('eshop_span_errors_total{span="checkout"} 1', text)
+        self.assertIn('eshop_events_total{name="orders"} 3', text)
+
+
+class TestShippingScheduler(unittest.TestCase):
+    def setUp(self):
+        from datetime import datetime, timezone
+
+        self.now = 1_000_000.0
+        self.epoch = datetime.fromtimestamp(self.now, timezone.utc)
+        self.publisher = MagicMock()
+        self.publisher.send_scheduled_shippings.side_effect = lambda schedule: [
+            f"message-{shipping_id}" for shipping_id, _ in schedule
+        ]
+        self.scheduler = ShippingScheduler(
+            self.publisher, lead=1.0, max_delay=900, clock=lambda: self.now
+        )
+
+    def due_in(self, seconds):
+        from datetime import timedelta
+
+        return self.epoch + timedelta(seconds=seconds)
+
+    def test_short_horizon_goes_to_sqs_with_delay(self):
+        # Близька доставка одразу йде в SQS із затримкою до моменту випуску
+        result = self.scheduler.schedule("soon", self.due_in(60))
+
+        self.assertEqual(result, "message-soon")
+        self.publisher.send_scheduled_shippings.assert_called_once_with(
+            [("soon", self.now + 59)]
+        )
+        self.assertEqual(self.scheduler.deferred_count(), 0)
+
+    def test_long_horizon_is_released_in_batches(self):
+        # Далекі доставки чекають у купі й передаються разом, коли настає їхній час
+        results = self.scheduler.schedule_many(
+            [
+                ("later", self.due_in(3600.5)),
+                ("soon", self.due_in(10)),
+                ("first", self.due_in(3600)),
+                ("tomorrow", self.due_in(86400)),
+            ]
+        )
+        self.assertEqual(results, [DEFERRED, "message-soon", DEFERRED, DEFERRED])
+        self.assertEqual(self.scheduler.release_due(), [])
+
+        self.now += 3600 - 900 - 1
+        self.assertEqual(self.scheduler.release_due(), ["first", "later"])
+        self.publisher.send_scheduled_shippings.assert_called_with(
+            [("first", 1_003_599.0), ("later", 1_003_599.5)]
+        )
+        self.assertEqual(self.scheduler.get_stats()["deferred"], 1)
+
+    def test_failed_handoff_is_retried(self):
+        # Доставка, яку SQS не прийняла, залишається в купі для повтору
+        self.scheduler.schedule("later", self.due_in(3600))
+        self.publisher.send_scheduled_shippings.side_effect = lambda schedule: [None]
+        self.now += 3600
+        self.assertEqual(self.scheduler.release_due(), [])
+        self.assertEqual(self.scheduler.deferred_count(), 1)
+
+        self.publisher.send_scheduled_shippings.side_effect = lambda schedule: ["m"]
+        self.assertEqual(self.scheduler.release_due(), ["later"])
+        self.assertGreater(self.scheduler.get_stats()["handoff"]["max_latency"], 0)
+
+    def test_service_schedules_instead_of_publishing(self):
+        # Сервіс із планувальником не публікує доставку одразу
+        from datetime import datetime, timedelta, timezone
+
+        repository = MagicMock()
+        repository.create_shipping.return_value = "shipping-1"
+        publisher = MagicMock()
+        scheduler = MagicMock()
+        service = ShippingService(repository, publisher, scheduler=scheduler)
+        due_date = datetime.now(timezone.utc) + timedelta(hours=2)
+
+        service.create_shipping("Нова Пошта", ["p"], "order-1", due_date)
+
+        scheduler.schedule.assert_called_once_with("shipping-1", due_date)
+        publisher.send_new_shipping.assert_not_called()
+
+    def test_rejected_shipping_is_not_lost(self):
+        # Якщо SQS не прийняла доставку, сервіс повертає її в created і
+        # повідомляє про помилку
+        from datetime import datetime, timedelta, timezone
+
+        self.publisher.send_scheduled_shippings.side_effect = lambda schedule: [None]
+        with self.assertRaises(ShippingNotPublished):
+            self.scheduler.schedule("soon", self.due_in(60))
+
+        repository = MagicMock()
+        repository.create_shipping.return_value = "shipping-1"
+        scheduler = ShippingScheduler(self.publisher)
+        service = ShippingService(repository, MagicMock(), scheduler=scheduler)
+        with self.assertRaises(ShippingNotPublished):
+            service.create_shipping(
+                "Нова Пошта",
+                ["p"],
+                "order-1",
+                datetime.now(timezone.utc) + timedelta(minutes=1),
+            )
+        self.assertEqual(
+            repository.update_shipping_status.call_args.args[:2],
+            ("shipping-1", ShippingService.SHIPPING_CREATED),
+        )
+
+    def test_start_recovers_deferred_shippings(self):
+        # Після перезапуску планувальник відновлює відкладені доставки з таблиці
+        repository = MagicMock()
+        repository.iter_shippings_by_status.side_effect = lambda *args, **kwargs: iter(
+            [
+                {"shipping_id": "later", "due_ts": to_timestamp(self.due_in(3600))},
+                {"shipping_id": "soon", "due_ts": to_timestamp(self.due_in(60))},
+                {"shipping_id": "overdue", "due_ts": to_timestamp(self.due_in(-600))},
+            ]
+        )
+        scheduler = ShippingScheduler(
+            self.publisher, clock=lambda: self.now, repository=repository
+        )
+
+        scheduler.start()
+        scheduler.stop()
+        self.assertEqual(scheduler.deferred_count(), 1)
+        # прострочена за час простою доставка йде до обробників одразу
+        self.publisher.send_scheduled_shippings.assert_called_once_with(
+            [("soon", self.now + 59), ("overdue", self.now - 601)]
+        )
+        self.assertEqual(
+            repository.iter_shippings_by_status.call_args,
+            call(ShippingService.SHIPPING_IN_PROGRESS),
+        )
+
+        # уже відкладені доставки не дублюються
+        self.assertEqual(scheduler.recover(), 2)
+        self.assertEqual(scheduler.deferred_count(), 1)
+
+
+class TestShippingItems(unittest.TestCase):
+    def test_legacy_item_is_decoded(self):
+        # Старий формат запису читається у новому вигляді
+        item = decode_item(
+            {
+                "shipping_id": "s",
+                "product_ids": "first,second",
+                "created_date": "2024-05-01T10:00:00+00:00",
+                "due_date": "2024-05-02T10:00:00.250000+00:00",
+            }
+        )
+        self.assertEqual(item["product_ids"], ["first", "second"])
+        self.assertEqual(item["created_ts"], 1714557600000)
+        self.assertEqual(item["due_ts"], 1714644000250)
+        self.assertNotIn("due_date", item)
+        self.assertEqual(decode_item({"product_ids": ""})["product_ids"], [])
+
+    def test_product_ids_keep_commas(self):
+        # Назви продуктів з комами більше не ламаються
+        product_ids = ["Стіл, дубовий", "Стілець"]
+        item = decode_item(encode_product_ids(product_ids))
+        self.assertEqual(item["product_ids"], product_ids)
+
+    def test_large_product_lists_are_compressed(self):
+        # Великий список продуктів стискається і відновлюється без втрат
+        product_ids = [f"product-{i}" for i in range(500)]
+        encoded = encode_product_ids(product_ids)
+        self.assertNotIn("product_ids", encoded)
+        self.assertLess(len(encoded["product_ids_z"]), len(str(product_ids)) / 3)
+        self.assertEqual(decode_item(encoded)["product_ids"], product_ids)
+
+    def test_timestamps(self):
+        # Наївний час вважається UTC
+        from datetime import datetime, timedelta, timezone
+
+        moment = datetime(2024, 5, 1, 10, 0, 0, 999999)
+        self.assertEqual(
+            to_timestamp(moment), to_timestamp(moment.replace(tzinfo=timezone.utc))
+        )
+        kyiv = timezone(timedelta(hours=3))
+        self.assertEqual(
+            to_timestamp(datetime(2024, 5, 1, 13, tzinfo=kyiv)), 1714557600000
+        )
+
+
+class TestIdempotentShipping(unittest.TestCase):
+    def setUp(self):
+        from datetime import datetime, timedelta, timezone
+
+        self.repository = MagicMock()
+        self.repository.create_shipping_once.return_value = ("shipping-1", True)
+        self.publisher = MagicMock()
+        self.service = ShippingService(self.repository, self.publisher, idempotent=True)
+        self.due_date = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    def test_default_key_is_order_and_type(self):
+        # Без явного ключа сервіс бере замовлення і тип доставки
+        shipping_id = self.service.create_shipping(
+            "Нова Пошта", ["p1"], "order-1", self.due_date
+        )
+        self.assertEqual(shipping_id, "shipping-1")
+        self.assertEqual(
+            self.repository.create_shipping_once.call_args.args[0],
+            "order-1#Нова Пошта",
+        )
+        self.publisher.send_new_shipping.assert_called_once_with("shipping-1")
+
+    def test_repeated_request_hits_cache(self):
+        # Повторний запит з тим самим ключем не звертається до таблиці
+        for _ in range(3):
+            shipping_id = self.service.create_shipping(
+                "Нова Пошта", ["p1"], "order-1", self.due_date, idempotency_key="k"
+            )
+        self.assertEqual(shipping_id, "shipping-1")
+        self.repository.create_shipping_once.assert_called_once()
+        self.publisher.send_new_shipping.assert_called_once()
+
+    def test_duplicate_is_not_published_again(self):
+        # Дублікат уже опублікованої доставки не потрапляє в чергу вдруге
+        self.repository.create_shipping_once.return_value = ("shipping-1", False)
+        self.repository.update_shipping_status.side_effect = ShippingTransitionRejected(
+            "shipping-1", ShippingService.SHIPPING_IN_PROGRESS
+        )
+        self.repository.get_shipping.return_value = {
+            "shipping_status": ShippingService.SHIPPING_COMPLETED
+        }
+        for _ in range(2):
+            shipping_id = self.service.create_shipping(
+                "Нова Пошта", ["p1"], "order-1", self.due_date
+            )
+        self.assertEqual(shipping_id, "shipping-1")
+        self.publisher.send_new_shipping.assert_not_called()
+        self.repository.get_shipping.assert_called_once_with(
+            "shipping-1", consistent=True
+        )
+        self.repository.create_shipping_once.assert_called_once()
+
+    def test_duplicate_of_unfinished_attempt_is_not_cached(self):
+        # Поки інша спроба ще публікує доставку, ключ не кешується, а якщо
+        # вона відкотилася до created, дублікат публікує доставку сам
+        self.repository.create_shipping_once.return_value = ("shipping-1", False)
+        rejected = ShippingTransitionRejected(
+            "shipping-1", ShippingService.SHIPPING_IN_PROGRESS
+        )
+        self.repository.update_shipping_status.side_effect = rejected
+        self.repository.get_shipping.return_value = {
+            "shipping_status": ShippingService.SHIPPING_IN_PROGRESS
+        }
+        self.service.create_shipping("Нова Пошта", ["p1"], "order-1", self.due_date)
+        self.assertIsNone(self.service.idempotency_cache.get("order-1#Нова Пошта"))
+
+        self.repository.update_shipping_status.side_effect = [rejected, None]
+        self.repository.get_shipping.return_value = {
+            "shipping_status": ShippingService.SHIPPING_CREATED
+        }
+        self.service.create_shipping("Нова Пошта", ["p1"], "order-1", self.due_date)
+        self.publisher.send_new_shipping.assert_called_once_with("shipping-1")
+        self.assertEqual(
+            self.service.idempotency_cache.get("order-1#Нова Пошта"), "shipping-1"
+        )
+
+    def test_unpublished_duplicate_is_published(self):
+        # Якщо перша спроба не дійшла до публікації, дублікат її завершує
+        self.repository.create_shipping_once.return_value = ("shipping-1", False)
+        self.service.create_shipping("Нова Пошта", ["p1"], "order-1", self.due_date)
+        self.publisher.send_new_shipping.assert_called_once_with("shipping-1")
+
+    def test_not_idempotent_by_default(self):
+        # Без ключа і без idempotent=True поведінка не змінюється
+        service = ShippingService(self.repository, self.publisher)
+        self.repository.create_shipping.return_value = "shipping-2"
+        service.create_shipping("Нова Пошта", ["p1"], "order-1", self.due_date)
+        self.repository.create_shipping_once.assert_not_called()
+
+
+class TestLRUStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUStatusCache(max_size=2, ttl=10)
+
+    def test_get_returns_cached_status(self):
+        # Збережений статус повертається з кешу
+        self.cache.set("shipping-1", "in progress")
+        self.assertEqual(self.cache.get("shipping-1"), "in progress")
+        self.assertIsNone(self.cache.get("shipping-2"))
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_entries_expire_after_ttl(self):
+        # Запис зникає після закінчення TTL
+        with patch("services.cache.time.monotonic", return_value=100.0):
+            self.cache.set("shipping-1", "in progress")
+        with patch("services.cache.time.monotonic", return_value=109.0):
+            self.assertEqual(self.cache.get("shipping-1"), "in progress")
+        with patch("services.cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(self.cache.get("shipping-1"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # При переповненні витісняється найдавніше використаний запис
+        self.cache.set("shipping-1", "created")
+        self.cache.set("shipping-2", "created")
+        self.cache.get("shipping-1")
+        self.cache.set("shipping-3", "created")
+        self.assertEqual(self.cache.get("shipping-1"), "created")
+        self.assertIsNone(self.cache.get("shipping-2"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_invalidate_removes_entry(self):
+        # Інвалідація видаляє запис з кешу
+        self.cache.set("shipping-1", "created")
+        self.cache.invalidate("shipping-1")
+        self.assertIsNone(self.cache.get("shipping-1"))
+
 
 if __name__ == "__main__":
     unittest.main()